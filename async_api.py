@@ -0,0 +1,136 @@
+import asyncio
+import concurrent.futures
+import functools
+
+import project
+
+'''
+ASYNC API
+
+Usage (inside an event loop):
+    async with AsyncProject() as api:
+        result = await api.release_title(1)
+
+The CLI is not a wrapper around this API: both sit on the same synchronous
+core in project.py (the *_rows functions and the write functions), which the
+CLI calls directly and this module runs on worker threads. mysql.connector has
+no asyncio driver, so the blocking calls stay in one place.
+'''
+
+# Column names of the rows each read returns, in query order
+COLUMNS = {
+    'users_by_genre': ('uid', 'nickname'),
+    'get_releases_reviewed': ('rid', 'genre', 'title'),
+    'get_popular_releases': ('rid', 'title', 'total'),
+    'release_title': ('rid', 'release_title', 'genre', 'video_title', 'ep_num', 'length'),
+    'get_active_viewers': ('uid', 'first', 'last'),
+    'videos_reviewed_count': ('rid', 'ep_num', 'title', 'length', 'viewer_count'),
+}
+
+
+def run_read(name, rows_function, *args):
+    # Runs in a worker thread: {'ok': True, 'rows': [{column: value}]} or {'ok': False, 'error': message}
+    # connect() prints and exits on connection errors; here that only fails the call
+    with project.capture_output():
+        try:
+            rows = list(rows_function(*args))
+        except (Exception, SystemExit) as error:
+            return {'ok': False, 'rows': [], 'error': str(error)}
+
+    return {'ok': True, 'rows': [dict(zip(COLUMNS[name], row)) for row in rows]}
+
+
+def run_write(function, *args):
+    # Runs in a worker thread: {'ok': bool, 'result': what function returned, 'messages': lines it printed}
+    with project.capture_output() as output:
+        try:
+            result = function(*args)
+        except (Exception, SystemExit) as error:
+            print(f"Error in {function.__name__}: {error}")
+            result = False
+
+    ok = all(result) if isinstance(result, list) else bool(result)
+    return {'ok': ok, 'result': result, 'messages': output.getvalue().splitlines()}
+
+
+class AsyncProject:
+    # The operations of project.py, insert_viewer through videos_reviewed_count, as coroutines returning
+    # structured results instead of printing
+    # Each call runs the blocking operation on a worker thread over the shared connection pool, at most
+    # max_in_flight at a time (by default one per pooled connection; every operation holds a single
+    # connection, delete_viewers included, so calls never wait on the pool)
+    # Reads go straight to the database rather than through the CLI's QUERY_CACHE; writes still invalidate it
+
+    def __init__(self, max_in_flight=project.POOL_SIZE, executor=None):
+        self.max_in_flight = max_in_flight
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._writer = project.WriteMarker()     # Read-your-writes across this object's calls
+        self._own_executor = executor is None
+        self._executor = executor or concurrent.futures.ThreadPoolExecutor(max_in_flight, thread_name_prefix='project-async')
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        # Waits for running calls and stops the executor if this object made it
+        if self._own_executor:
+            await asyncio.get_running_loop().run_in_executor(None, functools.partial(self._executor.shutdown, wait=True))
+
+    async def _run(self, function, *args):
+        async with self._semaphore:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(self._call, function, *args))
+
+    def _call(self, function, *args):
+        # Whatever worker thread runs it, a call's commits and replica reads count as this object's
+        with project.writes_as(self._writer):
+            return function(*args)
+
+    # Writes
+
+    async def insert_viewer(self, uid, email, nickname, street, city, state, zip, genres, joined_date, first, last, subscription):
+        return await self._run(run_write, project.insert_viewer, uid, email, nickname, street, city, state, zip,
+                               genres, joined_date, first, last, subscription)
+
+    async def add_genre(self, uid, genre):
+        return await self._run(run_write, project.add_genre, uid, genre)
+
+    async def delete_viewer(self, uid):
+        return await self._run(run_write, project.delete_viewer, uid)
+
+    async def delete_viewers(self, uids, chunk_size=project.DELETE_CHUNK_SIZE, rows_per_sec=project.DELETE_ROWS_PER_SEC):
+        return await self._run(run_write, project.delete_viewers, list(uids), chunk_size, rows_per_sec)
+
+    async def insert_movie(self, rid, website_url):
+        return await self._run(run_write, project.insert_movie, rid, website_url)
+
+    async def insert_session(self, sid, uid, rid, ep_num, initiate_at, leave_at, quality, device):
+        return await self._run(run_write, project.insert_session, sid, uid, rid, ep_num, initiate_at, leave_at, quality, device)
+
+    async def insert_sessions(self, rows, batch_size=project.IMPORT_BATCH_SIZE):
+        return await self._run(run_write, project.insert_sessions, list(rows), batch_size)
+
+    async def update_release(self, rid, title):
+        return await self._run(run_write, project.update_release, rid, title)
+
+    # Reads
+
+    async def users_by_genre(self, genre):
+        return await self._run(run_read, 'users_by_genre', project.users_by_genre_rows, genre)
+
+    async def get_releases_reviewed(self, uid, limit=None, after=None):
+        return await self._run(run_read, 'get_releases_reviewed', project.releases_reviewed_rows, uid, limit, after)
+
+    async def get_popular_releases(self, k, after=None):
+        return await self._run(run_read, 'get_popular_releases', project.popular_releases_rows, k, after)
+
+    async def release_title(self, sid):
+        return await self._run(run_read, 'release_title', project.release_title_rows, sid)
+
+    async def get_active_viewers(self, N, start_date, end_date, limit=None, after=None):
+        return await self._run(run_read, 'get_active_viewers', project.active_viewers_rows, N, start_date, end_date, limit, after)
+
+    async def videos_reviewed_count(self, rid):
+        return await self._run(run_read, 'videos_reviewed_count', project.videos_viewed_rows, rid)
@@ -0,0 +1,344 @@
+import subprocess
+import statistics
+import sys
+import os
+import time
+import threading
+import json
+import random
+import datetime
+import contextlib
+import csv
+import tempfile
+
+import client
+
+'''
+BENCHMARKS
+
+Usage: python3 bench.py <benchmark> [param1] [param2] ...
+'''
+
+PROJECT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'project.py')
+CLIENT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'client.py')
+
+
+def percentile(ordered, fraction):
+    # Nearest-rank percentile of an already sorted list
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(name, timings):
+    # Prints mean and percentile latencies (milliseconds) for a list of timings in seconds
+    ordered = sorted(timings)
+    p50 = percentile(ordered, 0.5)
+    p95 = percentile(ordered, 0.95)
+    print(f"{name}: n={len(ordered)} mean={statistics.mean(ordered) * 1000:.2f}ms "
+          f"p50={p50 * 1000:.2f}ms p95={p95 * 1000:.2f}ms")
+
+
+def time_process(command):
+    # Runs a command once and returns (elapsed seconds, stdout text)
+    start = time.perf_counter()
+    result = subprocess.run(command, capture_output=True, text=True)
+    return time.perf_counter() - start, result.stdout
+
+
+def bench_client(iterations, args):
+    # Compares "project.py <args>" with "client.py <args>" against a running "project.py serve"
+    # Both paths must print the same output for every iteration, so use read-only commands
+
+    iterations = int(iterations)
+    direct_times, client_times, socket_times = [], [], []
+    mismatches = 0
+
+    for _ in range(iterations):
+        elapsed, direct_output = time_process([sys.executable, PROJECT] + args)
+        direct_times.append(elapsed)
+
+        elapsed, client_output = time_process([sys.executable, '-S', CLIENT] + args)
+        client_times.append(elapsed)
+
+        # The socket round trip alone, without interpreter startup
+        start = time.perf_counter()
+        socket_output = client.send_command(args)
+        socket_times.append(time.perf_counter() - start)
+
+        if not (direct_output == client_output == socket_output):
+            mismatches += 1
+
+    summarize("direct project.py", direct_times)
+    summarize("client.py process", client_times)
+    summarize("client socket call", socket_times)
+    print(f"output mismatches: {mismatches}/{iterations}")
+    return mismatches == 0
+
+
+def run_measured(command):
+    # Runs a command, counting its output lines without keeping them
+    # Returns (elapsed seconds, output lines, peak RSS of the child in MB)
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+
+    lines = 0
+    for chunk in iter(lambda: process.stdout.read(65536), b''):
+        lines += chunk.count(b'\n')
+    process.stdout.close()
+
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return time.perf_counter() - start, lines, usage.ru_maxrss / 1024
+
+
+def bench_memory(args):
+    # Peak RSS of one listing command (e.g. activeViewer 1 2024-01-01 2025-12-31)
+    # Run it over growing ranges: with streaming output the peak should stay flat as lines grow
+    elapsed, lines, peak = run_measured([sys.executable, PROJECT] + args)
+    print(f"{' '.join(args)}: {lines} lines in {elapsed:.2f}s, peak RSS {peak:.1f} MB")
+    return True
+
+
+def bench_writers(max_writers, per_writer, first_sid, uid, rid, ep_num):
+    # Session insert throughput as writer threads grow (1, 2, 4, ... max_writers), comparing one
+    # commit per insert_session call with WriteCoalescer group commits
+    # Inserts new sessions for an existing viewer/video, using sids from first_sid upwards
+    import project
+
+    max_writers, per_writer = int(max_writers), int(per_writer)
+    next_sid = [int(first_sid)]
+
+    def sids(count):
+        start = next_sid[0]
+        next_sid[0] += count
+        return range(start, start + count)
+
+    def session_args(sid):
+        return (sid, uid, rid, ep_num, '2025-01-01 10:00:00', '2025-01-01 11:00:00', '720p', 'desktop')
+
+    def run(writers, write):
+        ranges = [sids(per_writer) for _ in range(writers)]
+        threads = [threading.Thread(target=lambda r=r: [write(sid) for sid in r]) for r in ranges]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return writers * per_writer / (time.perf_counter() - start)
+
+    writers = 1
+    while writers <= max_writers:
+        project.get_pool().max_size = writers + 1
+        direct = run(writers, lambda sid: project.insert_session(*session_args(sid)))
+
+        coalescer = project.WriteCoalescer()
+        grouped = run(writers, lambda sid: coalescer.submit(project.insert_session, *session_args(sid)).result())
+        coalescer.close()
+
+        print(f"{writers} writers: direct {direct:.0f} rows/sec, group commit {grouped:.0f} rows/sec")
+        writers *= 2
+
+    return True
+
+
+def bench_prepared(iterations, sid):
+    # Statements per second over one connection sending the registry's queries as text (COM_QUERY)
+    # versus as prepared statements (binary protocol), using session sid and its viewer and video
+    # The inserts are rolled back at the end
+    import project
+
+    iterations = int(iterations)
+    connection = project.get_pool().acquire()
+    lookup = connection.cursor()
+    lookup.execute("SELECT uid, rid, ep_num, initiate_at, leave_at, quality, device FROM Sessions WHERE sid = %s", (sid,))
+    session = lookup.fetchone()
+    lookup.close()
+    if session is None:
+        print(f"No session {sid}")
+        connection.close()
+        return False
+
+    uid, rid, ep_num = session[:3]
+    start_sid = 2 ** 31 - 1 - iterations    # Far above the generated sids
+    statements = [
+        ('releaseTitle', project.RELEASE_TITLE, lambda i: (sid,)),
+        ('listReleases', project.GET_RELEASES_REVIEWED, lambda i: (uid,)),
+        ('activeViewer', project.GET_ACTIVE_VIEWERS, lambda i: (session[3], session[4], 1)),
+        ('insertSession', project.INSERT_SESSION, lambda i: (start_sid + i, uid, rid, ep_num) + tuple(session[3:])),
+    ]
+
+    try:
+        for name, statement, params in statements:
+            rates = {}
+            for protocol, cursor in (('text', connection.cursor()), ('binary', connection.cursor(prepared=True))):
+                start = time.perf_counter()
+                for i in range(iterations):
+                    cursor.execute(statement, params(i))
+                    if cursor.with_rows:
+                        cursor.fetchall()
+                rates[protocol] = iterations / (time.perf_counter() - start)
+                cursor.close()
+                connection.rollback()
+
+            print(f"{name}: text {rates['text']:.0f}/sec, binary {rates['binary']:.0f}/sec "
+                  f"({rates['binary'] / rates['text']:.2f}x)")
+    finally:
+        connection.rollback()
+        connection.close()
+
+    return True
+
+
+def suite_plan(folder, manifest, runs, work_folder):
+    # The commands bench_suite runs, in order: (command, number of runs, function of the run number
+    # returning (params, options)); files some commands read are written to work_folder
+    import project
+
+    rng = random.Random(manifest['seed'])
+    viewers = range(manifest['first_viewer'], manifest['last_uid'] + 1)
+    new_uid = manifest['last_uid'] + 1
+    new_sid = manifest['sessions'] + 1
+    deletes = max(1, runs // 2)
+
+    with open(os.path.join(folder, 'series.csv'), newline='') as file:
+        series = [row[0] for row in csv.reader(file)][1:] or ['1']
+
+    # One month of activity, for activeViewer
+    start = datetime.datetime.fromisoformat(manifest['activity_start'])
+    month = [str(start), str(start + datetime.timedelta(days=30))]
+
+    def session(sid):
+        return [sid, rng.choice(viewers), 1, 1, '2025-06-01 10:00:00', '2025-06-01 11:00:00', '720p', 'desktop']
+
+    sessions_path = os.path.join(work_folder, 'sessions.csv')
+    with open(sessions_path, 'w', newline='') as file:
+        csv.writer(file, lineterminator='\n').writerows(session(new_sid + runs + i) for i in range(1000))
+
+    batch_path = os.path.join(work_folder, 'batch.txt')
+    with open(batch_path, 'w') as file:
+        for _ in range(100):
+            file.write(f"listReleases {rng.choice(viewers)}\nvideosViewed {rng.randint(1, manifest['releases'])}\n")
+
+    return [
+        ('import', 1, lambda i: ([folder], {})),
+        ('importDelta', 1, lambda i: ([folder], {})),
+        ('explain', 1, lambda i: ([], {})),
+        ('replicaStatus', 1 if project.REPLICA_CONFIGS else 0, lambda i: ([], {})),
+        ('rebuildAggregates', 1, lambda i: ([], {})),
+        ('maintainPartitions', 1 if project.SCHEMA_OPTIONS['partition_sessions'] else 0, lambda i: ([], {})),
+        ('listReleases', runs, lambda i: ([rng.choice(viewers)], {})),
+        ('popularRelease', runs, lambda i: ([10], {})),
+        ('releaseTitle', runs, lambda i: ([rng.randint(1, manifest['sessions'])], {})),
+        ('activeViewer', runs, lambda i: ([2] + month, {})),
+        ('videosViewed', runs, lambda i: ([rng.randint(1, manifest['releases'])], {})),
+        ('usersByGenre', runs, lambda i: (['comedy'], {})),
+        ('insertViewer', runs, lambda i: ([new_uid + i, f"bench{new_uid + i}@example.org", f"bench{new_uid + i}",
+                                           '1 Main Street', 'Irvine', 'California', '92697', 'Comedy;Drama',
+                                           '2025-01-01', 'Bench', 'User', 'monthly'], {})),
+        ('addGenre', runs, lambda i: ([new_uid + i, 'Horror'], {})),
+        ('insertMovie', min(runs, len(series)), lambda i: ([series[i], f"https://www.bench{series[i]}.com/"], {})),
+        ('updateRelease', runs, lambda i: ([i % manifest['releases'] + 1, f"Title {i % manifest['releases'] + 1}"], {})),
+        ('insertSession', runs, lambda i: (session(new_sid + i), {})),
+        ('insertSessions', 1, lambda i: ([sessions_path], {})),
+        ('batch', 1, lambda i: ([batch_path], {})),
+        ('cacheStats', runs, lambda i: ([], {})),
+        ('profileStats', runs if project.PROFILE_HISTOGRAM in project.PROFILE_HOOKS else 0, lambda i: ([], {})),
+        ('deleteViewer', deletes, lambda i: ([new_uid + i], {})),
+        ('deleteViewers', 1, lambda i: ([str(uid) for uid in range(new_uid + deletes, new_uid + runs)] or [str(new_uid)], {})),
+    ]
+
+
+def bench_suite(folder, runs=100, output='bench_results.json'):
+    # Runs every command of project.py's command table against the local database, starting with an
+    # import of folder (made by generate_data.py), and writes latency percentiles and throughput to output
+    # Commands run in this process with their output discarded, so times leave out interpreter startup
+    import project
+
+    with open(os.path.join(folder, 'manifest.json')) as file:
+        manifest = json.load(file)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_folder:
+        plan = suite_plan(folder, manifest, int(runs), work_folder)
+
+        for command, count, arguments in plan:
+            if not count:
+                continue
+
+            timings, failures = [], 0
+            for i in range(count):
+                params, options = arguments(i)
+                with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+                    start = time.perf_counter()
+                    result = project.dispatch(command, [str(param) for param in params], options)
+                    timings.append(time.perf_counter() - start)
+                if result is False or (isinstance(result, list) and not all(result)):
+                    failures += 1
+
+            ordered = sorted(timings)
+            results[command] = {
+                'runs': count,
+                'failures': failures,
+                'mean_ms': statistics.mean(ordered) * 1000,
+                'p50_ms': percentile(ordered, 0.5) * 1000,
+                'p95_ms': percentile(ordered, 0.95) * 1000,
+                'p99_ms': percentile(ordered, 0.99) * 1000,
+                'max_ms': ordered[-1] * 1000,
+                'per_sec': count / sum(ordered) if sum(ordered) > 0 else None,
+            }
+            summarize(command, timings)
+
+    # Rows per second for the loads, counting the data lines of the files they read
+    rows = 0
+    for file_name in set(project.TABLE_CSV.values()):
+        with open(os.path.join(folder, file_name), 'rb') as file:
+            rows += max(0, sum(1 for _ in file) - 1)
+    for command in ('import', 'importDelta'):
+        results[command]['rows_per_sec'] = rows / (results[command]['mean_ms'] / 1000)
+
+    # serve does not return, so it is timed by the 'client' benchmark instead
+    skipped = sorted(set(project.command_table([], {})) - {command for command, _, _ in plan} - {'serve'})
+    if skipped:
+        print(f"not benchmarked: {', '.join(skipped)}")
+
+    report = {
+        'started': datetime.datetime.now().isoformat(timespec='seconds'),
+        'manifest': manifest,
+        'schema_options': project.SCHEMA_OPTIONS,
+        'query_cache': project.QUERY_CACHE_ENABLED,
+        'commands': results,
+        'not_benchmarked': skipped,
+    }
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+
+    return not skipped and not any(result['failures'] for result in results.values())
+
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Please use the syntax: python3 bench.py <benchmark> [param1] [param2] ...")
+        return
+
+    benchmark = sys.argv[1]
+    params = sys.argv[2:]
+
+    benchmarks = {
+        'client': lambda: bench_client(params[0], params[1:]),
+        'memory': lambda: bench_memory(params),
+        'writers': lambda: bench_writers(*params[:6]),
+        'suite': lambda: bench_suite(*params[:3]),
+        'prepared': lambda: bench_prepared(params[0], params[1]),
+    }
+
+    if benchmark in benchmarks:
+        result = benchmarks[benchmark]()
+        if isinstance(result, bool):
+            print("Success" if result else "Fail")
+    else:
+        print(f"Unknown benchmark entered: {benchmark}")
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import socket
+import sys
+import json
+import io
+import os
+
+'''
+Thin client for "python3 project.py serve"
+
+Forwards a command to the running server over a Unix socket and prints what
+the command printed. Deliberately avoids importing project.py or
+mysql.connector so each call only pays for interpreter startup.
+
+Usage: python3 client.py <function> [param1] [param2] ...
+'''
+
+# Must match the socket the server was started with
+SOCKET_PATH = os.environ.get('PROJECT_SOCKET', '/tmp/cs122a_project.sock')
+
+
+def stream_command(args, output, socket_path=SOCKET_PATH):
+    # Sends one command (function name followed by its parameters) and writes its output to the binary
+    # stream output as it arrives, so long listings start printing before the command is done
+    # The working directory goes along so the server finds relative paths where this process would
+    request = {'cwd': os.getcwd(), 'args': args}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(request).encode() + b'\n')
+        sock.shutdown(socket.SHUT_WR)
+
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            output.write(chunk)
+            output.flush()
+
+
+def send_command(args, socket_path=SOCKET_PATH):
+    # Sends one command and returns its whole output text
+    output = io.BytesIO()
+    stream_command(args, output, socket_path)
+    return output.getvalue().decode()
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Please use the syntax: python3 client.py <function> [param1] [param2] ...")
+        return
+
+    try:
+        stream_command(sys.argv[1:], sys.stdout.buffer)
+    except OSError as error:
+        print(f"Error: could not reach server at {SOCKET_PATH}: {error}")
+        sys.exit(1)
+
+
+
+if __name__ == "__main__":
+    main()
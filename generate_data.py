@@ -0,0 +1,183 @@
+import csv
+import datetime
+import json
+import os
+import random
+import sys
+
+'''
+SYNTHETIC DATA
+
+Usage: python3 generate_data.py <folder> <sessions> [--seed N] [--skew S]
+'''
+
+# Same headers as the files in test_data/
+HEADERS = {
+    "users.csv": ['uid', 'email', 'joined_date', 'nickname', 'street', 'city', 'state', 'zip', 'genres'],
+    "producers.csv": ['uid', 'bio', 'company'],
+    "viewers.csv": ['uid', 'subscription', 'first_name', 'last_name'],
+    "releases.csv": ['rid', 'producer_uid', 'title', 'genre', 'release_date'],
+    "movies.csv": ['rid', 'website_url'],
+    "series.csv": ['rid', 'introduction'],
+    "videos.csv": ['rid', 'ep_num', 'title', 'length'],
+    "sessions.csv": ['sid', 'uid', 'rid', 'ep_num', 'initiate_at', 'leave_at', 'quality', 'device'],
+    "reviews.csv": ['rvid', 'uid', 'rid', 'rating', 'body', 'posted_at'],
+}
+
+# Table sizes relative to the number of sessions (at least the minimum)
+SESSIONS_PER_VIEWER = 20
+SESSIONS_PER_RELEASE = 200
+SESSIONS_PER_REVIEW = 10
+PRODUCERS_PER_RELEASE = 0.2
+SERIES_SHARE = 0.4              # The rest of the releases are movies, with one video each
+MAX_EPISODES = 24
+MIN_ROWS = 10
+
+# Sessions and reviews fall in this range; activeViewer and maintainPartitions ranges should match
+ACTIVITY_START = datetime.datetime(2024, 1, 1)
+ACTIVITY_DAYS = 730
+
+GENRES = ['Action', 'Comedy', 'Documentary', 'Horror', 'Musical', 'Romance', 'Drama', 'Sci-Fi', 'Animation', 'Thriller']
+SUBSCRIPTIONS = ['free', 'monthly', 'yearly']
+QUALITIES = ['480p', '720p', '1080p']
+DEVICES = ['mobile', 'desktop']
+FIRST_NAMES = ['Harry', 'Sean', 'Sara', 'Olivia', 'Maria', 'James', 'Wei', 'Aisha', 'Diego', 'Yuki']
+LAST_NAMES = ['Carpenter', 'Gonzales', 'Ramirez', 'Cooper', 'Nguyen', 'Smith', 'Khan', 'Rossi', 'Kim', 'Okafor']
+STATES = ['California', 'Montana', 'South Dakota', 'Texas', 'New York', 'Ohio', 'Oregon', 'Florida']
+
+
+def table_sizes(sessions):
+    # Row counts of each generated table for a number of sessions
+    releases = max(MIN_ROWS, sessions // SESSIONS_PER_RELEASE)
+    return {
+        'sessions': sessions,
+        'viewers': max(MIN_ROWS, sessions // SESSIONS_PER_VIEWER),
+        'releases': releases,
+        'producers': max(1, int(releases * PRODUCERS_PER_RELEASE)),
+        'reviews': max(MIN_ROWS, sessions // SESSIONS_PER_REVIEW),
+    }
+
+
+def zipf_rank(rng, n, skew):
+    # Draws a rank in 1..n with probability about proportional to 1 / rank ** skew
+    # Inverts the CDF of the continuous power law, so no per-rank table is needed for large n
+    u = rng.random()
+    if abs(skew - 1) < 1e-9:
+        rank = n ** u
+    else:
+        rank = ((n ** (1 - skew) - 1) * u + 1) ** (1 / (1 - skew))
+    return min(n, max(1, int(rank)))
+
+
+def episode_count(seed, rid, series_rids):
+    # Videos of a release: one for a movie, a repeatable 2..MAX_EPISODES for a series
+    if rid not in series_rids:
+        return 1
+    return random.Random(seed * 1000003 + rid).randint(2, MAX_EPISODES)
+
+
+def timestamp(rng):
+    # A random time in the activity range, to the second
+    return ACTIVITY_START + datetime.timedelta(seconds=rng.randrange(ACTIVITY_DAYS * 86400))
+
+
+def open_writer(folder, file_name):
+    file = open(os.path.join(folder, file_name), 'w', newline='')
+    writer = csv.writer(file, lineterminator='\n')
+    writer.writerow(HEADERS[file_name])
+    return file, writer
+
+
+def generate(folder, sessions, seed=1, skew=1.1):
+    # Writes the nine .csv files for `sessions` sessions into folder, row by row
+    # The same arguments always produce the same files; a manifest.json records the sizes and id ranges
+    sizes = table_sizes(sessions)
+    producers, viewers, releases = sizes['producers'], sizes['viewers'], sizes['releases']
+    os.makedirs(folder, exist_ok=True)
+
+    # Producers are uids 1..producers, viewers the uids after them
+    first_viewer = producers + 1
+    last_uid = producers + viewers
+
+    rng = random.Random(seed)
+    users_file, users = open_writer(folder, "users.csv")
+    for uid in range(1, last_uid + 1):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        joined = datetime.date(2018, 1, 1) + datetime.timedelta(days=rng.randrange(2190))
+        genres = ';'.join(rng.sample(GENRES, rng.randint(1, 3)))
+        users.writerow([uid, f"{first.lower()}{uid}@example.org", joined, f"{first.lower()}{last.lower()}{uid}",
+                        f"{rng.randint(1, 99999)} Main Street", f"City {rng.randint(1, 500)}", rng.choice(STATES),
+                        f"{rng.randint(10000, 99999)}", genres])
+    users_file.close()
+
+    producers_file, producer_rows = open_writer(folder, "producers.csv")
+    for uid in range(1, producers + 1):
+        producer_rows.writerow([uid, f"Producer with {rng.randint(1, 40)} years in {rng.choice(GENRES)}.",
+                                f"{rng.choice(LAST_NAMES)} Studios {uid}"])
+    producers_file.close()
+
+    viewers_file, viewer_rows = open_writer(folder, "viewers.csv")
+    for uid in range(first_viewer, last_uid + 1):
+        viewer_rows.writerow([uid, rng.choice(SUBSCRIPTIONS), rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)])
+    viewers_file.close()
+
+    # Releases, split into movies and series, each with its videos
+    series_rids = set(random.Random(seed + 1).sample(range(1, releases + 1), int(releases * SERIES_SHARE)))
+    rng = random.Random(seed + 2)
+    files = [open_writer(folder, name) for name in ("releases.csv", "movies.csv", "series.csv", "videos.csv")]
+    release_rows, movie_rows, series_rows, video_rows = [writer for _, writer in files]
+    for rid in range(1, releases + 1):
+        release_rows.writerow([rid, rng.randint(1, producers), f"Title {rid}", rng.choice(GENRES),
+                               datetime.date(1990, 1, 1) + datetime.timedelta(days=rng.randrange(12775))])
+        if rid in series_rids:
+            series_rows.writerow([rid, f"Series {rid} in {rng.randint(1, 10)} seasons."])
+        else:
+            movie_rows.writerow([rid, f"https://www.title{rid}.com/"])
+        for ep_num in range(1, episode_count(seed, rid, series_rids) + 1):
+            video_rows.writerow([rid, ep_num, f"Episode {ep_num}", rng.randint(20, 180)])
+    for file, _ in files:
+        file.close()
+
+    # Sessions and reviews favour popular viewers and releases (low ranks) with a Zipf skew
+    rng = random.Random(seed + 3)
+    sessions_file, session_rows = open_writer(folder, "sessions.csv")
+    for sid in range(1, sessions + 1):
+        rid = zipf_rank(rng, releases, skew)
+        start = timestamp(rng)
+        session_rows.writerow([sid, first_viewer - 1 + zipf_rank(rng, viewers, skew), rid,
+                               rng.randint(1, episode_count(seed, rid, series_rids)),
+                               start, start + datetime.timedelta(minutes=rng.randint(1, 180)),
+                               rng.choice(QUALITIES), rng.choice(DEVICES)])
+    sessions_file.close()
+
+    rng = random.Random(seed + 4)
+    reviews_file, review_rows = open_writer(folder, "reviews.csv")
+    for rvid in range(1, sizes['reviews'] + 1):
+        review_rows.writerow([rvid, first_viewer - 1 + zipf_rank(rng, viewers, skew), zipf_rank(rng, releases, skew),
+                              rng.randint(0, 10) / 2, f"Review {rvid}.", timestamp(rng)])
+    reviews_file.close()
+
+    manifest = dict(sizes, seed=seed, skew=skew, first_viewer=first_viewer, last_uid=last_uid,
+                    series=len(series_rids), activity_start=str(ACTIVITY_START), activity_days=ACTIVITY_DAYS)
+    with open(os.path.join(folder, 'manifest.json'), 'w') as file:
+        json.dump(manifest, file, indent=2)
+
+    return manifest
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Please use the syntax: python3 generate_data.py <folder> <sessions> [--seed N] [--skew S]")
+        return
+
+    args = sys.argv[1:]
+    options = {args[i][2:]: args[i + 1] for i in range(len(args) - 1) if args[i].startswith('--')}
+    folder, sessions = args[0], int(args[1])
+
+    manifest = generate(folder, sessions, int(options.get('seed', 1)), float(options.get('skew', 1.1)))
+    print(json.dumps(manifest))
+
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,29 @@
 import mysql.connector
+from mysql.connector import errorcode
 import sys
 import csv
 import os
+import time
+import threading
+import contextlib
+import shlex
+import re
+import concurrent.futures
+import queue
+import datetime
+import math
+import collections
+import functools
+import multiprocessing
+import io
+import json
+import socketserver
+import tempfile
+import shutil
+import weakref
+import itertools
+
+from client import SOCKET_PATH
 
 '''
 CONNECTING
@@ -12,141 +34,2072 @@ DB_CONFIG = {
     'user': 'test',
     'password': 'password',
     'database': 'cs122a',
+    'allow_local_infile': False,    # Only the import connection may send client files (IMPORT_DB_CONFIG)
 }
 
-def connect():
+# Connection used by import_data, the one place LOAD DATA LOCAL INFILE is sent
+IMPORT_DB_CONFIG = {**DB_CONFIG, 'allow_local_infile': True}
+
+# Optional derived tables kept in sync with the base tables (see DERIVED_TABLES)
+SCHEMA_OPTIONS = {
+    'review_counts': False,     # ReleaseReviewCounts: per-release review totals for popularRelease
+    'session_rollup': False,    # SessionDaily: per-viewer, per-day session counts for activeViewer
+    'episode_viewers': None,    # videosViewed from 'exact' EpisodeViewers or an 'hll' EpisodeViewerSketch
+    'partition_sessions': False,    # Sessions RANGE-partitioned by initiate_at month (see maintainPartitions)
+}
+
+# First monthly Sessions partition (older sessions share p_before) and months created ahead of the current one
+SESSION_PARTITION_START = datetime.date(2024, 1, 1)
+SESSION_PARTITIONS_AHEAD = 3
+
+# HyperLogLog registers per episode are 2 ** HLL_PRECISION (standard error about 1.04 / sqrt(registers))
+# Changing it requires rebuildAggregates
+HLL_PRECISION = 10
+
+# Number of CSV rows sent per multi-row INSERT during import
+IMPORT_BATCH_SIZE = 5000
+
+# Checkpoint file used by resumable imports (import --commit-every N)
+IMPORT_STATE_FILE = '.import_state.json'
+
+# Rows rejected by trusted imports (import --trusted yes), with the file, line and reason
+IMPORT_REJECT_FILE = 'import_rejects.csv'
+
+# Read-through cache for releaseTitle, listReleases and videosViewed (see QueryCache)
+# Off by default: a one-shot command would only pay for it. serve turns it on (unless --cache no)
+# Writes made by other processes or directly in the database are only picked up when entries expire
+QUERY_CACHE_ENABLED = False
+QUERY_CACHE_SIZE = 1024             # Maximum number of cached results
+QUERY_CACHE_TTL = 5                 # Seconds a result is served before it is read again
+QUERY_CACHE_MAX_CHARS = 65536       # Larger results are streamed but not cached
+
+# WriteCoalescer flushes after this many queued writes or this many seconds
+GROUP_COMMIT_ROWS = 200
+GROUP_COMMIT_INTERVAL = 0.005
+
+# Number of rows fetched and written at a time by the listing commands
+STREAM_CHUNK_SIZE = 1000
+
+# deleteViewers removes dependent rows this many per transaction, at no more than this many rows a second (0: no limit)
+DELETE_CHUNK_SIZE = 1000
+DELETE_ROWS_PER_SEC = 5000
+
+# Per-command profiles as JSON lines, off unless set: a file path or '-' for stderr (or pass --profile)
+PROFILE_PATH = os.environ.get('PROJECT_PROFILE')
+
+# Send the hot queries (see prepared_cursor) as server-side prepared statements over the binary protocol
+PREPARED_STATEMENTS = True
+
+# Connection pool settings
+POOL_SIZE = 5               # Maximum number of open connections
+POOL_IDLE_TIMEOUT = 300     # Seconds an unused connection is kept before being closed
+POOL_CHECK_AFTER = 30       # Seconds idle after which a connection is pinged before reuse
+POOL_WAIT_TIMEOUT = 30      # Seconds to wait for a free connection when the pool is full
+
+
+def replica_addresses(text):
+    # Parses "host[:port],..." (port 3306 by default) into replica settings; bad entries are reported and skipped
+    configs = []
+    for address in text.split(','):
+        address = address.strip()
+        if not address:
+            continue
+        host, _, port = address.partition(':')
+        if not host or (port and not port.isdigit()):
+            print(f"Ignoring replica address {address!r}, expected host or host:port", file=sys.stderr)
+            continue
+        configs.append({'host': host, 'port': int(port or 3306)})
+    return configs
+
+
+# Read replicas for the query commands (see replica_connection): settings merged over DB_CONFIG, e.g.
+# {'host': '127.0.0.1', 'port': 3307}, or PROJECT_REPLICAS="host[:port],..." in the environment
+# Reading the lag needs the REPLICATION CLIENT privilege on each replica
+REPLICA_CONFIGS = replica_addresses(os.environ.get('PROJECT_REPLICAS', ''))
+REPLICA_MAX_LAG = 5         # Seconds behind the primary (Seconds_Behind_Source) past which a replica gets no reads
+REPLICA_LAG_CHECK = 2       # Seconds a lag reading is trusted before it is read again
+
+
+class ConnectionPool:
+    # Keeps up to max_size open connections to one server and lends them out
+    # Idle connections are closed after idle_timeout and pinged before reuse after check_after
+
+    def __init__(self, config, max_size=POOL_SIZE, idle_timeout=POOL_IDLE_TIMEOUT,
+                 check_after=POOL_CHECK_AFTER, wait_timeout=POOL_WAIT_TIMEOUT):
+        self.config = config
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self.wait_timeout = wait_timeout
+
+        self._idle = []         # (connection, returned_at), most recently returned last
+        self._in_use = 0
+        self._condition = threading.Condition()
+        self._pid = os.getpid()
+
+    def acquire(self):
+        # Returns a PooledConnection, reusing an idle connection when one is available
+        deadline = time.monotonic() + self.wait_timeout
+
+        with self._condition:
+            self._check_fork()
+            while True:
+                self._evict_idle()
+                if self._idle:
+                    connection, returned_at = self._idle.pop()
+                    break
+                if self._in_use < self.max_size:
+                    connection, returned_at = None, None
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise mysql.connector.errors.PoolError("Connection pool exhausted")
+                self._condition.wait(remaining)
+
+            self._in_use += 1
+
+        # Network round trips happen outside the lock
+        try:
+            if connection is not None and not self._healthy(connection, returned_at):
+                self._disconnect(connection)
+                connection = None
+            if connection is None:
+                connection = mysql.connector.connect(**self.config)
+        except Exception:
+            with self._condition:
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+
+        return PooledConnection(self, connection)
+
+    def release(self, connection):
+        # Takes a connection back, discarding anything the borrower left uncommitted
+        try:
+            connection.consume_results()
+            if connection.in_transaction:
+                connection.rollback()
+            reusable = True
+        except mysql.connector.Error:
+            reusable = False
+
+        with self._condition:
+            self._in_use -= 1
+            if reusable and self._pid == os.getpid():
+                self._idle.append((connection, time.monotonic()))
+                connection = None
+            self._condition.notify()
+
+        if connection is not None:
+            self._disconnect(connection)
+
+    def close(self):
+        # Closes every idle connection; borrowed ones are closed when returned
+        with self._condition:
+            idle, self._idle = self._idle, []
+        for connection, returned_at in idle:
+            self._disconnect(connection)
+
+    def _healthy(self, connection, returned_at):
+        # Connections used recently are trusted, older ones are pinged
+        if time.monotonic() - returned_at < self.check_after:
+            return True
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except mysql.connector.Error:
+            return False
+
+    def _evict_idle(self):
+        # Called with the lock held; idle connections are ordered by return time
+        cutoff = time.monotonic() - self.idle_timeout
+        while self._idle and self._idle[0][1] < cutoff:
+            connection, returned_at = self._idle.pop(0)
+            self._disconnect(connection)
+
+    def _check_fork(self):
+        # A forked child must not share the parent's sockets, so it starts with an empty pool
+        if self._pid != os.getpid():
+            self._idle = []
+            self._in_use = 0
+            self._pid = os.getpid()
+
+    def _disconnect(self, connection):
+        try:
+            connection.close()
+        except mysql.connector.Error:
+            pass
+
+
+class PooledConnection:
+    # Connection borrowed from a ConnectionPool; close() returns it instead of disconnecting
+
+    def __init__(self, pool, connection):
+        self._pool = pool
+        self._connection = connection
+
+    def __getattr__(self, name):
+        if self._connection is None:
+            raise mysql.connector.errors.OperationalError("Connection was returned to the pool")
+        return getattr(self._connection, name)
+
+    def commit(self):
+        if self._connection is None:
+            raise mysql.connector.errors.OperationalError("Connection was returned to the pool")
+        self._connection.commit()
+        note_write()
+        apply_pending_invalidations()
+
+    def close(self):
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            self._pool.release(connection)
+
+
+class SessionConnection:
+    # View of the connection pinned by session(); close() leaves it with the session
+    # In a grouped session commits are left to the session owner and rollback() only
+    # undoes the current command, back to the "batch_command" savepoint
+
+    def __init__(self, connection, grouped=False):
+        self._connection = connection
+        self._grouped = grouped
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def commit(self):
+        if not self._grouped:
+            self._connection.commit()
+
+    def rollback(self):
+        if not self._grouped:
+            self._connection.rollback()
+            return
+
+        try:
+            self._connection.consume_results()
+            self._connection.cmd_query("ROLLBACK TO SAVEPOINT batch_command")
+        except mysql.connector.Error:
+            # The savepoint is gone after an implicit commit (e.g. DDL), so undo what is left
+            self._connection.rollback()
+
+    def close(self):
+        pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+
+_replicas = None
+_replica_turn = itertools.count()
+
+
+def get_pool():
+    # Creates the shared pool for DB_CONFIG on first use
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(DB_CONFIG)
+        return _pool
+
+
+def get_replicas():
+    # Creates a Replica for each of REPLICA_CONFIGS on first use
+    global _replicas
+    with _pool_lock:
+        if _replicas is None:
+            _replicas = [Replica(config) for config in REPLICA_CONFIGS]
+        return _replicas
+
+
+def close_pools():
+    get_pool().close()
+    for replica in get_replicas():
+        replica.pool.close()
+
+
+class WriteMarker:
+    # When one caller last committed: its reads stay on the primary until a replica is known to have
+    # caught up (see Replica.usable), while other callers keep reading from the replicas
+    # Each thread has its own; writes_as() lends one to work done for the same caller on other threads
+
+    def __init__(self):
+        self.at = None      # time.monotonic() of the last commit
+
+
+def current_writer():
+    marker = getattr(_local, 'writer', None)
+    if marker is None:
+        marker = _local.writer = WriteMarker()
+    return marker
+
+
+@contextlib.contextmanager
+def writes_as(marker):
+    # Commits and reads made by this thread in the block count as marker's
+    previous = getattr(_local, 'writer', None)
+    _local.writer = marker
     try:
-        connection = mysql.connector.connect(**DB_CONFIG)
-        return connection
+        yield marker
+    finally:
+        _local.writer = previous
+
+
+def note_write(marker=None):
+    # Called after every commit, for the current thread's caller unless a marker is given
+    (marker or current_writer()).at = time.monotonic()
+
+
+def replica_connection():
+    # A pooled connection to the next usable replica in turn, or None to read from the primary
+    # Replicas are tried round robin; a lag reading older than REPLICA_LAG_CHECK is refreshed on the
+    # connection about to be used, and a replica that cannot be reached sits out until its next check
+    replicas = get_replicas()
+    if not replicas or getattr(_local, 'primary', False):
+        return None
+
+    turn = next(_replica_turn)
+    for i in range(len(replicas)):
+        replica = replicas[(turn + i) % len(replicas)]
+        fresh = replica.fresh()
+        if fresh and not replica.usable():
+            continue
+
+        connection = None
+        try:
+            connection = replica.pool.acquire()
+            if not fresh:
+                replica.measure(connection)
+        except mysql.connector.Error:
+            replica.reading = (None, time.monotonic())
+
+        if connection is not None:
+            if replica.usable():
+                return connection
+            connection.close()
+
+    return None
+
+
+@contextlib.contextmanager
+def primary_reads(enabled=True):
+    # Sends the reads made by this thread in the block to the primary, for flows that must see their
+    # own writes regardless of replica lag (e.g. a write and a read made by separate CLI runs)
+    previous = getattr(_local, 'primary', False)
+    _local.primary = previous or enabled
+    try:
+        yield
+    finally:
+        _local.primary = previous
+
+
+class Replica:
+    # A read replica: its own pool and its last replication lag reading
+
+    def __init__(self, config):
+        self.config = {**DB_CONFIG, **config}
+        self.pool = ConnectionPool(self.config)
+        self.reading = (None, None)     # (seconds behind the primary or None, time.monotonic() it was taken)
+
+    def name(self):
+        return f"{self.config.get('host', 'localhost')}:{self.config.get('port', 3306)}"
+
+    def fresh(self):
+        checked_at = self.reading[1]
+        return checked_at is not None and time.monotonic() - checked_at < REPLICA_LAG_CHECK
+
+    def measure(self, connection):
+        # Reads the lag on one of this replica's connections; None when replication is stopped or missing
+        checked_at = time.monotonic()
+        cursor = connection.cursor(dictionary=True)
+        try:
+            try:
+                cursor.execute("SHOW REPLICA STATUS")
+            except mysql.connector.Error:
+                # Before MySQL 8.0.22
+                cursor.execute("SHOW SLAVE STATUS")
+            lags = [row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master')) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+        lag = None if not lags or None in lags else max(lags)
+        self.reading = (lag, checked_at)
+        return lag
+
+    def usable(self):
+        # Within REPLICA_MAX_LAG, and caught up with the current caller's last commit: when the lag was read
+        # the replica had applied everything committed lag seconds earlier (plus one for whole-second rounding)
+        lag, checked_at = self.reading
+        if lag is None or lag > REPLICA_MAX_LAG:
+            return False
+        last_write = current_writer().at
+        return last_write is None or last_write < checked_at - lag - 1
+
+
+@contextlib.contextmanager
+def session(grouped=False, pool=None):
+    # Pins one pooled connection (from pool, by default the shared one) to the current thread so every
+    # connect() in the block shares it
+    # grouped=True hands out SessionConnection views whose commits are deferred to the caller
+    current = getattr(_local, 'session', None)
+    if current is not None:
+        yield current
+        return
+
+    connection = (pool or get_pool()).acquire()
+    _local.session = connection
+    _local.grouped = grouped
+    try:
+        yield connection
+    finally:
+        _local.session = None
+        _local.grouped = False
+        # Tags of writes left uncommitted are applied as well; an extra invalidation is harmless
+        apply_pending_invalidations()
+        connection.close()
+
+
+@contextlib.contextmanager
+def import_session():
+    # session() over a connection of its own made with IMPORT_DB_CONFIG, closed at the end
+    # Inside an existing session the import shares it, and LOAD DATA falls back to batched inserts
+    pool = ConnectionPool(IMPORT_DB_CONFIG, max_size=1)
+    try:
+        with session(pool=pool) as connection:
+            yield connection
+    finally:
+        pool.close()
+
+
+def connect(read_only=False):
+    # read_only=True lets the connection come from a replica (see replica_connection); a session()
+    # always stays on its own primary connection
+    start = time.perf_counter()
+    try:
+        pinned = getattr(_local, 'session', None)
+        if pinned is not None:
+            connection = SessionConnection(pinned, getattr(_local, 'grouped', False))
+        else:
+            connection = replica_connection() if read_only else None
+            if connection is None:
+                connection = get_pool().acquire()
     except mysql.connector.Error as error:
         print(f"Error: {error}")
         sys.exit(1)
 
+    # Commands run under profile_command see their statements timed
+    profile = getattr(_profiling, 'profile', None)
+    if profile is None:
+        return connection
+    profile.add('connect', time.perf_counter() - start)
+    return ProfiledConnection(connection, profile)
+
+
+class PreparedCursor:
+    # Cursor from the statement registry lent to one command; close() keeps the statement prepared
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def close(self):
+        # Rows left unread would block the connection's next statement
+        with contextlib.suppress(mysql.connector.Error):
+            if self._cursor.with_rows:
+                self._cursor.fetchall()
+
+
+# mysql.connector connection -> (server connection id, {statement: prepared cursor})
+_prepared = weakref.WeakKeyDictionary()
+
+
+def base_connection(connection):
+    # The mysql.connector connection behind the pool, session and profiling views
+    while isinstance(connection, (PooledConnection, SessionConnection, ProfiledConnection)):
+        connection = connection._connection
+    return connection
+
+
+def prepared_cursor(connection, statement, **cursor_options):
+    # A cursor for statement, prepared once per underlying connection and reused by every later command
+    # on it (pooled, session or batch); statement must be the module constant itself, since the
+    # connector only skips re-preparing when it is given the same string object
+    # Without PREPARED_STATEMENTS, a plain cursor made with cursor_options
+    if not PREPARED_STATEMENTS:
+        return connection.cursor(**cursor_options)
+
+    base = base_connection(connection)
+    server_id, cursors = _prepared.get(base, (None, {}))
+    if server_id != base.connection_id:
+        # A reconnect drops every statement prepared on the old session
+        server_id, cursors = base.connection_id, {}
+        _prepared[base] = (server_id, cursors)
+
+    cursor = cursors.get(statement)
+    if cursor is None:
+        cursor = cursors[statement] = base.cursor(prepared=True)
+
+    if isinstance(connection, ProfiledConnection):
+        return ProfiledCursor(PreparedCursor(cursor), connection._profile)
+    return PreparedCursor(cursor)
+
 '''
-FUNCTIONS
+SCHEMA
 '''
 
-def create_tables():
-    # Creates all tables listed under 'tables' using the command associated with each table name
+# Table name -> CREATE TABLE command, in creation order
+TABLES = {
+    "Users": 
+        """
+        CREATE TABLE IF NOT EXISTS Users (
+            uid INT,
+            email TEXT NOT NULL,
+            joined_date DATE NOT NULL,
+            nickname TEXT NOT NULL,
+            street TEXT,
+            city TEXT,
+            state TEXT,
+            zip TEXT,
+            genres TEXT,
+            PRIMARY KEY (uid)
+        )
+        """,
+    "Producers":
+        """
+        CREATE TABLE IF NOT EXISTS Producers (
+            uid INT,
+            bio TEXT,
+            company TEXT,
+            PRIMARY KEY (uid),
+            FOREIGN KEY (uid) REFERENCES Users(uid) ON DELETE CASCADE
+        ) 
+        """,
+    "Viewers":
+        """
+        CREATE TABLE IF NOT EXISTS Viewers (
+            uid INT,
+            subscription ENUM('free', 'monthly', 'yearly'),
+            first TEXT NOT NULL,
+            last TEXT NOT NULL,
+            PRIMARY KEY (uid),
+            FOREIGN KEY (uid) REFERENCES Users(uid) ON DELETE CASCADE
+        )
+        """,
+    "Releases":
+        """
+        CREATE TABLE IF NOT EXISTS Releases (
+            rid INT,
+            producer_uid INT NOT NULL,
+            title TEXT NOT NULL,
+            genre TEXT NOT NULL,
+            release_date DATE NOT NULL,
+            PRIMARY KEY (rid),
+            FOREIGN KEY (producer_uid) REFERENCES Producers(uid) ON DELETE CASCADE
+        )
+        """,
+    "Movies":
+        """
+        CREATE TABLE IF NOT EXISTS Movies (
+            rid INT,
+            website_url TEXT,
+            PRIMARY KEY (rid),
+            FOREIGN KEY (rid) REFERENCES Releases(rid) ON DELETE CASCADE
+        );
+        """,
+    "Series":
+        """
+        CREATE TABLE IF NOT EXISTS Series (
+            rid INT,
+            introduction TEXT,
+            PRIMARY KEY (rid),
+            FOREIGN KEY (rid) REFERENCES Releases(rid) ON DELETE CASCADE
+        )
+        """,
+    "Videos":
+        """
+        CREATE TABLE IF NOT EXISTS Videos (
+            rid INT,
+            ep_num INT NOT NULL,
+            title TEXT NOT NULL,
+            length INT NOT NULL,
+            PRIMARY KEY (rid, ep_num),
+            FOREIGN KEY (rid) REFERENCES Releases(rid) ON DELETE CASCADE
+        );
+        """,
+    "Sessions":
+        """
+        CREATE TABLE IF NOT EXISTS Sessions (
+            sid INT,
+            uid INT NOT NULL,
+            rid INT NOT NULL,
+            ep_num INT NOT NULL,
+            initiate_at DATETIME NOT NULL,
+            leave_at DATETIME NOT NULL,
+            quality ENUM('480p', '720p', '1080p'),
+            device ENUM('mobile', 'desktop'),
+            PRIMARY KEY (sid),
+            FOREIGN KEY (uid) REFERENCES Viewers(uid) ON DELETE CASCADE,
+            FOREIGN KEY (rid, ep_num) REFERENCES Videos(rid, ep_num) ON DELETE CASCADE
+        )
+        """,
+    "Reviews":
+        """
+        CREATE TABLE IF NOT EXISTS Reviews (
+            rvid INT,
+            uid INT NOT NULL,
+            rid INT NOT NULL,
+            rating DECIMAL(2, 1) NOT NULL CHECK (rating BETWEEN 0 AND 5),
+            body TEXT,
+            posted_at DATETIME NOT NULL,
+            PRIMARY KEY (rvid),
+            FOREIGN KEY (uid) REFERENCES Viewers(uid) ON DELETE CASCADE,
+            FOREIGN KEY (rid) REFERENCES Releases(rid) ON DELETE CASCADE
+        );
+        """,
+    # One row per entry of Users.genres, stored as written: entries differing in case are different genres,
+    # as they always were for addGenre, while usersByGenre matches any case through the LOWER(genre) index
+    # 700 characters is as wide as a genre can be and still fit an index key (3072 bytes of utf8mb4)
+    "UserGenres":
+        """
+        CREATE TABLE IF NOT EXISTS UserGenres (
+            uid INT,
+            genre VARCHAR(700) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+            PRIMARY KEY (uid, genre),
+            INDEX idx_user_genres_genre ((LOWER(genre)), uid),
+            FOREIGN KEY (uid) REFERENCES Users(uid) ON DELETE CASCADE
+        )
+        """
+}
 
-    try:
-        connection = connect()
-        cursor = connection.cursor()
+# Table name -> .csv file it is imported from (UserGenres is split out of the users.csv genres column)
+TABLE_CSV = {
+    "Users": "users.csv",
+    "UserGenres": "users.csv",
+    "Producers": "producers.csv",
+    "Viewers": "viewers.csv",
+    "Releases": "releases.csv",
+    "Movies": "movies.csv",
+    "Series": "series.csv",
+    "Videos": "videos.csv",
+    "Reviews": "reviews.csv",
+    "Sessions": "sessions.csv"
+}
+
+
+def foreign_keys():
+    # Table -> list of (columns, parent table, parent columns) read from the FOREIGN KEY clauses in TABLES
+    pattern = re.compile(r"FOREIGN KEY \(([^)]*)\) REFERENCES (\w+)\s*\(([^)]*)\)")
+    keys = {}
+
+    for table, command in TABLES.items():
+        keys[table] = [
+            ([c.strip() for c in columns.split(',')], parent, [c.strip() for c in parent_columns.split(',')])
+            for columns, parent, parent_columns in pattern.findall(command)
+        ]
+
+    return keys
+
+
+def table_dependencies():
+    # Table -> set of tables that must be loaded before it (the load DAG)
+    return {table: {parent for _, parent, _ in keys if parent != table} for table, keys in foreign_keys().items()}
+
+
+def load_order(tables):
+    # The given tables ordered so every table comes after the tables it references
+    dependencies = table_dependencies()
+    ordered = []
+    remaining = list(tables)
+
+    while remaining:
+        ready = [t for t in remaining if not (dependencies.get(t, set()) & (set(remaining) - {t}))]
+        if not ready:
+            raise RuntimeError(f"Circular foreign keys between {', '.join(remaining)}")
+        ordered += ready
+        remaining = [t for t in remaining if t not in ready]
 
-        # Create tables
-        tables = {
-            "Users": 
+    return ordered
+
+
+def ddl_columns():
+    # Table -> column names in definition order, read from the column lines in TABLES
+    pattern = re.compile(r"^\s*(\w+)\s+\w", re.MULTILINE)
+    clauses = {'CREATE', 'PRIMARY', 'FOREIGN', 'INDEX', 'KEY', 'UNIQUE', 'CONSTRAINT', 'CHECK'}
+    return {table: [name for name in pattern.findall(command) if name.upper() not in clauses] for table, command in TABLES.items()}
+
+
+def primary_keys():
+    # Table -> primary key columns read from the PRIMARY KEY clauses in TABLES
+    pattern = re.compile(r"PRIMARY KEY \(([^)]*)\)")
+    return {table: [c.strip() for c in pattern.search(command).group(1).split(',')] for table, command in TABLES.items()}
+
+
+'''
+INDEXES
+'''
+
+# Secondary indexes kept on top of the primary keys and implicit foreign key indexes
+# Table -> {index name: columns}
+INDEXES = {
+    "Sessions": {
+        "idx_sessions_initiate_uid": "initiate_at, uid",    # activeViewer date range, grouped by uid
+        "idx_sessions_rid_uid": "rid, uid",                 # videosViewed distinct viewers per release
+        "idx_sessions_uid_initiate": "uid, initiate_at",    # activeViewer pages, seeking past the last uid
+    },
+    "Reviews": {
+        "idx_reviews_uid_rid": "uid, rid",                  # listReleases reviews by viewer
+        "idx_reviews_rid": "rid",                           # popularRelease reviews grouped by release
+    },
+}
+
+
+def ensure_indexes(cursor):
+    # Creates the indexes in INDEXES that do not exist yet; returns the names created
+    get_indexes = """
+        SELECT DISTINCT INDEX_NAME
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """
+    created = []
+
+    for table, indexes in INDEXES.items():
+        cursor.execute(get_indexes, (table,))
+        existing = {row[0] for row in cursor.fetchall()}
+
+        for name, columns in indexes.items():
+            if name not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD INDEX {name} ({columns})")
+                created.append(name)
+
+    return created
+
+'''
+PARTITIONS
+'''
+
+# Sessions when SCHEMA_OPTIONS['partition_sessions'] is on, with one partition per month of initiate_at
+# MySQL allows no foreign keys on a partitioned table and needs initiate_at in every unique key, so the
+# viewer/video references and sid uniqueness are checked by the inserts and delete_viewer instead
+PARTITIONED_SESSIONS = """
+    CREATE TABLE IF NOT EXISTS Sessions (
+        sid INT,
+        uid INT NOT NULL,
+        rid INT NOT NULL,
+        ep_num INT NOT NULL,
+        initiate_at DATETIME NOT NULL,
+        leave_at DATETIME NOT NULL,
+        quality ENUM('480p', '720p', '1080p'),
+        device ENUM('mobile', 'desktop'),
+        PRIMARY KEY (sid, initiate_at),
+        INDEX idx_sessions_uid (uid),
+        INDEX idx_sessions_video (rid, ep_num)
+    )
+    PARTITION BY RANGE COLUMNS (initiate_at) (
+        {partitions}
+    )
+"""
+
+
+def add_months(day, months):
+    # First day of the month `months` after the month of day
+    index = day.year * 12 + day.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    # Name of the partition holding the sessions of the month starting on month
+    return f"p{month:%Y%m}"
+
+
+def partition_definition(month):
+    return f"PARTITION {partition_name(month)} VALUES LESS THAN ('{add_months(month, 1)}')"
+
+
+def sessions_command():
+    # The Sessions CREATE TABLE to use: partitioned from SESSION_PARTITION_START to SESSION_PARTITIONS_AHEAD
+    # months past the current one, or the plain table
+    if not SCHEMA_OPTIONS['partition_sessions']:
+        return TABLES["Sessions"]
+
+    first = add_months(SESSION_PARTITION_START, 0)
+    last = add_months(datetime.date.today(), SESSION_PARTITIONS_AHEAD)
+
+    definitions = [f"PARTITION p_before VALUES LESS THAN ('{first}')"]
+    month = first
+    while month <= last:
+        definitions.append(partition_definition(month))
+        month = add_months(month, 1)
+    definitions.append("PARTITION p_future VALUES LESS THAN (MAXVALUE)")
+
+    return PARTITIONED_SESSIONS.format(partitions=",\n        ".join(definitions))
+
+
+def session_partitions(cursor):
+    # List of (partition name, upper bound date or None for MAXVALUE) of Sessions, empty if not partitioned
+    get_partitions = """
+        SELECT PARTITION_NAME, PARTITION_DESCRIPTION
+        FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'Sessions' AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+    """
+    cursor.execute(get_partitions)
+
+    partitions = []
+    for name, description in cursor.fetchall():
+        # Bounds read back as e.g. '2024-02-01 00:00:00' (quotes included) or MAXVALUE
+        bound = None if description == 'MAXVALUE' else datetime.date.fromisoformat(description.strip("'")[:10])
+        partitions.append((name, bound))
+
+    return partitions
+
+'''
+DERIVED TABLES
+'''
+
+# HyperLogLog register and rank of a viewer, from the first 32 bits of MD5(uid)
+# The low HLL_PRECISION bits pick the register; the rank is the position of the first 1 in the rest
+def hll_register_sql(uid):
+    return f"(CONV(LEFT(MD5({uid}), 8), 16, 10) & {2 ** HLL_PRECISION - 1})"
+
+
+def hll_rank_sql(uid):
+    rest = f"(CONV(LEFT(MD5({uid}), 8), 16, 10) >> {HLL_PRECISION})"
+    width = 32 - HLL_PRECISION
+    return f"IF({rest} = 0, {width + 1}, {width + 1} - LENGTH(BIN({rest})))"
+
+
+# Recomputes the sketch of one episode from Sessions (sketches cannot subtract a viewer)
+REBUILD_EPISODE_SKETCH = [
+    "DELETE FROM EpisodeViewerSketch WHERE rid = %s AND ep_num = %s",
+    f"""
+    INSERT INTO EpisodeViewerSketch (rid, ep_num, bucket, rnk)
+    SELECT rid, ep_num, {hll_register_sql('uid')}, MAX({hll_rank_sql('uid')})
+    FROM Sessions
+    WHERE rid = %s AND ep_num = %s
+    GROUP BY rid, ep_num, {hll_register_sql('uid')}
+    """,
+]
+
+
+# Tables derived from the base tables, each enabled by a SCHEMA_OPTIONS flag
+# 'source' is the base table it summarizes, 'create' makes the table, 'rebuild' recomputes it from scratch
+# and 'triggers' keep it current
+# Note: triggers do not fire for ON DELETE CASCADE, so cascading deletes must be handled by the caller
+DERIVED_TABLES = {
+    "ReleaseReviewCounts": {
+        'source': 'Reviews',
+        'option': 'review_counts',
+        'create':
+            """
+            CREATE TABLE IF NOT EXISTS ReleaseReviewCounts (
+                rid INT,
+                total INT NOT NULL,
+                PRIMARY KEY (rid),
+                INDEX idx_review_counts_total (total, rid),
+                FOREIGN KEY (rid) REFERENCES Releases(rid) ON DELETE CASCADE
+            )
+            """,
+        'rebuild': [
+            "DELETE FROM ReleaseReviewCounts",
+            "INSERT INTO ReleaseReviewCounts (rid, total) SELECT rid, COUNT(*) FROM Reviews GROUP BY rid",
+        ],
+        'triggers': {
+            "trg_review_counts_insert":
                 """
-                CREATE TABLE IF NOT EXISTS Users (
-                    uid INT,
-                    email TEXT NOT NULL,
-                    joined_date DATE NOT NULL,
-                    nickname TEXT NOT NULL,
-                    street TEXT,
-                    city TEXT,
-                    state TEXT,
-                    zip TEXT,
-                    genres TEXT,
-                    PRIMARY KEY (uid)
-                )
+                CREATE TRIGGER trg_review_counts_insert AFTER INSERT ON Reviews
+                FOR EACH ROW
+                    INSERT INTO ReleaseReviewCounts (rid, total) VALUES (NEW.rid, 1)
+                    ON DUPLICATE KEY UPDATE total = total + 1
                 """,
-            "Producers":
+            "trg_review_counts_delete":
                 """
-                CREATE TABLE IF NOT EXISTS Producers (
-                    uid INT,
-                    bio TEXT,
-                    company TEXT,
-                    PRIMARY KEY (uid),
-                    FOREIGN KEY (uid) REFERENCES Users(uid) ON DELETE CASCADE
-                ) 
+                CREATE TRIGGER trg_review_counts_delete AFTER DELETE ON Reviews
+                FOR EACH ROW
+                    UPDATE ReleaseReviewCounts SET total = total - 1 WHERE rid = OLD.rid
                 """,
-            "Viewers":
+            "trg_review_counts_update":
                 """
-                CREATE TABLE IF NOT EXISTS Viewers (
-                    uid INT,
-                    subscription ENUM('free', 'monthly', 'yearly'),
-                    first TEXT NOT NULL,
-                    last TEXT NOT NULL,
-                    PRIMARY KEY (uid),
-                    FOREIGN KEY (uid) REFERENCES Users(uid) ON DELETE CASCADE
-                )
+                CREATE TRIGGER trg_review_counts_update AFTER UPDATE ON Reviews
+                FOR EACH ROW
+                BEGIN
+                    IF NOT (OLD.rid <=> NEW.rid) THEN
+                        UPDATE ReleaseReviewCounts SET total = total - 1 WHERE rid = OLD.rid;
+                        INSERT INTO ReleaseReviewCounts (rid, total) VALUES (NEW.rid, 1)
+                        ON DUPLICATE KEY UPDATE total = total + 1;
+                    END IF;
+                END
                 """,
-            "Releases":
+        },
+    },
+    "SessionDaily": {
+        'source': 'Sessions',
+        'option': 'session_rollup',
+        'create':
+            """
+            CREATE TABLE IF NOT EXISTS SessionDaily (
+                uid INT,
+                day DATE,
+                sessions INT NOT NULL,
+                PRIMARY KEY (uid, day),
+                INDEX idx_session_daily_day (day, uid, sessions),
+                FOREIGN KEY (uid) REFERENCES Viewers(uid) ON DELETE CASCADE
+            )
+            """,
+        'rebuild': [
+            "DELETE FROM SessionDaily",
+            """
+            INSERT INTO SessionDaily (uid, day, sessions)
+            SELECT uid, DATE(initiate_at), COUNT(*) FROM Sessions GROUP BY uid, DATE(initiate_at)
+            """,
+        ],
+        'triggers': {
+            "trg_session_daily_insert":
                 """
-                CREATE TABLE IF NOT EXISTS Releases (
-                    rid INT,
-                    producer_uid INT NOT NULL,
-                    title TEXT NOT NULL,
-                    genre TEXT NOT NULL,
-                    release_date DATE NOT NULL,
-                    PRIMARY KEY (rid),
-                    FOREIGN KEY (producer_uid) REFERENCES Producers(uid) ON DELETE CASCADE
-                )
+                CREATE TRIGGER trg_session_daily_insert AFTER INSERT ON Sessions
+                FOR EACH ROW
+                    INSERT INTO SessionDaily (uid, day, sessions) VALUES (NEW.uid, DATE(NEW.initiate_at), 1)
+                    ON DUPLICATE KEY UPDATE sessions = sessions + 1
                 """,
-            "Movies":
+            "trg_session_daily_delete":
                 """
-                CREATE TABLE IF NOT EXISTS Movies (
-                    rid INT,
-                    website_url TEXT,
-                    PRIMARY KEY (rid),
-                    FOREIGN KEY (rid) REFERENCES Releases(rid) ON DELETE CASCADE
-                );
+                CREATE TRIGGER trg_session_daily_delete AFTER DELETE ON Sessions
+                FOR EACH ROW
+                BEGIN
+                    UPDATE SessionDaily SET sessions = sessions - 1
+                    WHERE uid = OLD.uid AND day = DATE(OLD.initiate_at);
+                    DELETE FROM SessionDaily
+                    WHERE uid = OLD.uid AND day = DATE(OLD.initiate_at) AND sessions <= 0;
+                END
                 """,
-            "Series":
+            "trg_session_daily_update":
                 """
-                CREATE TABLE IF NOT EXISTS Series (
-                    rid INT,
-                    introduction TEXT,
-                    PRIMARY KEY (rid),
-                    FOREIGN KEY (rid) REFERENCES Releases(rid) ON DELETE CASCADE
-                )
+                CREATE TRIGGER trg_session_daily_update AFTER UPDATE ON Sessions
+                FOR EACH ROW
+                BEGIN
+                    IF NOT (OLD.uid <=> NEW.uid AND DATE(OLD.initiate_at) <=> DATE(NEW.initiate_at)) THEN
+                        UPDATE SessionDaily SET sessions = sessions - 1
+                        WHERE uid = OLD.uid AND day = DATE(OLD.initiate_at);
+                        DELETE FROM SessionDaily
+                        WHERE uid = OLD.uid AND day = DATE(OLD.initiate_at) AND sessions <= 0;
+                        INSERT INTO SessionDaily (uid, day, sessions) VALUES (NEW.uid, DATE(NEW.initiate_at), 1)
+                        ON DUPLICATE KEY UPDATE sessions = sessions + 1;
+                    END IF;
+                END
                 """,
-            "Videos":
+        },
+    },
+    "EpisodeViewers": {
+        'source': 'Sessions',
+        'option': 'episode_viewers',
+        'mode': 'exact',
+        'create':
+            """
+            CREATE TABLE IF NOT EXISTS EpisodeViewers (
+                rid INT,
+                ep_num INT,
+                uid INT,
+                sessions INT NOT NULL,
+                PRIMARY KEY (rid, ep_num, uid),
+                FOREIGN KEY (rid, ep_num) REFERENCES Videos(rid, ep_num) ON DELETE CASCADE,
+                FOREIGN KEY (uid) REFERENCES Viewers(uid) ON DELETE CASCADE
+            )
+            """,
+        'rebuild': [
+            "DELETE FROM EpisodeViewers",
+            """
+            INSERT INTO EpisodeViewers (rid, ep_num, uid, sessions)
+            SELECT rid, ep_num, uid, COUNT(*) FROM Sessions GROUP BY rid, ep_num, uid
+            """,
+        ],
+        'triggers': {
+            "trg_episode_viewers_insert":
                 """
-                CREATE TABLE IF NOT EXISTS Videos (
-                    rid INT,
-                    ep_num INT NOT NULL,
-                    title TEXT NOT NULL,
-                    length INT NOT NULL,
-                    PRIMARY KEY (rid, ep_num),
-                    FOREIGN KEY (rid) REFERENCES Releases(rid) ON DELETE CASCADE
-                );
+                CREATE TRIGGER trg_episode_viewers_insert AFTER INSERT ON Sessions
+                FOR EACH ROW
+                    INSERT INTO EpisodeViewers (rid, ep_num, uid, sessions) VALUES (NEW.rid, NEW.ep_num, NEW.uid, 1)
+                    ON DUPLICATE KEY UPDATE sessions = sessions + 1
                 """,
-            "Sessions":
+            "trg_episode_viewers_delete":
                 """
-                CREATE TABLE IF NOT EXISTS Sessions (
-                    sid INT,
-                    uid INT NOT NULL,
-                    rid INT NOT NULL,
-                    ep_num INT NOT NULL,
-                    initiate_at DATETIME NOT NULL,
-                    leave_at DATETIME NOT NULL,
-                    quality ENUM('480p', '720p', '1080p'),
-                    device ENUM('mobile', 'desktop'),
-                    PRIMARY KEY (sid),
-                    FOREIGN KEY (uid) REFERENCES Viewers(uid) ON DELETE CASCADE,
-                    FOREIGN KEY (rid, ep_num) REFERENCES Videos(rid, ep_num) ON DELETE CASCADE
-                )
+                CREATE TRIGGER trg_episode_viewers_delete AFTER DELETE ON Sessions
+                FOR EACH ROW
+                BEGIN
+                    UPDATE EpisodeViewers SET sessions = sessions - 1
+                    WHERE rid = OLD.rid AND ep_num = OLD.ep_num AND uid = OLD.uid;
+                    DELETE FROM EpisodeViewers
+                    WHERE rid = OLD.rid AND ep_num = OLD.ep_num AND uid = OLD.uid AND sessions <= 0;
+                END
                 """,
-            "Reviews":
+            "trg_episode_viewers_update":
                 """
-                CREATE TABLE IF NOT EXISTS Reviews (
-                    rvid INT,
-                    uid INT NOT NULL,
-                    rid INT NOT NULL,
-                    rating DECIMAL(2, 1) NOT NULL CHECK (rating BETWEEN 0 AND 5),
-                    body TEXT,
-                    posted_at DATETIME NOT NULL,
-                    PRIMARY KEY (rvid),
-                    FOREIGN KEY (uid) REFERENCES Viewers(uid) ON DELETE CASCADE,
-                    FOREIGN KEY (rid) REFERENCES Releases(rid) ON DELETE CASCADE
-                );
+                CREATE TRIGGER trg_episode_viewers_update AFTER UPDATE ON Sessions
+                FOR EACH ROW
+                BEGIN
+                    IF NOT (OLD.rid <=> NEW.rid AND OLD.ep_num <=> NEW.ep_num AND OLD.uid <=> NEW.uid) THEN
+                        UPDATE EpisodeViewers SET sessions = sessions - 1
+                        WHERE rid = OLD.rid AND ep_num = OLD.ep_num AND uid = OLD.uid;
+                        DELETE FROM EpisodeViewers
+                        WHERE rid = OLD.rid AND ep_num = OLD.ep_num AND uid = OLD.uid AND sessions <= 0;
+                        INSERT INTO EpisodeViewers (rid, ep_num, uid, sessions) VALUES (NEW.rid, NEW.ep_num, NEW.uid, 1)
+                        ON DUPLICATE KEY UPDATE sessions = sessions + 1;
+                    END IF;
+                END
+                """,
+        },
+    },
+    "EpisodeViewerSketch": {
+        'source': 'Sessions',
+        'option': 'episode_viewers',
+        'mode': 'hll',
+        'create':
+            """
+            CREATE TABLE IF NOT EXISTS EpisodeViewerSketch (
+                rid INT,
+                ep_num INT,
+                bucket SMALLINT,
+                rnk TINYINT NOT NULL,
+                PRIMARY KEY (rid, ep_num, bucket),
+                FOREIGN KEY (rid, ep_num) REFERENCES Videos(rid, ep_num) ON DELETE CASCADE
+            )
+            """,
+        'rebuild': [
+            "DELETE FROM EpisodeViewerSketch",
+            f"""
+            INSERT INTO EpisodeViewerSketch (rid, ep_num, bucket, rnk)
+            SELECT rid, ep_num, {hll_register_sql('uid')}, MAX({hll_rank_sql('uid')})
+            FROM Sessions
+            GROUP BY rid, ep_num, {hll_register_sql('uid')}
+            """,
+        ],
+        'triggers': {
+            "trg_episode_sketch_insert":
+                f"""
+                CREATE TRIGGER trg_episode_sketch_insert AFTER INSERT ON Sessions
+                FOR EACH ROW
+                    INSERT INTO EpisodeViewerSketch (rid, ep_num, bucket, rnk)
+                    VALUES (NEW.rid, NEW.ep_num, {hll_register_sql('NEW.uid')}, {hll_rank_sql('NEW.uid')})
+                    ON DUPLICATE KEY UPDATE rnk = GREATEST(rnk, VALUES(rnk))
+                """,
+            # A deleted session's viewer may still count elsewhere, so its episode has to be recomputed;
+            # that is left to rebuild_dirty_sketches, once per episode rather than once per deleted row
+            "trg_episode_sketch_delete":
                 """
-        }
+                CREATE TRIGGER trg_episode_sketch_delete AFTER DELETE ON Sessions
+                FOR EACH ROW
+                    INSERT INTO EpisodeSketchDirty (rid, ep_num) VALUES (OLD.rid, OLD.ep_num)
+                    ON DUPLICATE KEY UPDATE rid = rid
+                """,
+            # A session moved to another episode or viewer is a delete from the old episode and an insert
+            "trg_episode_sketch_update":
+                f"""
+                CREATE TRIGGER trg_episode_sketch_update AFTER UPDATE ON Sessions
+                FOR EACH ROW
+                BEGIN
+                    IF NOT (OLD.rid <=> NEW.rid AND OLD.ep_num <=> NEW.ep_num AND OLD.uid <=> NEW.uid) THEN
+                        INSERT INTO EpisodeSketchDirty (rid, ep_num) VALUES (OLD.rid, OLD.ep_num)
+                        ON DUPLICATE KEY UPDATE rid = rid;
+                        INSERT INTO EpisodeViewerSketch (rid, ep_num, bucket, rnk)
+                        VALUES (NEW.rid, NEW.ep_num, {hll_register_sql('NEW.uid')}, {hll_rank_sql('NEW.uid')})
+                        ON DUPLICATE KEY UPDATE rnk = GREATEST(rnk, VALUES(rnk));
+                    END IF;
+                END
+                """,
+        },
+    },
+    # Episodes whose sketch is waiting for rebuild_dirty_sketches after session deletes and updates
+    "EpisodeSketchDirty": {
+        'source': 'Sessions',
+        'option': 'episode_viewers',
+        'mode': 'hll',
+        'create':
+            """
+            CREATE TABLE IF NOT EXISTS EpisodeSketchDirty (
+                rid INT,
+                ep_num INT,
+                PRIMARY KEY (rid, ep_num)
+            )
+            """,
+        'rebuild': [
+            "DELETE FROM EpisodeSketchDirty",
+        ],
+        'triggers': {},
+    },
+}
+
 
-        # Creates all tables above by executing the commands above
-        for table, command in tables.items():
+def rebuild_dirty_sketches(cursor):
+    # Recomputes the sketch of each episode marked in EpisodeSketchDirty once, and clears the marks
+    # Writes deleting or updating sessions call it before they commit; returns the number of episodes rebuilt
+    if SCHEMA_OPTIONS['episode_viewers'] != 'hll':
+        return 0
+
+    cursor.execute("SELECT rid, ep_num FROM EpisodeSketchDirty")
+    episodes = cursor.fetchall()
+    for rid, ep_num in episodes:
+        for command in REBUILD_EPISODE_SKETCH:
+            cursor.execute(command, (rid, ep_num))
+        cursor.execute("DELETE FROM EpisodeSketchDirty WHERE rid = %s AND ep_num = %s", (rid, ep_num))
+    return len(episodes)
+
+
+def enabled_derived_tables():
+    # The entries of DERIVED_TABLES whose SCHEMA_OPTIONS flag is on (and set to their 'mode', if any)
+    enabled = {}
+    for table, spec in DERIVED_TABLES.items():
+        value = SCHEMA_OPTIONS.get(spec['option'])
+        if value and spec.get('mode', value) == value:
+            enabled[table] = spec
+    return enabled
+
+
+def create_derived_tables(cursor):
+    # Creates the enabled derived tables; returns the ones that did not exist before
+    check = """
+        SELECT TABLE_NAME
+        FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """
+    created = []
+
+    for table, spec in enabled_derived_tables().items():
+        cursor.execute(check, (table,))
+        if not cursor.fetchall():
+            cursor.execute(spec['create'])
+            created.append(table)
+
+    return created
+
+
+def rebuild_derived_tables(cursor, tables=None):
+    # Recomputes the given (default: all enabled) derived tables from the base tables
+    for table, spec in enabled_derived_tables().items():
+        if tables is None or table in tables:
+            for command in spec['rebuild']:
+                cursor.execute(command)
+
+
+def create_triggers(cursor):
+    # (Re)creates the triggers of the enabled derived tables
+    # With binary logging on, creating triggers may need SUPER or log_bin_trust_function_creators
+    for table, spec in enabled_derived_tables().items():
+        for name, command in spec['triggers'].items():
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
             cursor.execute(command)
+
+
+def rebuild_aggregates():
+    # Rebuilds every enabled derived table and its triggers, e.g. after turning an option on
+    try:
+        connection = connect()
+        cursor = connection.cursor()
+
+        create_derived_tables(cursor)
+        rebuild_derived_tables(cursor)
+        create_triggers(cursor)
+
+        connection.commit()
+        cursor.close()
+        connection.close()
+        return True
+
+    except Exception as error:
+        print(f"Error in rebuild_aggregates as: {error}")
+        connection.rollback()
+        cursor.close()
+        connection.close()
+        return False
+
+
+'''
+QUERIES
+'''
+
+# Read queries shared by the functions below and check_query_plans
+
+GET_RELEASES_REVIEWED = """
+    SELECT DISTINCT r.rid, r.genre, r.title
+    FROM Releases r
+    JOIN Reviews rv ON r.rid = rv.rid
+    WHERE rv.uid = %s
+    ORDER BY r.title ASC;
+"""
+
+GET_POPULAR_RELEASES = """
+    SELECT rel.rid, rel.title, COUNT(rev.rvid) AS total
+    FROM Releases rel, Reviews rev
+    WHERE rel.rid = rev.rid
+    GROUP BY rel.rid, rel.title
+    ORDER BY total DESC, rel.rid DESC
+    LIMIT %s
+"""
+
+# Same result as GET_POPULAR_RELEASES, read from ReleaseReviewCounts by walking idx_review_counts_total
+GET_POPULAR_RELEASES_FROM_COUNTS = """
+    SELECT c.rid, rel.title, c.total
+    FROM ReleaseReviewCounts c
+    JOIN Releases rel ON rel.rid = c.rid
+    WHERE c.total > 0
+    ORDER BY c.total DESC, c.rid DESC
+    LIMIT %s
+"""
+
+# Pages of the listings: the *_PAGE queries return the first `limit` rows and the *_AFTER queries the
+# `limit` rows following a cursor, which is the ordering key of the last row already shown. The cursor
+# is compared as a row value so the index behind the ORDER BY can seek straight to it instead of
+# skipping OFFSET rows
+
+GET_RELEASES_REVIEWED_PAGE = """
+    SELECT DISTINCT r.rid, r.genre, r.title
+    FROM Releases r
+    JOIN Reviews rv ON r.rid = rv.rid
+    WHERE rv.uid = %s
+    ORDER BY r.title ASC, r.rid ASC
+    LIMIT %s;
+"""
+
+GET_RELEASES_REVIEWED_AFTER = """
+    SELECT DISTINCT r.rid, r.genre, r.title
+    FROM Releases r
+    JOIN Reviews rv ON r.rid = rv.rid
+    WHERE rv.uid = %s AND (r.title, r.rid) > (%s, %s)
+    ORDER BY r.title ASC, r.rid ASC
+    LIMIT %s;
+"""
+
+# The plain ranking has to count every release before it can seek; the summary table does not
+GET_POPULAR_RELEASES_AFTER = """
+    SELECT rel.rid, rel.title, COUNT(rev.rvid) AS total
+    FROM Releases rel, Reviews rev
+    WHERE rel.rid = rev.rid
+    GROUP BY rel.rid, rel.title
+    HAVING (total, rel.rid) < (%s, %s)
+    ORDER BY total DESC, rel.rid DESC
+    LIMIT %s
+"""
+
+GET_POPULAR_RELEASES_FROM_COUNTS_AFTER = """
+    SELECT c.rid, rel.title, c.total
+    FROM ReleaseReviewCounts c
+    JOIN Releases rel ON rel.rid = c.rid
+    WHERE c.total > 0 AND (c.total, c.rid) < (%s, %s)
+    ORDER BY c.total DESC, c.rid DESC
+    LIMIT %s
+"""
+
+# Largest LIMIT MySQL accepts, for pages after a cursor without a limit
+PAGE_ALL = 18446744073709551615
+
+INSERT_SESSION = """
+    INSERT INTO Sessions (sid, uid, rid, ep_num, initiate_at, leave_at, quality, device)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+# INSERT_SESSION for a partitioned Sessions, which has no foreign keys or unique sid to check against:
+# inserts nothing when the viewer or video is unknown or the sid is taken
+# Parameters: sid, initiate_at, leave_at, quality, device, uid, rid, ep_num, sid
+INSERT_SESSION_CHECKED = """
+    INSERT INTO Sessions (sid, uid, rid, ep_num, initiate_at, leave_at, quality, device)
+    SELECT %s, v.uid, vi.rid, vi.ep_num, %s, %s, %s, %s
+    FROM Viewers v, Videos vi
+    WHERE v.uid = %s AND vi.rid = %s AND vi.ep_num = %s
+      AND NOT EXISTS (SELECT 1 FROM Sessions WHERE sid = %s)
+"""
+
+# Constraint errors that mean a session is rejected (unknown viewer/video or taken sid) rather than broken
+SESSION_REJECTED_ERRORS = {errorcode.ER_DUP_ENTRY, errorcode.ER_NO_REFERENCED_ROW_2}
+
+# Same result as VIDEOS_REVIEWED_COUNT (distinct viewers of the whole release on every episode row),
+# counted from EpisodeViewers instead of Sessions
+VIDEOS_REVIEWED_COUNT_FROM_EPISODES = """
+    SELECT v.rid, v.ep_num, v.title, v.length, c.viewer_count
+    FROM Videos v
+    CROSS JOIN (SELECT COUNT(DISTINCT uid) AS viewer_count FROM EpisodeViewers WHERE rid = %s) c
+    WHERE v.rid = %s
+    ORDER BY v.rid DESC;
+"""
+
+# Registers of the release's episode sketches merged by taking the highest rank
+RELEASE_SKETCH = """
+    SELECT bucket, MAX(rnk)
+    FROM EpisodeViewerSketch
+    WHERE rid = %s
+    GROUP BY bucket
+"""
+
+RELEASE_VIDEOS = """
+    SELECT v.rid, v.ep_num, v.title, v.length
+    FROM Videos v
+    WHERE v.rid = %s
+    ORDER BY v.rid DESC;
+"""
+
+USERS_BY_GENRE = """
+    SELECT DISTINCT u.uid, u.nickname
+    FROM UserGenres g
+    JOIN Users u ON u.uid = g.uid
+    WHERE LOWER(g.genre) = %s
+    ORDER BY u.uid ASC;
+"""
+
+
+def popular_releases_query(after=None):
+    # Picks the summary table when it is maintained, and the page query when continuing after a cursor
+    if SCHEMA_OPTIONS['review_counts']:
+        return GET_POPULAR_RELEASES_FROM_COUNTS if after is None else GET_POPULAR_RELEASES_FROM_COUNTS_AFTER
+    return GET_POPULAR_RELEASES if after is None else GET_POPULAR_RELEASES_AFTER
+
+
+def releases_reviewed_query(uid, limit=None, after=None):
+    # Returns (query, params) for listReleases, or one page of it after a (title, rid) cursor
+    if limit is None and after is None:
+        return GET_RELEASES_REVIEWED, (uid,)
+    limit = PAGE_ALL if limit is None else max(int(limit), 0)
+    if after is None:
+        return GET_RELEASES_REVIEWED_PAGE, (uid, limit)
+    return GET_RELEASES_REVIEWED_AFTER, (uid, after[0], after[1], limit)
+
+
+def active_viewers_query(N, start_date, end_date, limit=None, after=None):
+    # Returns (query, params) for activeViewer, using SessionDaily for the whole days in the range
+    # With a limit or an `after` uid cursor, returns the matching page query instead
+    ranges = [(start_date, end_date)]
+    query, pages = GET_ACTIVE_VIEWERS, ACTIVE_VIEWER_PAGES[GET_ACTIVE_VIEWERS]
+
+    # Dates MySQL accepts but Python cannot parse are left to the plain query
+    try:
+        start = datetime.datetime.fromisoformat(str(start_date))
+        end = datetime.datetime.fromisoformat(str(end_date))
+    except ValueError:
+        start = end = None
+
+    if SCHEMA_OPTIONS['session_rollup'] and start is not None:
+        # Whole days lie fully inside [start, end]: from 00:00:00 through 23:59:59
+        first_day = start.date() if start.time() == datetime.time(0) else start.date() + datetime.timedelta(days=1)
+        last_day = end.date() if end.time() >= datetime.time(23, 59, 59) else end.date() - datetime.timedelta(days=1)
+
+        if first_day <= last_day:
+            first_midnight = datetime.datetime.combine(first_day, datetime.time(0))
+            after_last_midnight = datetime.datetime.combine(last_day + datetime.timedelta(days=1), datetime.time(0))
+            ranges = [(first_day, last_day),
+                      (start_date, first_midnight),
+                      (after_last_midnight, end_date)]
+            query, pages = GET_ACTIVE_VIEWERS_FROM_ROLLUP, ACTIVE_VIEWER_PAGES[GET_ACTIVE_VIEWERS_FROM_ROLLUP]
+
+    if limit is None and after is None:
+        return query, tuple(value for pair in ranges for value in pair) + (N,)
+
+    # The page queries take the uid cursor after each range, so every part of the union seeks past it
+    limit = PAGE_ALL if limit is None else max(int(limit), 0)
+    if after is None:
+        return pages[0], tuple(value for pair in ranges for value in pair) + (N, limit)
+    return pages[1], tuple(value for pair in ranges for value in pair + (after,)) + (N, limit)
+
+RELEASE_TITLE = """
+    SELECT r.rid, r.title, r.genre, v.title, v.ep_num, v.length
+    FROM Sessions s, Videos v, Releases r
+    WHERE s.rid = v.rid AND s.ep_num = v.ep_num AND v.rid = r.rid AND s.sid = %s
+    ORDER BY r.title ASC;
+"""
+
+GET_ACTIVE_VIEWERS = """
+    SELECT v.uid, v.first, v.last
+    FROM Viewers v
+    JOIN Sessions s ON v.uid = s.uid
+    WHERE s.initiate_at >= %s AND s.initiate_at <= %s
+    GROUP BY v.uid, v.first, v.last
+    HAVING COUNT(*) >= %s
+    ORDER BY v.uid ASC;
+"""
+
+# Same result as GET_ACTIVE_VIEWERS: whole days come from SessionDaily, the partial days at either
+# end of the range from Sessions
+GET_ACTIVE_VIEWERS_FROM_ROLLUP = """
+    SELECT v.uid, v.first, v.last
+    FROM Viewers v
+    JOIN (
+        SELECT uid, sessions FROM SessionDaily WHERE day >= %s AND day <= %s
+        UNION ALL
+        SELECT uid, 1 FROM Sessions WHERE initiate_at >= %s AND initiate_at < %s
+        UNION ALL
+        SELECT uid, 1 FROM Sessions WHERE initiate_at >= %s AND initiate_at <= %s
+    ) counts ON counts.uid = v.uid
+    GROUP BY v.uid, v.first, v.last
+    HAVING SUM(counts.sessions) >= %s
+    ORDER BY v.uid ASC;
+"""
+
+GET_ACTIVE_VIEWERS_PAGE = """
+    SELECT v.uid, v.first, v.last
+    FROM Viewers v
+    JOIN Sessions s ON v.uid = s.uid
+    WHERE s.initiate_at >= %s AND s.initiate_at <= %s
+    GROUP BY v.uid, v.first, v.last
+    HAVING COUNT(*) >= %s
+    ORDER BY v.uid ASC
+    LIMIT %s;
+"""
+
+# Seeks idx_sessions_uid_initiate past the cursor, so the page reads only the viewers it returns
+GET_ACTIVE_VIEWERS_AFTER = """
+    SELECT v.uid, v.first, v.last
+    FROM Viewers v
+    JOIN Sessions s ON v.uid = s.uid
+    WHERE s.initiate_at >= %s AND s.initiate_at <= %s AND s.uid > %s
+    GROUP BY v.uid, v.first, v.last
+    HAVING COUNT(*) >= %s
+    ORDER BY v.uid ASC
+    LIMIT %s;
+"""
+
+GET_ACTIVE_VIEWERS_FROM_ROLLUP_PAGE = """
+    SELECT v.uid, v.first, v.last
+    FROM Viewers v
+    JOIN (
+        SELECT uid, sessions FROM SessionDaily WHERE day >= %s AND day <= %s
+        UNION ALL
+        SELECT uid, 1 FROM Sessions WHERE initiate_at >= %s AND initiate_at < %s
+        UNION ALL
+        SELECT uid, 1 FROM Sessions WHERE initiate_at >= %s AND initiate_at <= %s
+    ) counts ON counts.uid = v.uid
+    GROUP BY v.uid, v.first, v.last
+    HAVING SUM(counts.sessions) >= %s
+    ORDER BY v.uid ASC
+    LIMIT %s;
+"""
+
+GET_ACTIVE_VIEWERS_FROM_ROLLUP_AFTER = """
+    SELECT v.uid, v.first, v.last
+    FROM Viewers v
+    JOIN (
+        SELECT uid, sessions FROM SessionDaily WHERE day >= %s AND day <= %s AND uid > %s
+        UNION ALL
+        SELECT uid, 1 FROM Sessions WHERE initiate_at >= %s AND initiate_at < %s AND uid > %s
+        UNION ALL
+        SELECT uid, 1 FROM Sessions WHERE initiate_at >= %s AND initiate_at <= %s AND uid > %s
+    ) counts ON counts.uid = v.uid
+    GROUP BY v.uid, v.first, v.last
+    HAVING SUM(counts.sessions) >= %s
+    ORDER BY v.uid ASC
+    LIMIT %s;
+"""
+
+# First page and following pages of each activeViewer query
+ACTIVE_VIEWER_PAGES = {
+    GET_ACTIVE_VIEWERS: (GET_ACTIVE_VIEWERS_PAGE, GET_ACTIVE_VIEWERS_AFTER),
+    GET_ACTIVE_VIEWERS_FROM_ROLLUP: (GET_ACTIVE_VIEWERS_FROM_ROLLUP_PAGE, GET_ACTIVE_VIEWERS_FROM_ROLLUP_AFTER),
+}
+
+VIDEOS_REVIEWED_COUNT = """
+    SELECT v.rid, v.ep_num, v.title, v.length, COUNT(DISTINCT s.uid) AS viewer_count
+    FROM Videos v
+    LEFT JOIN Sessions s ON v.rid = s.rid
+    WHERE v.rid = %s
+    GROUP BY v.rid, v.ep_num, v.title, v.length
+    ORDER BY v.rid DESC;
+"""
+
+# Queries checked by check_query_plans (or functions returning the query and parameters to use), with sample parameters and the table aliases allowed a full scan
+EXPLAIN_QUERIES = {
+    'listReleases': (GET_RELEASES_REVIEWED, (1,), set()),
+    'popularRelease': (lambda k: (popular_releases_query(), (k,)), (10,), {"rel"}),
+    'releaseTitle': (RELEASE_TITLE, (1,), set()),
+    'activeViewer': (active_viewers_query, (1, '2025-01-01', '2025-01-02'), set()),
+    'listReleases --after': (releases_reviewed_query, (1, 10, ('Title', 1)), set()),
+    'popularRelease --after': (lambda k, after: (popular_releases_query(after), after + (k,)), (10, (5, 1)), {"rel"}),
+    'activeViewer --after': (active_viewers_query, (1, '2025-01-01', '2025-01-02', 10, 1), set()),
+    'videosViewed': (lambda rid: (VIDEOS_REVIEWED_COUNT_FROM_EPISODES, (rid, rid))
+                     if SCHEMA_OPTIONS['episode_viewers'] == 'exact' else (VIDEOS_REVIEWED_COUNT, (rid,)), (1,), set()),
+    'usersByGenre': (USERS_BY_GENRE, ('comedy',), set()),
+}
+
+# Commands whose sample range above falls in one month, so a partitioned Sessions must be pruned
+EXPLAIN_PRUNED = {'activeViewer', 'activeViewer --after'}
+
+# Full scans over fewer estimated rows than this are not reported (small tables are scanned by choice)
+EXPLAIN_SCAN_ROWS = 1000
+
+'''
+OUTPUT
+'''
+
+class ThreadOutput:
+    # Stands in for sys.stdout and sends a thread's prints to its own buffer while one is set
+
+    def __init__(self, default):
+        self._default = default
+
+    def _target(self):
+        return getattr(_local, 'output', None) or self._default
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        return self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._default, name)
+
+
+_output_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def capture_output():
+    # Collects everything the current thread prints, without affecting other threads
+    with redirect_output(io.StringIO()) as output:
+        yield output
+
+
+@contextlib.contextmanager
+def redirect_output(stream):
+    # Sends everything the current thread prints to stream instead, without affecting other threads
+    install_thread_output()
+
+    previous = getattr(_local, 'output', None)
+    _local.output = stream
+    try:
+        yield stream
+    finally:
+        _local.output = previous
+
+
+def install_thread_output():
+    # Puts a ThreadOutput in front of sys.stdout once so threads can redirect their own prints
+    with _output_lock:
+        if not isinstance(sys.stdout, ThreadOutput):
+            sys.stdout = ThreadOutput(sys.stdout)
+
+
+class TeeOutput:
+    # Passes writes through to a stream while keeping a copy of the first limit characters
+
+    def __init__(self, stream, limit):
+        self._stream = stream
+        self._parts = []
+        self._size = 0
+        self.limit = limit
+        self.overflow = False
+
+    def write(self, text):
+        if not self.overflow:
+            self._size += len(text)
+            if self._size > self.limit:
+                self.overflow = True
+                self._parts = []
+            else:
+                self._parts.append(text)
+        return self._stream.write(text)
+
+    def flush(self):
+        return self._stream.flush()
+
+    def getvalue(self):
+        return ''.join(self._parts)
+
+
+@contextlib.contextmanager
+def tee_output(limit):
+    # Copies what the current thread prints (up to limit characters) while still printing it
+    install_thread_output()
+
+    previous = getattr(_local, 'output', None)
+    _local.output = TeeOutput(previous or sys.stdout._default, limit)
+    try:
+        yield _local.output
+    finally:
+        _local.output = previous
+
+
+'''
+CACHE
+'''
+
+class QueryCache:
+    # LRU cache of read command output with a time to live
+    # Entries are keyed by (command, *args) and tagged with what they depend on, e.g. ('rid', '5'),
+    # so a write can drop exactly the entries it affects
+
+    def __init__(self, max_entries=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        self._entries = collections.OrderedDict()     # key -> (expires_at, text, tags)
+        self._tagged = collections.defaultdict(set)   # tag -> keys
+        self._version = 0                             # bumped by every invalidation
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        # Returns (text or None, version); pass the version to put() for a miss
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None, self._version
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1], self._version
+
+    def put(self, key, text, tags, version):
+        # Stores a result unless something was invalidated while it was being computed
+        with self._lock:
+            if version != self._version:
+                return
+
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, text, tags)
+            for tag in tags:
+                self._tagged[tag].add(key)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, *tags):
+        # Drops every entry carrying one of tags
+        with self._lock:
+            self._version += 1
+            for tag in tags:
+                for key in list(self._tagged.pop(tag, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+            self._tagged.clear()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            for tag in entry[2]:
+                keys = self._tagged.get(tag)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._tagged[tag]
+
+
+QUERY_CACHE = QueryCache()
+
+
+def cached(command, tags):
+    # Serves repeated calls of a read function from QUERY_CACHE
+    # tags(args, output) returns the tags the result depends on; results of failed calls are not kept
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            # A grouped session sees its own uncommitted writes, which must not be served from or put
+            # into the shared cache
+            if not QUERY_CACHE_ENABLED or cache_deferred():
+                return function(*args, **kwargs)
+
+            key = (command,) + tuple(str(arg) for arg in args) + tuple(f"{name}={value}" for name, value in sorted(kwargs.items()))
+            text, version = QUERY_CACHE.get(key)
+            if text is not None:
+                sys.stdout.write(text)
+                return None
+
+            with tee_output(QUERY_CACHE_MAX_CHARS) as output:
+                result = function(*args, **kwargs)
+
+            if result is not False and not output.overflow:
+                value = output.getvalue()
+                QUERY_CACHE.put(key, value, tags(args, value), version)
+            return result
+
+        return wrapper
+    return decorate
+
+
+def first_column_tags(name, output):
+    # Tags for the ids in the first column of each output line, e.g. ('rid', '5')
+    return {(name, line.split(',', 1)[0]) for line in output.splitlines() if line}
+
+
+def invalidate_cache(*tags):
+    # Called by writes once their changes are committed; ids are compared as text
+    # In a grouped session the real commit is the owner's, so the tags wait for it: invalidating earlier
+    # would let another thread cache the old committed rows under the new version
+    if not QUERY_CACHE_ENABLED:
+        return
+    tags = [(name, str(value)) for name, value in tags]
+    if getattr(_local, 'grouped', False):
+        _local.pending_tags = getattr(_local, 'pending_tags', []) + tags
+    else:
+        QUERY_CACHE.invalidate(*tags)
+
+
+def clear_cache():
+    # Drops every cached result, after the owner's commit in a grouped session like invalidate_cache
+    if getattr(_local, 'grouped', False):
+        _local.pending_clear = True
+    else:
+        QUERY_CACHE.clear()
+
+
+def cache_deferred():
+    # True while this thread writes in a grouped session or has invalidations waiting for a commit
+    return bool(getattr(_local, 'grouped', False) or getattr(_local, 'pending_tags', None)
+                or getattr(_local, 'pending_clear', False))
+
+
+def apply_pending_invalidations():
+    # Applies the clear and tags held back in this thread's grouped session (see invalidate_cache)
+    if getattr(_local, 'pending_clear', False):
+        _local.pending_clear = False
+        _local.pending_tags = []
+        QUERY_CACHE.clear()
+
+    tags = getattr(_local, 'pending_tags', None)
+    if tags:
+        _local.pending_tags = []
+        QUERY_CACHE.invalidate(*tags)
+
+
+def cache_stats():
+    print(f"{QUERY_CACHE.hits},{QUERY_CACHE.misses},{QUERY_CACHE.invalidations},{len(QUERY_CACHE._entries)}")
+
+
+'''
+PROFILING
+'''
+
+# Called with the record of each profiled command (see profile_command); append to add an exporter
+PROFILE_HOOKS = []
+
+_profiling = threading.local()
+_profile_outputs = set()
+_profile_lock = threading.Lock()
+
+
+def statement_key(operation):
+    # SQL text with whitespace collapsed and cut short, to group timings by statement
+    text = ' '.join(str(operation).split())
+    return text if len(text) <= 120 else text[:117] + '...'
+
+
+class CommandProfile:
+    # Wall time per phase (connect, execute, fetch, commit, other), round trips, rows and per-statement
+    # time of one command, filled in through the ProfiledConnection and ProfiledCursor it hands out
+
+    def __init__(self, command, params):
+        self.command = command
+        self.params = [str(param) for param in params]
+        self.start = time.perf_counter()
+        self.result = None
+        self.phases = collections.defaultdict(float)
+        self.round_trips = 0
+        self.rows_read = 0
+        self.rows_written = 0
+        self.statements = {}    # statement_key -> [calls, seconds, rows]
+
+    def add(self, phase, seconds, round_trips=0, statement=None, rows=0):
+        self.phases[phase] += seconds
+        self.round_trips += round_trips
+        if statement is not None:
+            entry = self.statements.setdefault(statement, [0, 0.0, 0])
+            entry[0] += phase == 'execute'
+            entry[1] += seconds
+            entry[2] += rows
+
+    def record(self):
+        # The JSON-ready profile; 'other' is everything outside the database calls (Python work and printing)
+        total = time.perf_counter() - self.start
+        phases = dict(self.phases, other=max(0.0, total - sum(self.phases.values())))
+        return {
+            'command': self.command,
+            'params': self.params,
+            'ok': self.result is not False,
+            'total_ms': total * 1000,
+            'phases_ms': {phase: seconds * 1000 for phase, seconds in phases.items()},
+            'round_trips': self.round_trips,
+            'rows_read': self.rows_read,
+            'rows_written': self.rows_written,
+            'statements': [{'sql': sql, 'calls': calls, 'ms': seconds * 1000, 'rows': rows}
+                           for sql, (calls, seconds, rows) in self.statements.items()],
+        }
+
+
+class ProfiledCursor:
+    # Cursor proxy timing execute and fetch calls into a CommandProfile
+
+    def __init__(self, cursor, profile):
+        self._cursor = cursor
+        self._profile = profile
+        self._statement = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def _executed(self, start, round_trips):
+        # Statements without a result set count their affected rows as written
+        rows = 0
+        if not getattr(self._cursor, 'with_rows', True) and self._cursor.rowcount > 0:
+            rows = self._cursor.rowcount
+            self._profile.rows_written += rows
+        self._profile.add('execute', time.perf_counter() - start, round_trips, self._statement, rows)
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        self._statement = statement_key(operation)
+        start = time.perf_counter()
+        try:
+            return self._cursor.execute(operation, params, *args, **kwargs)
+        finally:
+            self._executed(start, 1)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        # The connector sends INSERT ... VALUES as one multi-row statement and anything else row by row
+        seq_params = list(seq_params)
+        self._statement = statement_key(operation)
+        batched = re.match(r"\s*INSERT\b.*\bVALUES\b", operation, re.IGNORECASE | re.DOTALL)
+        start = time.perf_counter()
+        try:
+            return self._cursor.executemany(operation, seq_params, *args, **kwargs)
+        finally:
+            self._executed(start, 1 if batched else len(seq_params))
+
+    def _fetched(self, start, rows):
+        self._profile.rows_read += rows
+        self._profile.add('fetch', time.perf_counter() - start, 0, self._statement, rows)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._fetched(start, row is not None)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        start = time.perf_counter()
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._fetched(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._fetched(start, len(rows))
+        return rows
+
+
+class ProfiledConnection:
+    # Connection proxy handing out ProfiledCursors and timing commits and rollbacks
+
+    def __init__(self, connection, profile):
+        self._connection = connection
+        self._profile = profile
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def cursor(self, *args, **kwargs):
+        return ProfiledCursor(self._connection.cursor(*args, **kwargs), self._profile)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            return self._connection.commit()
+        finally:
+            self._profile.add('commit', time.perf_counter() - start, 1)
+
+    def rollback(self):
+        start = time.perf_counter()
+        try:
+            return self._connection.rollback()
+        finally:
+            self._profile.add('commit', time.perf_counter() - start, 1)
+
+    def close(self):
+        return self._connection.close()
+
+
+@contextlib.contextmanager
+def profile_command(command, params):
+    # Profiles the connect() calls of one command on this thread when any PROFILE_HOOKS are set
+    # and passes the finished record to each hook; nested commands (batch) get records of their own
+    if not PROFILE_HOOKS:
+        yield None
+        return
+
+    outer = getattr(_profiling, 'profile', None)
+    profile = CommandProfile(command, params)
+    _profiling.profile = profile
+    try:
+        yield profile
+    finally:
+        _profiling.profile = outer
+        record = profile.record()
+        for hook in list(PROFILE_HOOKS):
+            hook(record)
+
+
+class JsonLinesHook:
+    # Profile hook writing each record as one JSON line to a file, or to stderr for '-'
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record)
+        with self._lock:
+            if self.path == '-':
+                print(line, file=sys.stderr)
+            else:
+                with open(self.path, 'a') as file:
+                    file.write(line + '\n')
+
+
+class ProfileHistogram:
+    # Profile hook aggregating command and per-call statement times into histograms with power-of-two
+    # millisecond buckets, so a long-running process (serve) can export them (profileStats)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.commands = {}
+        self.statements = {}
+
+    @staticmethod
+    def bucket(ms):
+        # Upper bound of the bucket holding ms: 1, 2, 4, 8, ...
+        return 1 if ms <= 1 else 2 ** math.ceil(math.log2(ms))
+
+    def _add(self, histograms, name, ms):
+        histogram = histograms.setdefault(name, {'count': 0, 'sum_ms': 0.0, 'buckets': collections.Counter()})
+        histogram['count'] += 1
+        histogram['sum_ms'] += ms
+        histogram['buckets'][self.bucket(ms)] += 1
+
+    def __call__(self, record):
+        with self._lock:
+            self._add(self.commands, record['command'], record['total_ms'])
+            for statement in record['statements']:
+                if statement['calls']:
+                    self._add(self.statements, statement['sql'], statement['ms'] / statement['calls'])
+
+    def snapshot(self):
+        # {'commands': {name: histogram}, 'statements': {sql: histogram}} with buckets as {"le_ms": count}
+        with self._lock:
+            return {
+                kind: {name: dict(histogram, buckets={str(le): count for le, count in sorted(histogram['buckets'].items())})
+                       for name, histogram in histograms.items()}
+                for kind, histograms in (('commands', self.commands), ('statements', self.statements))
+            }
+
+
+PROFILE_HISTOGRAM = ProfileHistogram()
+
+
+def enable_profiling(path=None):
+    # Turns profiling on: records are aggregated into PROFILE_HISTOGRAM and, with a path, written as JSON lines
+    with _profile_lock:
+        if PROFILE_HISTOGRAM not in PROFILE_HOOKS:
+            PROFILE_HOOKS.append(PROFILE_HISTOGRAM)
+        if path and path not in _profile_outputs:
+            _profile_outputs.add(path)
+            PROFILE_HOOKS.append(JsonLinesHook(path))
+
+
+def profile_stats(export_path=None):
+    # Prints the profile histograms of this process as JSON, or writes them to export_path
+    if PROFILE_HISTOGRAM not in PROFILE_HOOKS:
+        print("Profiling is off (--profile or PROJECT_PROFILE)")
+        return False
+
+    snapshot = json.dumps(PROFILE_HISTOGRAM.snapshot())
+    if export_path:
+        with open(export_path, 'w') as file:
+            file.write(snapshot + '\n')
+    else:
+        print(snapshot)
+    return True
+
+
+if PROFILE_PATH:
+    enable_profiling(PROFILE_PATH)
+
+
+'''
+FUNCTIONS
+'''
+
+def fetch_rows(cursor, chunk_size=STREAM_CHUNK_SIZE):
+    # Yields the rows of an unbuffered cursor, fetching chunk_size at a time
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def query_rows(query, params, prepared=False):
+    # Yields the rows of a read query as they arrive, over a connection held until the last row
+    # prepared=True sends it through the statement registry (see prepared_cursor)
+    # The connection may be a replica's, so query must not write
+    connection = connect(read_only=True)
+    cursor = prepared_cursor(connection, query, buffered=False) if prepared else connection.cursor(buffered=False)
+
+    try:
+        cursor.execute(query, params)
+        yield from fetch_rows(cursor)
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def print_rows(rows, chunk_size=STREAM_CHUNK_SIZE):
+    # Writes rows to stdout as comma separated lines, one write per chunk
+    # Only chunk_size rows are held at a time; returns the number of rows written
+    rows = iter(rows)
+    total = 0
+
+    for chunk in iter(lambda: list(itertools.islice(rows, chunk_size)), []):
+        # Same text as print(f"{row[0]},{row[1]},...") for each row
+        sys.stdout.write(''.join(','.join(map(str, row)) + '\n' for row in chunk))
+        total += len(chunk)
+
+    return total
+
+
+def create_tables(triggers=True):
+    # Creates all tables listed under TABLES using the command associated with each table name
+    # Bulk loads pass triggers=False and build the derived tables once the data is in
+
+    try:
+        connection = connect()
+        cursor = connection.cursor()
+
+        # Creates all tables in TABLES by executing their commands (Sessions may be partitioned)
+        for table, command in TABLES.items():
+            cursor.execute(sessions_command() if table == "Sessions" else command)
+
+        # Adds any secondary index from INDEXES the tables are missing
+        ensure_indexes(cursor)
+
+        # Derived tables that are new start out filled from the base tables
+        created = create_derived_tables(cursor)
+        if triggers:
+            rebuild_derived_tables(cursor, created)
+            create_triggers(cursor)
         
         # Commit all edits
         connection.commit()
@@ -160,66 +2113,773 @@ def create_tables():
         connection.close()   
 
 
-def import_data(folder_path):
+def read_csv_rows(file_path):
+    # Yields each row of a .csv file (header skipped) with empty strings replaced by None
+    with open(file_path, 'r', newline='') as f:
+        csv_reader = csv.reader(f)
+        next(csv_reader, None) # Skip headers
+
+        for row in csv_reader:
+            yield [None if item == '' else item for item in row]
+
+
+def bulk_insert_csv(cursor, table, file_path, batch_size=IMPORT_BATCH_SIZE):
+    # Inserts a .csv file into table using multi-row INSERTs of batch_size rows; returns the row count
+    insert_query = None
+    batch = []
+    total = 0
+
+    for row in read_csv_rows(file_path):
+        # The INSERT is built once per table from the width of the first row
+        if insert_query is None:
+            placeholders = ', '.join(['%s'] * len(row))
+            insert_query = f"INSERT INTO {table} VALUES ({placeholders})"
+
+        batch.append(row)
+        if len(batch) >= batch_size:
+            cursor.executemany(insert_query, batch)     # Rewritten by the connector into one multi-row INSERT
+            total += len(batch)
+            batch = []
+
+    if batch:
+        cursor.executemany(insert_query, batch)
+        total += len(batch)
+
+    return total
+
+
+def split_genres(genres):
+    # Splits a ';' separated genres string into its distinct genres, keeping their order and case
+    result = []
+    for genre in (genres or '').split(';'):
+        genre = genre.strip()
+        if genre and genre not in result:
+            result.append(genre)
+    return result
+
+
+def load_user_genres(cursor, file_path, batch_size=IMPORT_BATCH_SIZE, table="UserGenres"):
+    # Fills UserGenres (or a table like it) from the genres column of users.csv; returns the number of pairs inserted
+    insert_query = f"INSERT INTO {table} (uid, genre) VALUES (%s, %s)"
+    batch = []
+    total = 0
+
+    with open(file_path, 'r', newline='') as f:
+        csv_reader = csv.reader(f)
+        headers = next(csv_reader, None) or []
+        uid_index = headers.index('uid') if 'uid' in headers else 0
+        genres_index = headers.index('genres') if 'genres' in headers else -1
+
+        for row in csv_reader:
+            if not row:
+                continue
+            for genre in split_genres(row[genres_index]):
+                batch.append((row[uid_index], genre))
+
+            if len(batch) >= batch_size:
+                cursor.executemany(insert_query, batch)
+                total += len(batch)
+                batch = []
+
+    if batch:
+        cursor.executemany(insert_query, batch)
+        total += len(batch)
+
+    return total
+
+
+def local_infile_enabled(cursor):
+    # Checks whether the server accepts LOAD DATA LOCAL INFILE
+    try:
+        cursor.execute("SELECT @@GLOBAL.local_infile")
+        result = cursor.fetchone()
+        return bool(result and int(result[0]))
+    except mysql.connector.Error:
+        return False
+
+
+def table_columns(cursor, table):
+    # Column names of table in definition order
+    get_columns = """
+        SELECT COLUMN_NAME
+        FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+        ORDER BY ORDINAL_POSITION
+    """
+    cursor.execute(get_columns, (table,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def load_data_infile(cursor, table, file_path):
+    # Loads a .csv file with LOAD DATA LOCAL INFILE (see test_data/load_data_instructions.txt)
+    # Returns the number of rows loaded, or None if the server or client refused the command
+    columns = table_columns(cursor, table)
+
+    # Read every field into a variable so empty strings can become NULL like in bulk_insert_csv
+    variables = ', '.join(f"@c{i}" for i in range(len(columns)))
+    assignments = ', '.join(f"{column} = NULLIF(@c{i}, '')" for i, column in enumerate(columns))
+
+    load_command = f"""
+        LOAD DATA LOCAL INFILE %s INTO TABLE {table}
+        FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' ESCAPED BY ''
+        LINES TERMINATED BY '\\n'
+        IGNORE 1 ROWS
+        ({variables})
+        SET {assignments}
+    """
+
+    try:
+        cursor.execute(load_command, (os.path.abspath(file_path),))
+        rows = cursor.rowcount
+    except mysql.connector.Error as error:
+        print(f"LOAD DATA unavailable for {table}, using batched inserts: {error}", file=sys.stderr)
+        return None
+
+    # With LOCAL the server acts as if IGNORE were given: duplicate keys, orphans and bad values only
+    # warn and the row is dropped or altered, so anything short of a clean load fails like an INSERT would
+    cursor.execute("SELECT @@warning_count")
+    warnings = cursor.fetchone()[0]
+    expected = sum(1 for row in read_csv_rows(file_path))
+    if warnings or rows != expected:
+        cursor.execute("SHOW WARNINGS LIMIT 1")
+        first = cursor.fetchone()
+        detail = f": {first[2]}" if first else ""
+        raise ValueError(f"LOAD DATA loaded {rows} of {expected} rows into {table} with {warnings} warnings{detail}")
+
+    return rows
+
+
+def load_table(cursor, table, folder_path, batch_size=IMPORT_BATCH_SIZE, use_infile=False):
+    # Loads one table from its .csv file in folder_path; returns (rows, method), or None without a file
+    file_path = os.path.join(folder_path, TABLE_CSV[table])
+    if not os.path.exists(file_path):
+        return None
+
+    if table == "UserGenres":
+        return load_user_genres(cursor, file_path, batch_size), f"executemany x{batch_size}"
+
+    if use_infile:
+        rows = load_data_infile(cursor, table, file_path)
+        if rows is not None:
+            return rows, "load data"
+
+    # Fall back to batched inserts when LOAD DATA is disabled or refused
+    return bulk_insert_csv(cursor, table, file_path, batch_size), f"executemany x{batch_size}"
+
+
+def load_table_worker(table, folder_path, batch_size, use_infile, trusted=False):
+    # Runs in a worker process: loads one table over its own connection and commits it
+    # Returns (rows, method, start, end) with wall clock times so the parent can line tables up
+    start = time.time()
+    connection = mysql.connector.connect(**IMPORT_DB_CONFIG)
+    cursor = connection.cursor()
+
+    try:
+        if trusted:
+            set_load_checks(cursor, False)
+        rows, method = load_table(cursor, table, folder_path, batch_size, use_infile)
+        connection.commit()
+    finally:
+        cursor.close()
+        connection.close()
+
+    return rows, method, start, time.time()
+
+
+def parallel_load(folder_path, batch_size, use_infile, workers, trusted=False):
+    # Loads the tables of TABLE_CSV in worker processes, starting each one as soon as its parents are in
+    # Each table commits on its own, so a failure leaves the tables finished before it loaded
+    dependencies = table_dependencies()
+    waiting = [t for t in TABLE_CSV if os.path.exists(os.path.join(folder_path, TABLE_CSV[t]))]
+    running = {}
+    timings = {}
+
+    # spawn keeps the workers from inheriting this process's pooled and session connections
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        while waiting or running:
+            busy = set(waiting) | set(running.values())
+            for table in list(waiting):
+                if not (dependencies.get(table, set()) & (busy - {table})):
+                    future = executor.submit(load_table_worker, table, folder_path, batch_size, use_infile, trusted)
+                    running[future] = table
+                    waiting.remove(table)
+
+            if not running:
+                raise RuntimeError(f"Circular foreign keys between {', '.join(waiting)}")
+
+            finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                table = running.pop(future)
+                rows, method, start, end = future.result()
+                timings[table] = (start, end)
+                report_import_rate(table, rows, end - start, method)
+
+    report_critical_path(timings, dependencies)
+    return timings
+
+
+def report_critical_path(timings, dependencies):
+    # Prints each table's start/end offsets and the chain of tables that bounded the total time
+    # Nothing to report when no table was loaded (a folder without .csv files)
+    if not timings:
+        return
+
+    origin = min(start for start, _ in timings.values())
+    path_time = {}
+    previous = {}
+
+    # Longest chain of load times ending at each table, in finish order (parents always finish first)
+    for table in sorted(timings, key=lambda t: timings[t][1]):
+        start, end = timings[table]
+        parents = [p for p in dependencies.get(table, ()) if p in path_time]
+        slowest = max(parents, key=lambda p: path_time[p], default=None)
+        path_time[table] = (end - start) + (path_time[slowest] if slowest else 0)
+        previous[table] = slowest
+        print(f"{table}: {start - origin:.2f}s -> {end - origin:.2f}s", file=sys.stderr)
+
+    table = max(path_time, key=lambda t: path_time[t])
+    total = path_time[table]
+    path = []
+    while table:
+        path.append(table)
+        table = previous[table]
+
+    print(f"Critical path ({total:.2f}s): {' -> '.join(reversed(path))}", file=sys.stderr)
+
+
+def report_import_rate(table, rows, elapsed, method):
+    # Prints the load rate of one table to stderr so stdout keeps the usual Success/Fail output
+    rate = rows / elapsed if elapsed > 0 else float(rows)
+    print(f"{table}: {rows} rows in {elapsed:.2f}s ({rate:.0f} rows/sec, {method})", file=sys.stderr)
+
+
+def reset_tables(cursor):
+    # Drops every table and creates them again without triggers, ready for a bulk load
+
+    # Delete old tables (foreign keys would otherwise block dropping parents before children)
+    tables = list(TABLES) + list(DERIVED_TABLES)
+
+    cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
+    for table in tables:
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")     # Removes all tables defined under tables
+    cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
+
+    # Creates tables first; derived tables are filled after the load instead of row by row
+    create_tables(triggers=False)
+
+
+def csv_header(file_path):
+    # Returns the header row of a .csv file
+    with open(file_path, 'r', newline='') as f:
+        return next(csv.reader(f), [])
+
+
+def read_csv_from(file_path, offset=0):
+    # Yields (row, byte offset just past the row) for the data rows of a .csv file
+    # offset is a value previously yielded, or 0 to start right after the header
+    with open(file_path, 'rb') as f:
+        header = f.readline()
+        if offset:
+            f.seek(offset)
+
+        while True:
+            line = f.readline()
+            if not line:
+                break
+
+            # A quoted field may span lines; keep reading until the quotes balance
+            while line.count(b'"') % 2:
+                more = f.readline()
+                if not more:
+                    break
+                line += more
+
+            if not line.strip():
+                continue
+
+            row = next(csv.reader([line.decode()]))
+            yield [None if item == '' else item for item in row], f.tell()
+
+
+def import_rows(table, row, header):
+    # The rows a .csv row contributes to table; users.csv rows become one UserGenres row per genre
+    if table != "UserGenres":
+        return [row]
+
+    uid = row[header.index('uid')] if 'uid' in header else row[0]
+    genres = row[header.index('genres')] if 'genres' in header else row[-1]
+    return [(uid, genre) for genre in split_genres(genres)]
+
+
+def read_import_state(state_path, folder_path):
+    # Returns the saved checkpoint for folder_path, or None when there is nothing to resume
+    if not os.path.exists(state_path):
+        return None
+
+    with open(state_path, 'r') as f:
+        state = json.load(f)
+
+    return state if state.get('folder') == os.path.abspath(folder_path) else None
+
+
+def write_import_state(state_path, state):
+    # Replaces the checkpoint file in one step so a crash never leaves half a file
+    temporary_path = state_path + '.tmp'
+    with open(temporary_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(temporary_path, state_path)
+
+
+def import_resumable(folder_path, commit_every, state_path=IMPORT_STATE_FILE, batch_size=IMPORT_BATCH_SIZE):
+    # Streams the .csv files into the tables, committing every commit_every rows and saving a
+    # checkpoint (table, file, byte offset, row number) after each commit
+    # Run again after an interruption to continue from the last checkpoint instead of starting over
+
+    batch_size = min(batch_size, commit_every)
+
+    with session():
+        try:
+            connection = connect()
+            cursor = connection.cursor()
+
+            check_partitioned_sessions(folder_path)
+
+            state = read_import_state(state_path, folder_path)
+            if state is None:
+                reset_tables(cursor)
+                state = {'folder': os.path.abspath(folder_path), 'completed': [],
+                         'table': None, 'file': None, 'offset': 0, 'row': 0}
+                write_import_state(state_path, state)
+            else:
+                print(f"Resuming import at {state['table']} row {state['row']}", file=sys.stderr)
+
+            for table, csv_file in TABLE_CSV.items():
+                file_path = os.path.join(folder_path, csv_file)
+                if table in state['completed'] or not os.path.exists(file_path):
+                    continue
+
+                resuming = state['table'] == table
+                offset = state['offset'] if resuming else 0
+                row_number = state['row'] if resuming else 0
+
+                # Rows committed after the last checkpoint was saved may already be in the table,
+                # so the first batch after resuming skips duplicate keys (only those: unlike INSERT
+                # IGNORE, the no-op update still fails on foreign key and data errors)
+                key = primary_keys()[table][0]
+                skip_duplicates = f" ON DUPLICATE KEY UPDATE {key} = {key}" if resuming and offset else ""
+                header = csv_header(file_path)
+                insert_query = None
+                batch = []
+                uncommitted = 0
+                start = time.perf_counter()
+                loaded = 0
+
+                for row, offset in read_csv_from(file_path, offset):
+                    for values in import_rows(table, row, header):
+                        if insert_query is None:
+                            placeholders = ', '.join(['%s'] * len(values))
+                            columns = " (uid, genre)" if table == "UserGenres" else ""
+                            insert_query = f"INSERT INTO {table}{columns} VALUES ({placeholders})"
+                        batch.append(values)
+
+                    row_number += 1
+                    uncommitted += 1
+
+                    if len(batch) >= batch_size or uncommitted >= commit_every:
+                        if batch:
+                            cursor.executemany(insert_query + skip_duplicates, batch)
+                            loaded += len(batch)
+                            batch = []
+
+                    if uncommitted >= commit_every:
+                        connection.commit()
+                        state.update({'table': table, 'file': csv_file, 'offset': offset, 'row': row_number})
+                        write_import_state(state_path, state)
+                        uncommitted = 0
+
+                        # Later batches are new rows again
+                        skip_duplicates = ""
+
+                if batch:
+                    cursor.executemany(insert_query + skip_duplicates, batch)
+                    loaded += len(batch)
+
+                connection.commit()
+                state['completed'].append(table)
+                state.update({'table': None, 'file': None, 'offset': 0, 'row': 0})
+                write_import_state(state_path, state)
+                report_import_rate(table, loaded, time.perf_counter() - start, f"commit every {commit_every}")
+
+            rebuild_derived_tables(cursor)
+            create_triggers(cursor)
+
+            connection.commit()
+            clear_cache()
+            os.remove(state_path)
+            cursor.close()
+            connection.close()
+            return True
+
+        except Exception as error:
+            print(f"Error in import_resumable as: {error}")
+            connection.rollback()       # Only the rows since the last checkpoint are lost
+            cursor.close()
+            connection.close()
+            return False
+
+
+def validate_csv_files(folder_path, clean_folder, reject_path):
+    # Checks the foreign keys and primary keys of the .csv files in folder_path in memory, streaming each
+    # file once in load order against the keys of the parent rows already accepted
+    # Accepted rows are written to the same file name in clean_folder, the others to reject_path as
+    # file,line,reason,fields...; returns the number of rows rejected
+    references = foreign_keys()
+    keys = primary_keys()
+    columns_of = ddl_columns()
+
+    # Parent table -> {referenced columns: set of accepted values}
+    accepted = collections.defaultdict(dict)
+    for table, table_keys in references.items():
+        for _, parent, parent_columns in table_keys:
+            accepted[parent][tuple(parent_columns)] = set()
+
+    rejected = 0
+    with open(reject_path, 'w', newline='') as reject_file:
+        rejects = csv.writer(reject_file)
+        rejects.writerow(['file', 'line', 'reason'])
+
+        # UserGenres comes from users.csv, which is checked as Users
+        for table in load_order([t for t in TABLE_CSV if t != "UserGenres"]):
+            file_name = TABLE_CSV[table]
+            file_path = os.path.join(folder_path, file_name)
+            if not os.path.exists(file_path):
+                continue
+
+            header = csv_header(file_path)
+            # Columns are found by header name, or by table position when the header names differ
+            position = {column: header.index(column) if column in header else i for i, column in enumerate(columns_of[table])}
+            key_columns = [position[c] for c in keys[table]]
+            checks = [([position[c] for c in columns], accepted[parent][tuple(parent_columns)], parent)
+                      for columns, parent, parent_columns in references[table]]
+            seen = set()
+
+            with open(os.path.join(clean_folder, file_name), 'w', newline='') as clean_file:
+                writer = csv.writer(clean_file, lineterminator='\n')
+                writer.writerow(header)
+
+                for line, row in enumerate(read_csv_rows(file_path), start=2):
+                    key = tuple(row[i] for i in key_columns) if len(row) == len(header) else None
+                    reason = None
+                    if key is None:
+                        reason = f"expected {len(header)} fields"
+                    elif key in seen:
+                        reason = f"duplicate {table} key"
+                    else:
+                        for columns, parent_keys, parent in checks:
+                            value = tuple(row[i] for i in columns)
+                            if None not in value and value not in parent_keys:
+                                reason = f"no {parent} row for {','.join(map(str, value))}"
+                                break
+
+                    if reason:
+                        rejects.writerow([file_name, line, reason] + ['' if v is None else v for v in row])
+                        rejected += 1
+                        continue
+
+                    seen.add(key)
+                    for columns, values in accepted[table].items():
+                        values.add(tuple(row[position[c]] for c in columns))
+                    writer.writerow(['' if v is None else v for v in row])
+
+    return rejected
+
+
+def check_partitioned_sessions(folder_path, reject_path=IMPORT_REJECT_FILE):
+    # A partitioned Sessions has no foreign keys or unique sid (see PARTITIONED_SESSIONS), so before an
+    # import loads it the files are checked in memory; raises ValueError if a sessions.csv row would have
+    # failed against the unpartitioned table
+    file_name = TABLE_CSV["Sessions"]
+    if not SCHEMA_OPTIONS['partition_sessions'] or not os.path.exists(os.path.join(folder_path, file_name)):
+        return
+
+    clean_folder = tempfile.mkdtemp(prefix='import_check_')
+    try:
+        validate_csv_files(folder_path, clean_folder, reject_path)
+    finally:
+        shutil.rmtree(clean_folder, ignore_errors=True)
+
+    with open(reject_path, 'r', newline='') as reject_file:
+        rejected = sum(1 for row in csv.reader(reject_file) if row and row[0] == file_name)
+    if rejected:
+        raise ValueError(f"{rejected} rows of {file_name} have no viewer or video or repeat a sid, see {reject_path}")
+
+
+def set_load_checks(cursor, enabled):
+    # Turns foreign key and unique checks on or off for the connection's session
+    value = 1 if enabled else 0
+    cursor.execute(f"SET FOREIGN_KEY_CHECKS = {value}")
+    cursor.execute(f"SET UNIQUE_CHECKS = {value}")
+
+
+def import_data(folder_path, batch_size=IMPORT_BATCH_SIZE, strategy='auto', workers=1, trusted=False, reject_path=IMPORT_REJECT_FILE):
     # Given a path to .csv files, create tables in memory from data in those .csv files
+    # Runs in one session so create_tables and the loads share a connection
+    # Trusted imports check the keys in memory first, then load the accepted rows with the server's
+    # foreign key and unique checks off; rows that fail go to reject_path instead of stopping the import
+    clean_folder = None
+
+    with import_session():
+        try:
+            connection = connect()          # Connects to local database using configs
+            cursor = connection.cursor()    # MySQL object that can fetch and operate on each row
+
+            # Validated before anything is dropped
+            if trusted:
+                clean_folder = tempfile.mkdtemp(prefix='import_')
+                rejected = validate_csv_files(folder_path, clean_folder, reject_path)
+                if rejected:
+                    print(f"{rejected} rows rejected, see {reject_path}", file=sys.stderr)
+                folder_path = clean_folder
+            else:
+                check_partitioned_sessions(folder_path, reject_path)
+
+            # Delete old tables and create empty ones
+            reset_tables(cursor)
+
+            # LOAD DATA is only attempted when both the server and the chosen strategy allow it
+            use_infile = strategy == 'infile' or (strategy == 'auto' and local_infile_enabled(cursor))
+
+            if trusted:
+                set_load_checks(cursor, False)
+
+            # Import data from all the .csv files, table by table or across worker processes
+            if workers > 1:
+                parallel_load(folder_path, batch_size, use_infile, workers, trusted)
+            else:
+                for table in TABLE_CSV:
+                    start = time.perf_counter()
+                    loaded = load_table(cursor, table, folder_path, batch_size, use_infile)
+                    if loaded is not None:
+                        report_import_rate(table, loaded[0], time.perf_counter() - start, loaded[1])
+
+            if trusted:
+                set_load_checks(cursor, True)
+
+            rebuild_derived_tables(cursor)
+            create_triggers(cursor)
+
+            # Commits all edits
+            connection.commit()         
+            clear_cache()
+            cursor.close()              
+            connection.close()
+            return True
     
+        except Exception as error:
+            print(f"Error in import_data as: {error}")
+            connection.rollback()       # Wipes all edits
+            # The pooled connection must not keep its checks off
+            if trusted:
+                with contextlib.suppress(mysql.connector.Error):
+                    set_load_checks(cursor, True)
+            cursor.close()              
+            connection.close()          
+            return False
+
+        finally:
+            if clean_folder:
+                shutil.rmtree(clean_folder, ignore_errors=True)
+
+
+def row_hash_sql(alias, columns):
+    # Content hash of a row; JSON_ARRAY keeps NULL apart from '' and ('a|b', 'c') apart from ('a', 'b|c')
+    return f"MD5(JSON_ARRAY({', '.join(f'{alias}.{column}' for column in columns)}))"
+
+
+# Staged sessions whose viewer or video is missing, checked once the parent tables are upserted
+DELTA_ORPHAN_SESSIONS = """
+    SELECT COUNT(*)
+    FROM delta_Sessions d
+    LEFT JOIN Viewers v ON v.uid = d.uid
+    LEFT JOIN Videos vi ON vi.rid = d.rid AND vi.ep_num = d.ep_num
+    WHERE (d.uid IS NOT NULL AND v.uid IS NULL)
+       OR (d.rid IS NOT NULL AND d.ep_num IS NOT NULL AND vi.rid IS NULL)
+"""
+
+
+def stage_table(cursor, table, folder_path, batch_size=IMPORT_BATCH_SIZE):
+    # Loads the .csv file of table into a TEMPORARY delta_<table> with its columns and primary key
+    # Returns the number of rows staged
+    stage = f"delta_{table}"
+    key = ', '.join(primary_keys()[table])
+
+    # CREATE ... SELECT rather than LIKE, which would copy the partitioning a temporary table cannot have
+    cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {stage}")
+    cursor.execute(f"CREATE TEMPORARY TABLE {stage} (PRIMARY KEY ({key})) SELECT * FROM {table} LIMIT 0")
+
+    file_path = os.path.join(folder_path, TABLE_CSV[table])
+    if table == "UserGenres":
+        return load_user_genres(cursor, file_path, batch_size, stage)
+    return bulk_insert_csv(cursor, stage, file_path, batch_size)
+
+
+def upsert_staged(cursor, table, key):
+    # Inserts the staged rows whose key is new and updates those whose content hash differs
+    # Returns (inserted, updated)
+    stage = f"delta_{table}"
+    columns = table_columns(cursor, table)
+    match = ' AND '.join(f"t.{column} = d.{column}" for column in key)
+
+    insert_new = f"""
+        INSERT INTO {table} ({', '.join(columns)})
+        SELECT {', '.join(f'd.{column}' for column in columns)}
+        FROM {stage} d
+        LEFT JOIN {table} t ON {match}
+        WHERE t.{key[0]} IS NULL
+    """
+    cursor.execute(insert_new)
+    inserted = cursor.rowcount
+
+    # Tables that are all key (UserGenres) have nothing to update
+    values = [column for column in columns if column not in key]
+    if not values:
+        return inserted, 0
+
+    update_changed = f"""
+        UPDATE {table} t
+        JOIN {stage} d ON {match}
+        SET {', '.join(f't.{column} = d.{column}' for column in values)}
+        WHERE {row_hash_sql('t', columns)} <> {row_hash_sql('d', columns)}
+    """
+    cursor.execute(update_changed)
+    return inserted, cursor.rowcount
+
+
+def delete_unstaged(cursor, table, key, scope=""):
+    # Deletes the rows of table (limited by an extra scope condition on t) with no staged row; returns the count
+    stage = f"delta_{table}"
+    match = ' AND '.join(f"t.{column} = d.{column}" for column in key)
+
+    delete_missing = f"""
+        DELETE t FROM {table} t
+        LEFT JOIN {stage} d ON {match}
+        WHERE d.{key[0]} IS NULL {scope}
+    """
+    cursor.execute(delete_missing)
+    return cursor.rowcount
+
+
+def mark_deleted_rows(cursor, staged):
+    # Fills a TEMPORARY gone_<table> with the keys of the rows delete_missing removes: the rows of the staged
+    # tables missing from their delta_<table>, and every row below them that a cascade would take along
+    # Returns table -> number of rows marked, for the tables with any (the others get no gone_<table>)
+    keys = primary_keys()
+    references = foreign_keys()
+    marked = {}
+
+    for table in load_order(list(TABLES)):
+        key = keys[table]
+        sources = []
+        if table in staged:
+            match = ' AND '.join(f"t.{column} = d.{column}" for column in key)
+            sources.append(f"LEFT JOIN delta_{table} d ON {match} WHERE d.{key[0]} IS NULL")
+        for columns, parent, parent_columns in references[table]:
+            if parent in marked:
+                match = ' AND '.join(f"t.{column} = g.{parent_column}" for column, parent_column in zip(columns, parent_columns))
+                sources.append(f"JOIN gone_{parent} g ON {match}")
+        if not sources:
+            continue
+
+        cursor.execute(f"CREATE TEMPORARY TABLE gone_{table} (PRIMARY KEY ({', '.join(key)})) SELECT {', '.join(key)} FROM {table} LIMIT 0")
+        for source in sources:
+            cursor.execute(f"INSERT IGNORE INTO gone_{table} SELECT {', '.join(f't.{column}' for column in key)} FROM {table} t {source}")
+        cursor.execute(f"SELECT COUNT(*) FROM gone_{table}")
+        count = cursor.fetchone()[0]
+        if count:
+            marked[table] = count
+        else:
+            cursor.execute(f"DROP TEMPORARY TABLE gone_{table}")
+
+    return marked
+
+
+def delete_marked(cursor, table, key):
+    # Deletes the rows of table listed in gone_<table>; returns the count
+    match = ' AND '.join(f"t.{column} = g.{column}" for column in key)
+    cursor.execute(f"DELETE t FROM {table} t JOIN gone_{table} g ON {match}")
+    return cursor.rowcount
+
+
+def import_delta(folder_path, delete_missing=False, batch_size=IMPORT_BATCH_SIZE):
+    # Brings the tables in line with the .csv files in folder_path without dropping them
+    # Rows are matched by primary key: new rows are inserted, rows whose content changed are updated and,
+    # with delete_missing, rows that are no longer in their file are deleted. Tables without a file are
+    # left alone, apart from rows whose parent is deleted. Runs as one transaction and prints per-table
+    # counts to stderr
+    tables = []
+    marked = {}
+
     try:
-        connection = connect()          # Connects to local database using configs
-        cursor = connection.cursor()    # MySQL object that can fetch and operate on each row
+        connection = connect()
+        cursor = connection.cursor()
 
-        # Delete old tables
-        tables = {"movies", "producers", "releases", "reviews", "series", "sessions", "users", "videos", "viewers"}
+        tables = load_order([t for t in TABLE_CSV if os.path.exists(os.path.join(folder_path, TABLE_CSV[t]))])
+        keys = primary_keys()
+        counts = {}
 
+        # Parents are upserted before the rows that reference them
         for table in tables:
-            cursor.execute(f"DROP TABLE IF EXISTS {table}")     # Removes all tables defined under tables
-
-        # Creates tables first 
-        create_tables()
-
-        # Import data from all the .csv files
-        tables_csv = {
-            "Users": "users.csv",
-            "Producers": "producers.csv",
-            "Viewers": "viewers.csv",
-            "Releases": "releases.csv",
-            "Movies": "movies.csv",
-            "Series": "series.csv",
-            "Videos": "videos.csv",               
-            "Reviews": "reviews.csv",
-            "Sessions": "sessions.csv"
-        }
-        
-        for table, csv_file in tables_csv.items():
-            file_path = os.path.join(folder_path, csv_file)
-
-            # Open each .csv file
-            if os.path.exists(file_path):
-                with open(file_path, 'r') as f:
-                    csv_reader = csv.reader(f)
-                    headers = next(csv_reader, None) # Skip headers
-
-                    for row in csv_reader:
-                        # Replace empty strings with None
-                        processed_row = [None if item == '' else item for item in row]
-                        
-                        # Create the placeholders for the INSERT statement
-                        placeholders = ', '.join(['%s'] * len(processed_row))
-                        
-                        # Execute the INSERT statement
-                        insert_query = f"INSERT INTO {table} VALUES ({placeholders})"
-                        cursor.execute(insert_query, processed_row)
-
-        # Commits all edits
-        connection.commit()         
-        cursor.close()              
+            staged = stage_table(cursor, table, folder_path, batch_size)
+            if table == "Sessions" and SCHEMA_OPTIONS['partition_sessions']:
+                # No foreign keys to stop orphans; a repeated sid already failed the staging key
+                cursor.execute(DELTA_ORPHAN_SESSIONS)
+                orphans = cursor.fetchone()[0]
+                if orphans:
+                    raise ValueError(f"{orphans} sessions have no viewer or video")
+            inserted, updated = upsert_staged(cursor, table, keys[table])
+            counts[table] = [inserted, updated, 0, staged - inserted - updated]
+
+        # Every row that goes is deleted explicitly, children first: a cascade would skip the triggers
+        # that keep the derived tables current (and a partitioned Sessions has none to cascade through)
+        # UserGenres mirrors users.csv, so genres dropped from a listed user are removed either way
+        if delete_missing:
+            marked = mark_deleted_rows(cursor, tables)
+            for table in reversed(load_order(list(marked))):
+                counts.setdefault(table, [0, 0, 0, 0])[2] = delete_marked(cursor, table, keys[table])
+        elif "UserGenres" in counts:
+            counts["UserGenres"][2] = delete_unstaged(cursor, "UserGenres", keys["UserGenres"], "AND t.uid IN (SELECT uid FROM delta_Users)")
+
+        # Sessions deleted or moved to another episode leave their episodes' sketches to recompute
+        rebuild_dirty_sketches(cursor)
+
+        for table in tables:
+            cursor.execute(f"DROP TEMPORARY TABLE delta_{table}")
+        for table in marked:
+            cursor.execute(f"DROP TEMPORARY TABLE gone_{table}")
+
+        connection.commit()
+        clear_cache()
+
+        for table in load_order(list(counts)):
+            inserted, updated, deleted, unchanged = counts[table]
+            print(f"{table}: {inserted} inserted, {updated} updated, {deleted} deleted, {unchanged} unchanged", file=sys.stderr)
+
+        cursor.close()
         connection.close()
         return True
-    
+
     except Exception as error:
-        print(f"Error in import_data as: {error}")
-        connection.rollback()       # Wipes all edits
-        cursor.close()              
-        connection.close()          
+        print(f"Error in import_delta as: {error}")
+        connection.rollback()
+        # Temporary tables would otherwise live on with the pooled connection
+        with contextlib.suppress(mysql.connector.Error):
+            for table in tables:
+                cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS delta_{table}")
+            for table in TABLES:
+                cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS gone_{table}")
+        cursor.close()
+        connection.close()
         return False
 
 
@@ -260,6 +2920,12 @@ def insert_viewer(uid, email, nickname, street, city, state, zip, genres, joined
         viewer_params = (uid, subscription, first, last)
         cursor.execute(insert_viewer_command, viewer_params)
 
+        # Insert the user's genres
+        insert_genres_command = "INSERT INTO UserGenres (uid, genre) VALUES (%s, %s)"
+        genre_params = [(uid, genre) for genre in split_genres(genres)]
+        if genre_params:
+            cursor.executemany(insert_genres_command, genre_params)
+
         # Commit all edits
         connection.commit()         
         cursor.close()              
@@ -282,31 +2948,24 @@ def add_genre(uid, genre):
 
         genre = genre.strip().lower()
 
-        get_user = "SELECT genres FROM Users WHERE uid = %s"
-        cursor.execute(get_user, (uid,))
-        result = cursor.fetchone()
+        # One idempotent insert: nothing is added if the user is missing or already has the genre
+        add_user_genre = """
+            INSERT INTO UserGenres (uid, genre)
+            SELECT uid, %s FROM Users WHERE uid = %s
+            ON DUPLICATE KEY UPDATE uid = uid
+        """
+        cursor.execute(add_user_genre, (genre, uid))
 
-        if not result:
+        if cursor.rowcount != 1:
             cursor.close()
             connection.close()
             return False
 
-        current_genres = result[0]
-        if current_genres is None:
-            update_user = "UPDATE Users SET genres = %s WHERE uid = %s"
-            cursor.execute(update_user, (genre, uid))
-            connection.commit()
-        else:
-            list_of_genres = current_genres.split(";")
-            if genre not in list_of_genres:
-                list_of_genres.append(genre)
-                new_list_of_genres = ';'.join(list_of_genres)
-                update_user = "UPDATE Users SET genres = %s WHERE uid = %s"
-                cursor.execute(update_user, (new_list_of_genres, uid))
-                connection.commit()
-            else:
-                return False
+        # Keep the Users.genres text in step; appended in SQL so concurrent calls cannot lose updates
+        update_user = "UPDATE Users SET genres = CONCAT_WS(';', NULLIF(genres, ''), %s) WHERE uid = %s"
+        cursor.execute(update_user, (genre, uid))
 
+        connection.commit()
         cursor.close()
         connection.close()
         return True
@@ -321,6 +2980,21 @@ def add_genre(uid, genre):
 
     
 
+def users_by_genre_rows(genre):
+    # (uid, nickname) of the users with genre, served by idx_user_genres_genre
+    return query_rows(USERS_BY_GENRE, (genre.strip().lower(),))
+
+
+def users_by_genre(genre):
+    try:
+        print_rows(users_by_genre_rows(genre))
+
+    except Exception as e:
+        print(f"Error in users_by_genre: {e}")
+        return False
+
+
+
 def delete_viewer(uid):
     try:
         connection = connect()
@@ -339,7 +3013,46 @@ def delete_viewer(uid):
             connection.close()
             return False
 
+        # Cached results that the cascades below will change: releases the viewer watched or produced
+        affected = []
+        if QUERY_CACHE_ENABLED:
+            get_affected = """
+                SELECT DISTINCT rid FROM Sessions WHERE uid = %s
+                UNION
+                SELECT rid FROM Releases WHERE producer_uid = %s
+            """
+            cursor.execute(get_affected, (uid, uid))
+            affected = [('rid', row[0]) for row in cursor.fetchall()]
+
+        episodes = []
+        if SCHEMA_OPTIONS['episode_viewers'] == 'hll':
+            get_episodes = "SELECT DISTINCT rid, ep_num FROM Sessions WHERE uid = %s"
+            cursor.execute(get_episodes, (uid,))
+            episodes = cursor.fetchall()
+
+        # A partitioned Sessions has no foreign keys for the deletes below to cascade through
+        if SCHEMA_OPTIONS['partition_sessions']:
+            if viewer:
+                delete_sessions = "DELETE FROM Sessions WHERE uid = %s"
+                cursor.execute(delete_sessions, (uid,))
+
+        # Other viewers' sessions of the producer's releases go directly too: the cascade from Producers
+        # would skip the SessionDaily triggers (the viewer's own SessionDaily rows cascade from Viewers)
+        if SCHEMA_OPTIONS['partition_sessions'] or SCHEMA_OPTIONS['session_rollup']:
+            if producer:
+                delete_sessions = """
+                    DELETE s FROM Sessions s
+                    JOIN Releases r ON r.rid = s.rid
+                    WHERE r.producer_uid = %s
+                """
+                cursor.execute(delete_sessions, (uid,))
+
         if viewer:
+            # Reviews are deleted directly so the review count triggers see them (cascades skip triggers)
+            if SCHEMA_OPTIONS['review_counts']:
+                delete_reviews = "DELETE FROM Reviews WHERE uid = %s"
+                cursor.execute(delete_reviews, (uid,))
+
             delete_viewer = "DELETE FROM Viewers WHERE uid = %s"
             cursor.execute(delete_viewer, (uid,))
 
@@ -350,7 +3063,18 @@ def delete_viewer(uid):
         delete_user = "DELETE FROM Users WHERE uid = %s"
         cursor.execute(delete_user, (uid,))
 
+        # Cascaded session deletes skip the sketch triggers, so their episodes are marked here and
+        # recomputed once with those of the explicit deletes
+        if episodes:
+            mark_episode = """
+                INSERT INTO EpisodeSketchDirty (rid, ep_num) VALUES (%s, %s)
+                ON DUPLICATE KEY UPDATE rid = rid
+            """
+            cursor.executemany(mark_episode, [tuple(episode) for episode in episodes])
+        rebuild_dirty_sketches(cursor)
+
         connection.commit()
+        invalidate_cache(('uid', uid), *affected)
         cursor.close()
         connection.close()
         return True
@@ -364,6 +3088,108 @@ def delete_viewer(uid):
 
 
 
+class RowThrottle:
+    # Sleeps as needed to keep the rows passed to wait() at or under rows_per_sec on average (0: no limit)
+
+    def __init__(self, rows_per_sec=DELETE_ROWS_PER_SEC):
+        self.rows_per_sec = rows_per_sec
+        self.start = time.monotonic()
+        self.rows = 0
+
+    def wait(self, rows):
+        self.rows += rows
+        if self.rows_per_sec > 0:
+            delay = self.rows / self.rows_per_sec - (time.monotonic() - self.start)
+            if delay > 0:
+                time.sleep(delay)
+
+    def rate(self):
+        elapsed = time.monotonic() - self.start
+        return self.rows / elapsed if elapsed > 0 else float(self.rows)
+
+
+def delete_in_chunks(connection, cursor, delete_query, params, chunk_size, throttle):
+    # Repeats a DELETE ... LIMIT %s, committing after each chunk so locks are only held for chunk_size rows
+    # Returns the number of rows deleted
+    total = 0
+
+    while True:
+        cursor.execute(delete_query, params + (chunk_size,))
+        deleted = cursor.rowcount
+        rebuild_dirty_sketches(cursor)
+        connection.commit()
+        total += deleted
+        throttle.wait(deleted)
+
+        if deleted < chunk_size:
+            return total
+
+
+def read_uids(source):
+    # Yields uids from a list of uids, or from a file (or '-' for stdin) with one uid per line
+    if len(source) != 1 or (source[0] != '-' and not os.path.isfile(source[0])):
+        yield from source
+        return
+
+    stream = sys.stdin if source[0] == '-' else open(source[0], 'r')
+    try:
+        for line in stream:
+            if line.strip():
+                yield line.strip()
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def delete_viewers(source, chunk_size=DELETE_CHUNK_SIZE, rows_per_sec=DELETE_ROWS_PER_SEC):
+    # Deletes many users like delete_viewer and returns a True/False result per uid
+    # Their sessions and reviews (and those of releases they produced) are deleted first, chunk_size rows
+    # per transaction at no more than rows_per_sec, so the final delete_viewer has little left to cascade
+    # Progress goes to stderr
+    results = []
+    throttle = RowThrottle(rows_per_sec)
+    chunked_deletes = [
+        ("sessions", "DELETE FROM Sessions WHERE uid = %s LIMIT %s"),
+        ("reviews", "DELETE FROM Reviews WHERE uid = %s LIMIT %s"),
+        ("sessions", "DELETE FROM Sessions WHERE rid IN (SELECT rid FROM Releases WHERE producer_uid = %s) LIMIT %s"),
+        ("reviews", "DELETE FROM Reviews WHERE rid IN (SELECT rid FROM Releases WHERE producer_uid = %s) LIMIT %s"),
+    ]
+
+    # One connection for the whole run: the delete_viewer calls share it through the session instead of
+    # borrowing a second pooled connection each
+    with session():
+        try:
+            connection = connect()
+            cursor = connection.cursor()
+
+            for uid in read_uids(source):
+                # Cached results the chunks change; delete_viewer drops the rest once it has run
+                affected = []
+                if QUERY_CACHE_ENABLED:
+                    cursor.execute("SELECT DISTINCT rid FROM Sessions WHERE uid = %s", (uid,))
+                    affected = [('rid', row[0]) for row in cursor.fetchall()]
+
+                deleted = collections.Counter()
+                for kind, delete_query in chunked_deletes:
+                    deleted[kind] += delete_in_chunks(connection, cursor, delete_query, (uid,), chunk_size, throttle)
+                invalidate_cache(('uid', uid), *affected)
+
+                results.append(delete_viewer(uid))
+                print(f"[{len(results)}] uid {uid}: {deleted['sessions']} sessions, {deleted['reviews']} reviews "
+                      f"({throttle.rows} rows at {throttle.rate():.0f} rows/sec)", file=sys.stderr)
+
+            cursor.close()
+            connection.close()
+            return results
+
+        except Exception as e:
+            print(f"Error in delete_viewers as: {e}")
+            connection.rollback()
+            cursor.close()
+            connection.close()
+            return results
+
+
 def insert_movie(rid, website_url):
     # Assumption: Corresponding release record already exists
 
@@ -409,48 +3235,258 @@ def insert_movie(rid, website_url):
 def insert_session(sid, uid, rid, ep_num, initiate_at, leave_at, quality, device):
     try:
         connection = connect()
-        cursor = connection.cursor()
-
-        get_viewer = "SELECT uid FROM Viewers WHERE uid = %s"
-        cursor.execute(get_viewer, (uid,))
 
-        if not cursor.fetchone():
+        # One round trip: the Viewers/Videos foreign keys and the sid primary key do the checking
+        # A partitioned Sessions has neither, so the insert checks them itself and inserts no row
+        statement = INSERT_SESSION_CHECKED if SCHEMA_OPTIONS['partition_sessions'] else INSERT_SESSION
+        cursor = prepared_cursor(connection, statement)
+        try:
+            if statement is INSERT_SESSION_CHECKED:
+                cursor.execute(INSERT_SESSION_CHECKED, (sid, initiate_at, leave_at, quality, device, uid, rid, ep_num, sid))
+                inserted = cursor.rowcount == 1
+            else:
+                cursor.execute(INSERT_SESSION, (sid, uid, rid, ep_num, initiate_at, leave_at, quality, device))
+                inserted = True
+        except mysql.connector.IntegrityError as error:
+            if error.errno not in SESSION_REJECTED_ERRORS:
+                raise
+            inserted = False
+
+        if not inserted:
+            connection.rollback()
             cursor.close()
             connection.close()
             return False
 
-        get_video = "SELECT rid, ep_num FROM Videos WHERE rid = %s AND ep_num = %s"
-        cursor.execute(get_video, (rid, ep_num))
-        if not cursor.fetchone():
-            cursor.close()
-            connection.close()
-            return False
+        connection.commit()
+        invalidate_cache(('rid', rid), ('uid', uid), ('sid', sid))
+
+        cursor.close()
+        connection.close()
+        return True
+
+    except Exception as e:
+        print(f"Error in insert_session as: {e}")
+        connection.rollback()
+        cursor.close()
+        connection.close()
+        return False
+
+
+
+def read_sessions(source):
+    # Yields session rows (sid, uid, rid, ep_num, initiate_at, leave_at, quality, device) from a
+    # sessions .csv file (header optional), '-' for stdin, or any iterable of rows
+    if not isinstance(source, str):
+        yield from source
+        return
+
+    stream = sys.stdin if source == '-' else open(source, 'r', newline='')
+    try:
+        for row in csv.reader(stream):
+            if row and row[0] != 'sid':
+                yield [None if item == '' else item for item in row]
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def session_key(*values):
+    # Normalizes ids from text or the database so they compare equal; None if one is not an integer
+    try:
+        return tuple(int(value) for value in values)
+    except (TypeError, ValueError):
+        return None
+
+
+def insert_session_batch(cursor, rows):
+    # Checks and inserts one batch of sessions; returns a True/False result per row
+    # References are checked with one query per kind for the whole batch instead of per row
+    well_formed = [row for row in rows if len(row) == 8]
+    uids = {session_key(row[1]) for row in well_formed} - {None}
+    videos = {session_key(row[2], row[3]) for row in well_formed} - {None}
+    sids = {session_key(row[0]) for row in well_formed} - {None}
+
+    known_viewers, known_videos, taken_sids = set(), set(), set()
+    if uids:
+        cursor.execute(f"SELECT uid FROM Viewers WHERE uid IN ({', '.join(['%s'] * len(uids))})",
+                       [key[0] for key in uids])
+        known_viewers = {session_key(row[0]) for row in cursor.fetchall()}
+    if videos:
+        cursor.execute(f"SELECT rid, ep_num FROM Videos WHERE (rid, ep_num) IN ({', '.join(['(%s, %s)'] * len(videos))})",
+                       [value for key in videos for value in key])
+        known_videos = {session_key(row[0], row[1]) for row in cursor.fetchall()}
+    if sids:
+        cursor.execute(f"SELECT sid FROM Sessions WHERE sid IN ({', '.join(['%s'] * len(sids))})",
+                       [key[0] for key in sids])
+        taken_sids = {session_key(row[0]) for row in cursor.fetchall()}
+
+    results = []
+    valid = []
+    for row in rows:
+        sid = session_key(row[0]) if len(row) == 8 else None
+        ok = (sid is not None and sid not in taken_sids
+              and session_key(row[1]) in known_viewers and session_key(row[2], row[3]) in known_videos)
+        if ok:
+            taken_sids.add(sid)     # A repeated sid later in the batch fails like a duplicate
+            valid.append(row)
+        results.append(ok)
+
+    if not valid:
+        return results
+
+    try:
+        cursor.executemany(INSERT_SESSION, valid)
+    except mysql.connector.Error:
+        # Something the checks above cannot see (e.g. a bad enum value or a concurrent delete):
+        # redo the batch row by row so only the offending rows fail
+        cursor.execute("ROLLBACK TO SAVEPOINT session_batch")
+        for index, row in enumerate(rows):
+            if results[index]:
+                try:
+                    cursor.execute(INSERT_SESSION, row)
+                except mysql.connector.Error:
+                    results[index] = False
+
+    return results
+
+
+def insert_sessions(source, batch_size=IMPORT_BATCH_SIZE):
+    # Inserts many sessions, batch_size at a time, and returns a True/False result per row in input order
+    results = []
+
+    try:
+        connection = connect()
+        cursor = connection.cursor()
+
+        batch = []
+        for row in read_sessions(source):
+            batch.append(list(row))
+            if len(batch) >= batch_size:
+                cursor.execute("SAVEPOINT session_batch")
+                results += insert_session_batch(cursor, batch)
+                connection.commit()
+                batch = []
+
+        if batch:
+            cursor.execute("SAVEPOINT session_batch")
+            results += insert_session_batch(cursor, batch)
+            connection.commit()
+
+        # Too many keys to drop one by one
+        clear_cache()
+
+        cursor.close()
+        connection.close()
+        return results
+
+    except Exception as e:
+        print(f"Error in insert_sessions as: {e}")
+        connection.rollback()
+        cursor.close()
+        connection.close()
+        return results
+
+
+
+def archive_partition(connection, name, file_path):
+    # Writes the rows of one Sessions partition to a sessions .csv file; returns the number of rows
+    # The file is written under a temporary name and only renamed once complete
+    cursor = connection.cursor(buffered=False)
+    cursor.execute(f"SELECT * FROM Sessions PARTITION ({name})")
+    total = 0
+
+    with open(file_path + '.tmp', 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(cursor.column_names)
+        while True:
+            rows = cursor.fetchmany(STREAM_CHUNK_SIZE)
+            if not rows:
+                break
+            writer.writerows(rows)
+            total += len(rows)
 
-        get_session = "SELECT sid FROM Sessions WHERE sid = %s"
-        cursor.execute(get_session, (sid,))
-        if cursor.fetchone():
+    cursor.close()
+    os.replace(file_path + '.tmp', file_path)
+    return total
+
+
+def maintain_partitions(ahead=SESSION_PARTITIONS_AHEAD, retain=None, archive_folder=None):
+    # Adds monthly Sessions partitions up to `ahead` months past the current one
+    # With retain, partitions entirely older than the last `retain` months are removed: archived to
+    # <archive_folder>/sessions_<partition>.csv and dropped, or without a folder detached into a
+    # Sessions_<partition> table
+    try:
+        connection = connect()
+        cursor = connection.cursor()
+
+        partitions = session_partitions(cursor)
+        if not partitions:
+            print("Sessions is not partitioned")
             cursor.close()
             connection.close()
             return False
 
-        insert_session = "INSERT INTO Sessions (sid, uid, rid, ep_num, initiate_at, leave_at, quality, device) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
-        cursor.execute(insert_session, (sid, uid, rid, ep_num, initiate_at, leave_at, quality, device))
+        this_month = add_months(datetime.date.today(), 0)
 
-        connection.commit()
+        # New months are split off p_future, which only holds sessions dated past every monthly partition
+        month = max(bound for name, bound in partitions if bound)
+        added = []
+        while month <= add_months(this_month, ahead):
+            added.append(month)
+            month = add_months(month, 1)
+
+        if added:
+            definitions = ", ".join(partition_definition(month) for month in added)
+            cursor.execute(f"""
+                ALTER TABLE Sessions REORGANIZE PARTITION p_future INTO (
+                    {definitions}, PARTITION p_future VALUES LESS THAN (MAXVALUE)
+                )
+            """)
+            for month in added:
+                print(f"added,{partition_name(month)}")
+
+        removed = []
+        if retain is not None:
+            cutoff = add_months(this_month, -retain)
+            for name, bound in partitions:
+                if bound is None or bound > cutoff:
+                    continue
+
+                if archive_folder:
+                    file_path = os.path.join(archive_folder, f"sessions_{name}.csv")
+                    rows = archive_partition(connection, name, file_path)
+                    cursor.execute(f"ALTER TABLE Sessions DROP PARTITION {name}")
+                    print(f"archived,{name},{file_path},{rows}")
+                else:
+                    # EXCHANGE needs an empty, unpartitioned table of the same layout
+                    archive_table = f"Sessions_{name}"
+                    cursor.execute(f"CREATE TABLE {archive_table} LIKE Sessions")
+                    cursor.execute(f"ALTER TABLE {archive_table} REMOVE PARTITIONING")
+                    cursor.execute(f"ALTER TABLE Sessions EXCHANGE PARTITION {name} WITH TABLE {archive_table}")
+                    cursor.execute(f"ALTER TABLE Sessions DROP PARTITION {name}")
+                    print(f"detached,{name},{archive_table}")
+                removed.append(name)
+
+        # Dropping partitions skips the triggers, so tables derived from Sessions are recomputed
+        if removed:
+            rebuild_derived_tables(cursor, [table for table, spec in enabled_derived_tables().items()
+                                            if spec['source'] == 'Sessions'])
+            connection.commit()
+            clear_cache()
 
         cursor.close()
         connection.close()
         return True
 
-    except Exception as e:
-        print(f"Error in insert_session as: {e}")
+    except Exception as error:
+        print(f"Error in maintain_partitions as: {error}")
         connection.rollback()
         cursor.close()
         connection.close()
         return False
 
 
-
 def update_release(rid, title):
     try:
         connection = connect()
@@ -478,6 +3514,7 @@ def update_release(rid, title):
         cursor.execute(update_release_q,(title,rid))
 
         connection.commit()
+        invalidate_cache(('rid', rid))
         cursor.close()
         connection.close()
         return True
@@ -491,199 +3528,567 @@ def update_release(rid, title):
 
 
 
-def get_releases_reviewed(uid):
-    try:
-        connection = connect()
-        cursor = connection.cursor()
-
-        # Get releases for a viewer
-        get_releases_reviewed_command = """
-            SELECT DISTINCT r.rid, r.genre, r.title
-            FROM Releases r
-            JOIN Reviews rv ON r.rid = rv.rid
-            WHERE rv.uid = %s
-            ORDER BY r.title ASC;
-        """
-        
-        cursor.execute(get_releases_reviewed_command, (uid,))
-        results = cursor.fetchall()
+def releases_reviewed_rows(uid, limit=None, after=None):
+    # (rid, genre, title) of the releases a viewer reviewed, by title
+    # limit and after = (title, rid) of the last row shown return one page, ordered by title then rid
+    query, params = releases_reviewed_query(uid, limit, after)
+    return query_rows(query, params, prepared=True)
 
-        cursor.close()
-        connection.close()
 
-        # Check if results exists and print
-        if results:
-            for row in results:
-                print(f"{row[0]},{row[1]},{row[2]}")
+@cached('listReleases', lambda args, output: {('uid', str(args[0]))} | first_column_tags('rid', output))
+def get_releases_reviewed(uid, limit=None, after=None):
+    try:
+        # Get releases for a viewer and print them as they arrive
+        print_rows(releases_reviewed_rows(uid, limit, after))
     
     except Exception as error:
         print(f"Error in get_releases_reviewed as: {error}")
-        cursor.close()
-        connection.close()
-
+        return False
 
 
-def get_popular_releases(k):
-    try:
-        connection = connect()
-        cursor = connection.cursor()
-    
-        get_releases = """
-                            SELECT rel.rid, rel.title, COUNT(rev.rvid) AS total
-                            FROM Releases rel, Reviews rev
-                            WHERE rel.rid = rev.rid
-                            GROUP BY rel.rid, rel.title
-                            ORDER BY total DESC, rel.rid DESC
-                        """
 
-        cursor.execute(get_releases)
-        names = cursor.fetchall()
+def popular_releases_rows(k, after=None):
+    # (rid, title, total) of the k most reviewed releases; the top k is cut in SQL so only k rows come back
+    # With after = (total, rid) of the last row shown, the k releases ranked after it
+    if after is None:
+        return query_rows(popular_releases_query(), (max(int(k), 0),))
+    return query_rows(popular_releases_query(after), (after[0], after[1], max(int(k), 0)))
 
-        if names:
-            for row in names[:int(k)]:
-                print(f"{row[0]},{row[1]},{row[2]}")
 
-        cursor.close()
-        connection.close()
+def get_popular_releases(k, after=None):
+    try:
+        print_rows(popular_releases_rows(k, after))
     
     except Exception as e:
         print(f"Error in get_popular_releases as: {e}")
-        connection.rollback()
-        cursor.close()
-        connection.close()
         return False
 
 
 
-def release_title(sid):
-    try:
-        connection = connect()
-        cursor = connection.cursor()
-
-        get_titles = """
-                    SELECT r.rid, r.title, r.genre, v.title, v.ep_num, v.length
-                    FROM Sessions s, Videos v, Releases r
-                    WHERE s.rid = v.rid AND s.ep_num = v.ep_num AND v.rid = r.rid AND s.sid = %s
-                    ORDER BY r.title ASC;
-                """
-        
-        cursor.execute(get_titles, (sid,))
-        titles = cursor.fetchall()
+def release_title_rows(sid):
+    # (rid, release title, genre, video title, ep_num, length) of the video watched in session sid
+    return query_rows(RELEASE_TITLE, (sid,), prepared=True)
 
-        if titles:
-            for row in titles:
-                print(f"{row[0]},{row[1]},{row[2]},{row[3]},{row[4]},{row[5]}")
 
-        cursor.close()
-        connection.close()
+@cached('releaseTitle', lambda args, output: {('sid', str(args[0]))} | first_column_tags('rid', output))
+def release_title(sid):
+    try:
+        print_rows(release_title_rows(sid))
 
     except Exception as e:
         print(f"Error in release_title as: {e}")
-        connection.rollback()
-        cursor.close()
-        connection.close()
         return False
 
 
 
-def get_active_viewers(N, start_date, end_date):
+def active_viewers_rows(N, start_date, end_date, limit=None, after=None):
+    # (uid, first, last) of the viewers with at least N sessions started in [start_date, end_date]
+    # limit and after = the last uid shown return one page
+    query, params = active_viewers_query(N, start_date, end_date, limit, after)
+    return query_rows(query, params, prepared=True)
+
+
+def get_active_viewers(N, start_date, end_date, limit=None, after=None):
     try:
-        connection = connect()
-        cursor = connection.cursor()
-        
-        get_active_viewers_command = """
-            SELECT v.uid, v.first, v.last
-            FROM Viewers v
-            JOIN Sessions s ON v.uid = s.uid
-            WHERE s.initiate_at >= %s AND s.initiate_at <= %s
-            GROUP BY v.uid, v.first, v.last
-            HAVING COUNT(*) >= %s
-            ORDER BY v.uid ASC;
-        """
-        
-        cursor.execute(get_active_viewers_command, (start_date, end_date, N))
-        rows = cursor.fetchall()
-        
         # Print each row in CSV format: uid,first,last
-        for row in rows:
-            print(f"{row[0]},{row[1]},{row[2]}")
-
-        cursor.close()
-        connection.close()
+        print_rows(active_viewers_rows(N, start_date, end_date, limit, after))
     
     except Exception as e:
         print(f"Error in get_active_viewers: {e}")
-        connection.rollback()
-        cursor.close()
-        connection.close()
+        return False
 
 
 
-def videos_reviewed_count(rid):
-    try:
-        connection = connect()
-        cursor = connection.cursor()
-        
-        videos_reviewed_count_command = """
-            SELECT v.rid, v.ep_num, v.title, v.length, COUNT(DISTINCT s.uid) AS viewer_count
-            FROM Videos v
-            LEFT JOIN Sessions s ON v.rid = s.rid
-            WHERE v.rid = %s
-            GROUP BY v.rid, v.ep_num, v.title, v.length
-            ORDER BY v.rid DESC;
-        """
-        
-        cursor.execute(videos_reviewed_count_command, (rid,))
-        rows = cursor.fetchall()
+def hll_estimate(ranks):
+    # HyperLogLog cardinality estimate from {register: rank}, with the small range correction
+    registers = 2 ** HLL_PRECISION
+    alpha = 0.7213 / (1 + 1.079 / registers)
+    total = sum(2.0 ** -ranks.get(register, 0) for register in range(registers))
+    estimate = alpha * registers * registers / total
 
-        for row in rows:
-            print(f"{row[0]},{row[1]},{row[2]},{row[3]},{row[4]}")
+    empty = registers - len(ranks)
+    if estimate <= 2.5 * registers and empty:
+        estimate = registers * math.log(registers / empty)
+    return round(estimate)
 
-        cursor.close()
-        connection.close()
+
+def videos_viewed_rows(rid):
+    # (rid, ep_num, title, length, viewer_count) for each video of a release, where viewer_count is the
+    # release's distinct viewers, counted from Sessions or EpisodeViewers or estimated from the sketches
+    mode = SCHEMA_OPTIONS['episode_viewers']
+    if mode == 'exact':
+        return query_rows(VIDEOS_REVIEWED_COUNT_FROM_EPISODES, (rid, rid))
+    if mode != 'hll':
+        return query_rows(VIDEOS_REVIEWED_COUNT, (rid,))
+
+    # Approximate: merge the episode sketches of the release and estimate once
+    viewers = hll_estimate(dict(query_rows(RELEASE_SKETCH, (rid,))))
+    return (tuple(row) + (viewers,) for row in query_rows(RELEASE_VIDEOS, (rid,)))
+
+
+@cached('videosViewed', lambda args, output: {('rid', str(args[0]))})
+def videos_reviewed_count(rid):
+    try:
+        print_rows(videos_viewed_rows(rid))
     
     except Exception as e:
         print(f"Error in videos_reviewed_count: {e}")
-        connection.rollback()
+        return False
+
+
+
+def split_options(args):
+    # Separates "--name value" pairs from positional parameters
+    # Everything after a bare "--" is positional, e.g. a title or body that starts with "--"
+    params = []
+    options = {}
+    i = 0
+    while i < len(args):
+        if args[i] == '--':
+            params.extend(args[i + 1:])
+            break
+        if args[i].startswith('--') and i + 1 < len(args):
+            options[args[i][2:]] = args[i + 1]
+            i += 2
+        else:
+            params.append(args[i])
+            i += 1
+    return params, options
+
+
+def split_cursor(text, parts=1):
+    # Parses an --after cursor, the ordering key of the last row of the previous page: "uid", "title,rid"
+    # or "total,rid". Only the last comma splits a two part key, since titles may contain commas
+    if text is None:
+        return None
+    return text if parts == 1 else tuple(text.rsplit(',', 1))
+
+
+
+def check_query_plans(min_rows=EXPLAIN_SCAN_ROWS):
+    # Runs EXPLAIN on each query in EXPLAIN_QUERIES and returns a list of (command, table, rows) full scans
+    # With a partitioned Sessions, the commands in EXPLAIN_PRUNED reading every partition are listed too
+
+    connection = connect()
+    cursor = connection.cursor(dictionary=True)
+    scans = []
+
+    try:
+        partitions = []
+        if SCHEMA_OPTIONS['partition_sessions']:
+            plain = connection.cursor()
+            partitions = session_partitions(plain)
+            plain.close()
+
+        for command, (query, params, allowed) in EXPLAIN_QUERIES.items():
+            if callable(query):
+                query, params = query(*params)
+
+            cursor.execute("EXPLAIN " + query, params)
+            for step in cursor.fetchall():
+                rows = step['rows'] or 0
+                if step['type'] == 'ALL' and step['table'] not in allowed and rows >= min_rows:
+                    scans.append((command, step['table'], rows))
+
+                # Only partitioned tables have a partitions column
+                read = step.get('partitions')
+                if command in EXPLAIN_PRUNED and read and len(partitions) > 1 and len(read.split(',')) == len(partitions):
+                    scans.append((command, step['table'], f"all {len(partitions)} partitions"))
+    finally:
         cursor.close()
         connection.close()
 
+    return scans
 
 
-def main():
-    # Error with user syntax
-    if len(sys.argv) < 2:
-        print("Please use the syntax: python3 project.py <function> [param1] [param2] ...")
-        return
-    
-    function_name = sys.argv[1]     # Collects the function to be executed
-    params = sys.argv[2:]           # Everything after are the parameters
+def explain_queries():
+    # Prints one line per full scan found by check_query_plans; Fail means an index is not being used
+    try:
+        scans = check_query_plans()
+    except Exception as error:
+        print(f"Error in explain_queries as: {error}")
+        return False
 
-    # Available functions
-    functions = {
-        'import': lambda: import_data(params[0]),
+    for command, table, rows in scans:
+        print(f"{command},{table},{rows}")
+
+    return not scans
+
+
+def replica_status():
+    # Reads each replica's lag now and prints name,lag,usable (lag is "stopped" when replication is not
+    # running); Fail when no replica can take reads, so every query command would go to the primary
+    replicas = get_replicas()
+    if not replicas:
+        print("No replicas configured")
+        return False
+
+    usable = 0
+    for replica in replicas:
+        try:
+            connection = replica.pool.acquire()
+            try:
+                lag = replica.measure(connection)
+            finally:
+                connection.close()
+        except mysql.connector.Error as error:
+            replica.reading = (None, time.monotonic())
+            print(f"{replica.name()},unreachable,no,{error}")
+            continue
+
+        if replica.usable():
+            usable += 1
+        print(f"{replica.name()},{'stopped' if lag is None else lag},{'yes' if replica.usable() else 'no'}")
+
+    return usable > 0
+
+
+
+class WriteCoalescer:
+    # Runs writes (e.g. insert_session, insert_viewer) queued by many threads on one connection and
+    # commits them in groups: a group closes after max_rows writes or interval seconds, whichever is first
+    # Each write gets its own savepoint, so a failed write does not undo the rest of its group
+
+    def __init__(self, max_rows=GROUP_COMMIT_ROWS, interval=GROUP_COMMIT_INTERVAL):
+        self.max_rows = max_rows
+        self.interval = interval
+        self._queue = queue.Queue()
+        self._closed = False
+        self._error = None          # What stopped the writer thread, if it failed
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="write-coalescer", daemon=True)
+        self._thread.start()
+
+    def submit(self, function, *args):
+        # Queues function(*args); the returned Future gets its result once the group is committed
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._error is not None:
+                raise RuntimeError(f"WriteCoalescer stopped: {self._error}")
+            if self._closed:
+                raise RuntimeError("WriteCoalescer is closed")
+            # The commit happens on the writer thread but counts for the caller queuing the write
+            self._queue.put((function, args, future, current_writer()))
+        return future
+
+    def close(self):
+        # Flushes everything queued so far and stops the writer thread
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self):
+        group = []
+        try:
+            self._write_groups(group)
+        except (Exception, SystemExit) as error:
+            # e.g. no connection for the session, or a rollback on a dead connection: everything
+            # pending fails instead of waiting forever, and later submits are refused
+            with self._lock:
+                self._error = error
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    group.append(item)
+            for _, _, future, _ in group:
+                if not future.done():
+                    future.set_exception(error)
+
+    def _write_groups(self, group):
+        # group is filled in place so _run can fail the writes of a group that did not finish
+        with session(grouped=True) as connection:
+            stopping = False
+            while not stopping:
+                group.clear()
+                item = self._queue.get()
+                if item is None:
+                    break
+
+                group.append(item)
+                deadline = time.monotonic() + self.interval
+                while len(group) < self.max_rows:
+                    try:
+                        item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stopping = True
+                        break
+                    group.append(item)
+
+                self._flush(connection, group)
+
+    def _flush(self, connection, group):
+        outcomes = []
+
+        for function, args, future, writer in group:
+            try:
+                connection.consume_results()
+                connection.cmd_query("SAVEPOINT batch_command")
+                with writes_as(writer):
+                    outcomes.append((future, function(*args), None))
+            except (Exception, SystemExit) as error:
+                SessionConnection(connection, grouped=True).rollback()
+                outcomes.append((future, None, error))
+
+        # One commit (one log flush) for the whole group; results are only reported once it is durable
+        try:
+            connection.commit()
+            for _, _, _, writer in group:
+                note_write(writer)
+        except mysql.connector.Error as error:
+            connection.rollback()
+            outcomes = [(future, None, error) for future, _, _ in outcomes]
+
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+
+# Positional parameters and --options of each command that name files or folders, resolved against
+# the client's working directory when the command comes over the socket (see client_paths)
+PATH_ARGUMENTS = {
+    'import': ([0], ['rejects', 'state']),
+    'importDelta': ([0], []),
+    'insertSessions': ([0], []),
+    'deleteViewers': ([0], []),
+    'batch': ([0], []),
+    'maintainPartitions': ([], ['archive']),
+    'profileStats': ([], ['export']),
+}
+
+# Commands reading stdin when given no file or '-', which the server cannot do for a client
+STDIN_COMMANDS = {'insertSessions', 'deleteViewers', 'batch'}
+
+
+def client_paths(function_name, params, options, cwd):
+    # Returns params and options with relative paths joined to cwd, so a command sent by client.py reads
+    # and writes the same files as when run directly; raises ValueError for a stdin source
+    if function_name in STDIN_COMMANDS and (not params or params[0] == '-'):
+        raise ValueError(f"{function_name} cannot read stdin through the server, pass a file")
+
+    params, options = list(params), dict(options)
+    positions, names = PATH_ARGUMENTS.get(function_name, ([], []))
+    for i in positions:
+        if i < len(params):
+            path = os.path.join(cwd, params[i])
+            # deleteViewers takes uids unless its only parameter is a file (see read_uids)
+            if function_name != 'deleteViewers' or (len(params) == 1 and os.path.isfile(path)):
+                params[i] = path
+    for name in names:
+        if name in options:
+            options[name] = os.path.join(cwd, options[name])
+
+    return params, options
+
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    # Runs one command forwarded by client.py and sends back exactly what it printed
+    # Requests are {"cwd": client directory, "args": argv}; paths in the command and in the commands of
+    # a batch file are taken relative to cwd
+    # Output goes to the socket as it is printed, a buffer at a time, so long listings stream to the client
+
+    def handle(self):
+        output = io.TextIOWrapper(self.wfile, encoding='utf-8', newline='\n')
+        try:
+            with redirect_output(output):
+                try:
+                    request = json.loads(self.rfile.readline())
+                    args = request['args']
+                    function_name = args[0]
+                    params, options = split_options(args[1:])
+                    _local.client_cwd = request['cwd']
+
+                    if function_name == 'serve':
+                        print("Unknown function entered: serve")
+                    else:
+                        dispatch(function_name, params, options)
+
+                # connect() exits on connection errors; the server keeps running
+                except (Exception, SystemExit) as error:
+                    print(f"Error in server command: {error}")
+
+                finally:
+                    _local.client_cwd = None
+
+            output.flush()
+
+        # The client went away mid-command; nothing is left to send it
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+        finally:
+            # Leaves wfile open for the server to close
+            with contextlib.suppress(OSError, ValueError):
+                output.detach()
+
+
+
+def serve_commands(socket_path=SOCKET_PATH, cache=True):
+    # Keeps pooled connections warm and answers commands from client.py on a Unix socket
+    # The query cache is on for the server's lifetime unless cache is False
+    global QUERY_CACHE_ENABLED
+    QUERY_CACHE_ENABLED = cache
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    # Open the first connection now so the first client call is already warm
+    connect().close()
+
+    server = socketserver.ThreadingUnixStreamServer(socket_path, CommandHandler)
+    server.daemon_threads = True
+    print(f"Listening on {socket_path}", file=sys.stderr)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+        close_pools()
+
+
+
+def run_batch(source='-', commit_every=1):
+    # Runs one command per line from a file (or stdin for '-') over a single connection
+    # Work is committed every commit_every commands; a failing command only undoes its own writes
+
+    stream = sys.stdin if source == '-' else open(source, 'r')
+
+    try:
+        with session(grouped=True) as connection:
+            pending = 0
+
+            for line in stream:
+                args = shlex.split(line, comments=True)
+                if not args:
+                    continue
+
+                function_name = args[0]
+                params, options = split_options(args[1:])
+
+                # Each command gets a savepoint for SessionConnection.rollback() to return to
+                connection.consume_results()
+                connection.cmd_query("SAVEPOINT batch_command")
+
+                try:
+                    dispatch(function_name, params, options)
+                except Exception as error:
+                    print(f"Error in batch command {function_name}: {error}")
+                    SessionConnection(connection, grouped=True).rollback()
+
+                pending += 1
+                if pending >= commit_every:
+                    connection.commit()
+                    pending = 0
+
+            connection.commit()
+
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+
+def command_table(params, options):
+    # Command name -> function running it with the given parameters and --options
+    return {
+        'import': lambda: import_resumable(params[0], int(options['commit-every']), options.get('state', IMPORT_STATE_FILE), int(options.get('batch-size', IMPORT_BATCH_SIZE)))
+                          if 'commit-every' in options else
+                          import_data(params[0], int(options.get('batch-size', IMPORT_BATCH_SIZE)), options.get('strategy', 'auto'), int(options.get('workers', 1)),
+                                      options.get('trusted', 'no').lower() in ('yes', 'true', '1'), options.get('rejects', IMPORT_REJECT_FILE)),
+        'importDelta': lambda: import_delta(params[0], options.get('delete-missing', 'no').lower() in ('yes', 'true', '1'),
+                                            int(options.get('batch-size', IMPORT_BATCH_SIZE))),
         'insertViewer': lambda: insert_viewer(params[0], params[1], params[2], params[3], params[4], params[5], params[6], params[7], params[8], params[9], params[10], params[11]),
         'insertMovie': lambda: insert_movie(params[0], params[1]),
         'updateRelease': lambda: update_release(params[0], params[1]),
-        'listReleases': lambda: get_releases_reviewed(params[0]),
+        'listReleases': lambda: get_releases_reviewed(params[0], options.get('limit'), split_cursor(options.get('after'), 2)),
         'addGenre': lambda: add_genre(params[0], params[1]),
+        'usersByGenre': lambda: users_by_genre(params[0]),
         'deleteViewer': lambda: delete_viewer(params[0]),
+        'deleteViewers': lambda: delete_viewers(params or ['-'], int(options.get('chunk-size', DELETE_CHUNK_SIZE)),
+                                                float(options.get('rows-per-sec', DELETE_ROWS_PER_SEC))),
         'insertSession': lambda: insert_session(params[0], params[1], params[2], params[3], params[4], params[5], params[6], params[7]),
-        'popularRelease': lambda: get_popular_releases(params[0]),
+        'insertSessions': lambda: insert_sessions(params[0] if params else '-', int(options.get('batch-size', IMPORT_BATCH_SIZE))),
+        'popularRelease': lambda: get_popular_releases(options['limit'] if 'limit' in options else params[0], split_cursor(options.get('after'), 2)),
         'releaseTitle': lambda: release_title(params[0]),
-        'activeViewer': lambda: get_active_viewers(params[0], params[1], params[2]),
-        'videosViewed': lambda: videos_reviewed_count(params[0])
+        'activeViewer': lambda: get_active_viewers(params[0], params[1], params[2], options.get('limit'), split_cursor(options.get('after'))),
+        'videosViewed': lambda: videos_reviewed_count(params[0]),
+        'batch': lambda: run_batch(params[0] if params else '-', int(options.get('commit-every', 1))),
+        'explain': lambda: explain_queries(),
+        'replicaStatus': lambda: replica_status(),
+        'rebuildAggregates': lambda: rebuild_aggregates(),
+        'cacheStats': lambda: cache_stats(),
+        'profileStats': lambda: profile_stats(options.get('export')),
+        'maintainPartitions': lambda: maintain_partitions(int(options.get('ahead', SESSION_PARTITIONS_AHEAD)),
+                                                          int(options['retain']) if 'retain' in options else None,
+                                                          options.get('archive')),
+        'serve': lambda: serve_commands(options.get('socket', SOCKET_PATH), options.get('cache', 'yes').lower() in ('yes', 'true', '1'))
     }
 
+
+def dispatch(function_name, params, options):
+    # Runs one command from command_table and prints its result
+
+    # --primary yes keeps the command's reads off the replicas
+    primary = options.pop('primary', 'no').lower() in ('yes', 'true', '1')
+
+    # Commands sent by client.py name files relative to the client
+    cwd = getattr(_local, 'client_cwd', None)
+    if cwd is not None:
+        try:
+            params, options = client_paths(function_name, params, options, cwd)
+        except ValueError as error:
+            print(f"Error: {error}")
+            return False
+
+    # Available functions
+    functions = command_table(params, options)
+
     # Run functions
     if function_name in functions:
-        result = functions[function_name]()
+        with primary_reads(primary), profile_command(function_name, params) as profile:
+            result = functions[function_name]()
+            if profile:
+                profile.result = result
+
         if isinstance(result, bool):
             print("Success" if result else "Fail")
+        elif isinstance(result, list):
+            # One line per row for bulk commands
+            for row_result in result:
+                print("Success" if row_result else "Fail")
+        return result
     else:
         print(f"Unknown function entered: {function_name}")
 
 
 
+def main():
+    # Error with user syntax
+    if len(sys.argv) < 2:
+        print("Please use the syntax: python3 project.py <function> [param1] [param2] ...")
+        return
+    
+    function_name = sys.argv[1]     # Collects the function to be executed
+    params, options = split_options(sys.argv[2:])   # Everything after are the parameters and --options
+
+    # --profile <file|-> applies to every command this process runs (all of them under serve)
+    if 'profile' in options:
+        enable_profiling(options.pop('profile'))
+
+    dispatch(function_name, params, options)
+
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
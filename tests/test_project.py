@@ -0,0 +1,521 @@
+import csv
+import datetime
+import hashlib
+
+import mysql.connector
+import pytest
+
+import project
+
+'''
+Checks of the logic that needs no database; the EXPLAIN checks at the end run against the local
+MySQL from DB_CONFIG (after "python3 project.py import test_data") and are skipped without it
+'''
+
+
+@pytest.fixture(autouse=True)
+def schema_options(monkeypatch):
+    # Every test starts from the default options and may change them freely
+    monkeypatch.setattr(project, 'SCHEMA_OPTIONS', dict(project.SCHEMA_OPTIONS))
+
+
+# activeViewer day splitting
+
+def test_active_viewers_plain_without_rollup():
+    query, params = project.active_viewers_query(2, '2025-01-01 10:00:00', '2025-01-05 12:00:00')
+    assert query is project.GET_ACTIVE_VIEWERS
+    assert params == ('2025-01-01 10:00:00', '2025-01-05 12:00:00', 2)
+
+
+def test_active_viewers_rollup_splits_whole_days_from_partial_ends():
+    project.SCHEMA_OPTIONS['session_rollup'] = True
+    start, end = '2025-01-01 10:00:00', '2025-01-05 12:00:00'
+    query, params = project.active_viewers_query(2, start, end)
+
+    assert query is project.GET_ACTIVE_VIEWERS_FROM_ROLLUP
+    assert params == (datetime.date(2025, 1, 2), datetime.date(2025, 1, 4),
+                      start, datetime.datetime(2025, 1, 2),
+                      datetime.datetime(2025, 1, 5), end,
+                      2)
+
+
+def test_active_viewers_rollup_ranges_cover_the_interval_exactly():
+    # [start, first midnight) + whole days + [midnight after the last day, end] must be [start, end]
+    project.SCHEMA_OPTIONS['session_rollup'] = True
+    cases = [
+        ('2025-01-01 00:00:00', '2025-01-03 23:59:59'),
+        ('2025-01-01 00:00:01', '2025-01-03 23:59:58'),
+        ('2025-01-31 23:00:00', '2025-03-01 01:00:00'),
+    ]
+    for start, end in cases:
+        query, params = project.active_viewers_query(1, start, end)
+        first_day, last_day, head_start, head_end, tail_start, tail_end, _ = params
+        assert query is project.GET_ACTIVE_VIEWERS_FROM_ROLLUP
+        assert head_start == start and tail_end == end
+        assert head_end == datetime.datetime.combine(first_day, datetime.time(0))
+        assert tail_start == datetime.datetime.combine(last_day + datetime.timedelta(days=1), datetime.time(0))
+        assert datetime.datetime.fromisoformat(start) <= head_end
+        assert tail_start <= datetime.datetime.fromisoformat(end) + datetime.timedelta(seconds=1)
+
+
+def test_active_viewers_rollup_falls_back_without_a_whole_day():
+    project.SCHEMA_OPTIONS['session_rollup'] = True
+    for start, end in [('2025-01-01 10:00:00', '2025-01-01 12:00:00'),
+                       ('2025-01-01 10:00:00', '2025-01-02 09:00:00'),
+                       ('yesterday', '2025-01-05')]:
+        query, params = project.active_viewers_query(3, start, end)
+        assert query is project.GET_ACTIVE_VIEWERS
+        assert params == (start, end, 3)
+
+
+def test_active_viewers_pages_seek_every_part_past_the_cursor():
+    project.SCHEMA_OPTIONS['session_rollup'] = True
+    query, params = project.active_viewers_query(2, '2025-01-01 10:00:00', '2025-01-05 12:00:00', 10, 42)
+    assert query is project.GET_ACTIVE_VIEWERS_FROM_ROLLUP_AFTER
+    assert params.count(42) == 3
+    assert params[-2:] == (2, 10)
+    assert query.count('%s') == len(params)
+
+    query, params = project.active_viewers_query(2, '2025-01-01', '2025-01-05', 10)
+    assert query is project.GET_ACTIVE_VIEWERS_FROM_ROLLUP_PAGE
+    assert query.count('%s') == len(params)
+
+
+# Load order
+
+def test_load_order_puts_parents_first():
+    dependencies = project.table_dependencies()
+    assert {'Viewers', 'Videos'} <= dependencies['Sessions']
+
+    ordered = project.load_order(list(reversed(list(project.TABLE_CSV))))
+    assert sorted(ordered) == sorted(project.TABLE_CSV)
+    for table in ordered:
+        for parent in dependencies.get(table, set()):
+            if parent in ordered:
+                assert ordered.index(parent) < ordered.index(table)
+
+
+def test_load_order_rejects_cycles(monkeypatch):
+    monkeypatch.setattr(project, 'table_dependencies', lambda: {'A': {'B'}, 'B': {'A'}})
+    with pytest.raises(RuntimeError):
+        project.load_order(['A', 'B'])
+
+
+def test_report_critical_path(capsys):
+    project.report_critical_path({}, {})
+    assert capsys.readouterr().err == ''
+
+    timings = {'Users': (0.0, 1.0), 'Viewers': (1.0, 2.0), 'Producers': (1.0, 4.0), 'Releases': (4.0, 5.0)}
+    project.report_critical_path(timings, project.table_dependencies())
+    assert 'Critical path (5.00s): Users -> Producers -> Releases' in capsys.readouterr().err
+
+
+# Delta deletes
+
+class RecordingCursor:
+    # Keeps the statements it is given; every COUNT(*) reads count
+    def __init__(self, count):
+        self.count = count
+        self.statements = []
+
+    def execute(self, statement, params=None):
+        self.statements.append(' '.join(statement.split()))
+
+    def fetchone(self):
+        return (self.count,)
+
+
+def test_mark_deleted_rows_follows_the_cascades():
+    cursor = RecordingCursor(1)
+    assert set(project.mark_deleted_rows(cursor, ['Videos'])) == {'Videos', 'Sessions'}
+    assert any('FROM Sessions t JOIN gone_Videos g ON t.rid = g.rid AND t.ep_num = g.ep_num' in s for s in cursor.statements)
+
+    cursor = RecordingCursor(1)
+    assert set(project.mark_deleted_rows(cursor, ['Users'])) == set(project.TABLES)
+
+
+def test_mark_deleted_rows_drops_empty_marks():
+    cursor = RecordingCursor(0)
+    assert project.mark_deleted_rows(cursor, ['Users', 'Viewers']) == {}
+    assert cursor.statements[-1] == 'DROP TEMPORARY TABLE gone_Viewers'
+    assert not any('gone_Sessions' in s for s in cursor.statements)
+
+
+# Page cursors
+
+def test_split_cursor():
+    assert project.split_cursor(None) is None
+    assert project.split_cursor('17') == '17'
+    assert project.split_cursor('12,7', 2) == ('12', '7')
+    assert project.split_cursor('Hello, World,7', 2) == ('Hello, World', '7')
+
+
+# Command lines
+
+def test_split_options():
+    assert project.split_options(['5', '--limit', '10', 'x']) == (['5', 'x'], {'limit': '10'})
+    # A trailing --name has no value to take, so it stays a parameter
+    assert project.split_options(['5', '--after']) == (['5', '--after'], {})
+
+
+def test_split_options_stops_at_a_bare_double_dash():
+    assert project.split_options(['--limit', '3', '--', '--draft--', '--limit', '4']) == (['--draft--', '--limit', '4'], {'limit': '3'})
+    assert project.split_options(['--']) == ([], {})
+
+
+def test_client_paths_resolves_relative_paths():
+    params, options = project.client_paths('import', ['data'], {'rejects': 'r.csv', 'state': '/tmp/s.json', 'workers': '2'}, '/home/me')
+    assert params == ['/home/me/data']
+    assert options == {'rejects': '/home/me/r.csv', 'state': '/tmp/s.json', 'workers': '2'}
+
+    # Commands without paths are passed through
+    assert project.client_paths('releaseTitle', ['data'], {}, '/home/me') == (['data'], {})
+
+
+def test_client_paths_tells_uids_from_a_uid_file(tmp_path):
+    (tmp_path / '7').write_text('7\n')
+    assert project.client_paths('deleteViewers', ['7', '8'], {}, str(tmp_path)) == (['7', '8'], {})
+    assert project.client_paths('deleteViewers', ['8'], {}, str(tmp_path)) == (['8'], {})
+    assert project.client_paths('deleteViewers', ['7'], {}, str(tmp_path)) == ([str(tmp_path / '7')], {})
+
+
+def test_client_paths_refuses_stdin():
+    for params in ([], ['-']):
+        with pytest.raises(ValueError):
+            project.client_paths('insertSessions', params, {}, '/home/me')
+
+
+# HyperLogLog
+
+def sketch(uids):
+    # Register -> rank for uids, as the hll_register_sql / hll_rank_sql expressions compute them
+    ranks = {}
+    width = 32 - project.HLL_PRECISION
+    for uid in uids:
+        value = int(hashlib.md5(str(uid).encode()).hexdigest()[:8], 16)
+        register = value & (2 ** project.HLL_PRECISION - 1)
+        rest = value >> project.HLL_PRECISION
+        rank = width + 1 if rest == 0 else width + 1 - len(bin(rest)[2:])
+        ranks[register] = max(ranks.get(register, 0), rank)
+    return ranks
+
+
+def test_hll_estimate_empty():
+    assert project.hll_estimate({}) == 0
+
+
+def test_hll_estimate_small_and_large_counts():
+    assert abs(project.hll_estimate(sketch(range(1, 101))) - 100) <= 5
+
+    # Three standard errors
+    error = 3 * 1.04 / (2 ** project.HLL_PRECISION) ** 0.5
+    estimate = project.hll_estimate(sketch(range(1, 50001)))
+    assert abs(estimate - 50000) <= 50000 * error
+
+
+# QueryCache
+
+def test_query_cache_drops_tagged_entries_only():
+    cache = project.QueryCache()
+    text, version = cache.get(('listReleases', '1'))
+    assert text is None
+    cache.put(('listReleases', '1'), 'a\n', {('uid', '1'), ('rid', '5')}, version)
+    cache.put(('listReleases', '2'), 'b\n', {('uid', '2')}, version)
+
+    cache.invalidate(('rid', '5'))
+    assert cache.get(('listReleases', '1'))[0] is None
+    assert cache.get(('listReleases', '2'))[0] == 'b\n'
+
+
+def test_query_cache_refuses_results_read_before_an_invalidation():
+    cache = project.QueryCache()
+    _, version = cache.get(('releaseTitle', '1'))
+    cache.invalidate(('sid', '1'))
+    cache.put(('releaseTitle', '1'), 'stale\n', {('sid', '1')}, version)
+    assert cache.get(('releaseTitle', '1'))[0] is None
+
+
+def test_query_cache_expires_and_evicts():
+    cache = project.QueryCache(max_entries=2, ttl=-1)
+    cache.put(('a',), 'a', set(), 0)
+    assert cache.get(('a',))[0] is None
+
+    cache = project.QueryCache(max_entries=2)
+    for key in ('a', 'b', 'c'):
+        cache.put((key,), key, set(), 0)
+    assert cache.get(('a',))[0] is None
+    assert cache.get(('c',))[0] == 'c'
+
+
+# Resumable reads
+
+def test_read_csv_from_resumes_at_an_offset(tmp_path):
+    path = tmp_path / 'reviews.csv'
+    path.write_bytes(b'rvid,body\n1,"two\nlines"\n\n2,plain\n3,\n')
+
+    rows = list(project.read_csv_from(str(path)))
+    assert [row for row, _ in rows] == [['1', 'two\nlines'], ['2', 'plain'], ['3', None]]
+
+    offsets = [offset for _, offset in rows]
+    assert [row for row, _ in project.read_csv_from(str(path), offsets[0])] == [['2', 'plain'], ['3', None]]
+    assert list(project.read_csv_from(str(path), offsets[-1])) == []
+
+
+# User genres
+
+def test_split_genres_keeps_case_and_drops_exact_repeats():
+    # addGenre 1 romance still adds a genre next to an imported 'Romance'
+    assert project.split_genres(' Romance;Drama;;Romance; romance ') == ['Romance', 'Drama', 'romance']
+    assert project.split_genres(None) == []
+    assert project.split_genres('') == []
+
+
+# Trusted imports
+
+CSV_FILES = {
+    'users.csv': 'uid,email,joined_date,nickname,street,city,state,zip,genres\n'
+                 '1,a@example.org,2024-01-01,a,,,,,Drama\n'
+                 '2,b@example.org,2024-01-01,b,,,,,\n'
+                 '3,c@example.org,2024-01-01,c,,,,,Comedy;Drama\n',
+    'producers.csv': 'uid,bio,company\n1,,Acme\n',
+    'viewers.csv': 'uid,subscription,first_name,last_name\n2,free,B,Bee\n3,monthly,C,Cee\n',
+    'releases.csv': 'rid,producer_uid,title,genre,release_date\n1,1,One,Drama,2024-02-01\n',
+    'videos.csv': 'rid,ep_num,title,length\n1,1,Pilot,40\n',
+    'sessions.csv': 'sid,uid,rid,ep_num,initiate_at,leave_at,quality,device\n'
+                    '1,2,1,1,2025-01-01 10:00:00,2025-01-01 11:00:00,720p,mobile\n',
+    'reviews.csv': 'rvid,uid,rid,rating,body,posted_at\n1,3,1,4,Good,2025-01-02 10:00:00\n',
+}
+
+
+def validate(tmp_path, **changes):
+    # Writes CSV_FILES (with a file's lines appended from changes) and validates them
+    # Returns (rows rejected, rejects file rows, clean folder)
+    source, clean = tmp_path / 'in', tmp_path / 'clean'
+    source.mkdir()
+    clean.mkdir()
+    for name, text in CSV_FILES.items():
+        (source / name).write_text(text + changes.get(name.replace('.csv', ''), ''))
+
+    rejects = tmp_path / 'rejects.csv'
+    rejected = project.validate_csv_files(str(source), str(clean), str(rejects))
+    with open(rejects, newline='') as file:
+        return rejected, list(csv.reader(file)), clean
+
+
+def test_validate_csv_files_keeps_clean_files_unchanged(tmp_path):
+    rejected, rejects, clean = validate(tmp_path)
+    assert rejected == 0
+    assert rejects == [['file', 'line', 'reason']]
+    for name, text in CSV_FILES.items():
+        assert (clean / name).read_text() == text
+
+
+def test_validate_csv_files_rejects_orphans_and_their_children(tmp_path):
+    rejected, rejects, clean = validate(
+        tmp_path,
+        viewers='9,free,No,User\n',
+        sessions='2,9,1,1,2025-01-01 10:00:00,2025-01-01 11:00:00,,\n3,2,1,7,2025-01-01 10:00:00,2025-01-01 11:00:00,,\n',
+    )
+    assert rejected == 3
+    assert rejects[1:] == [
+        ['viewers.csv', '4', 'no Users row for 9', '9', 'free', 'No', 'User'],
+        ['sessions.csv', '3', 'no Viewers row for 9', '2', '9', '1', '1', '2025-01-01 10:00:00', '2025-01-01 11:00:00', '', ''],
+        ['sessions.csv', '4', 'no Videos row for 1,7', '3', '2', '1', '7', '2025-01-01 10:00:00', '2025-01-01 11:00:00', '', ''],
+    ]
+    assert (clean / 'sessions.csv').read_text() == CSV_FILES['sessions.csv']
+
+
+def test_validate_csv_files_rejects_duplicate_keys_and_bad_widths(tmp_path):
+    rejected, rejects, clean = validate(
+        tmp_path,
+        users='1,again@example.org,2024-01-01,again,,,,,\n4,short@example.org\n',
+        videos='1,1,Pilot again,40\n1,2,Second,40,extra\n',
+    )
+    assert rejected == 4
+    assert [row[:3] for row in rejects[1:]] == [
+        ['users.csv', '5', 'duplicate Users key'],
+        ['users.csv', '6', 'expected 9 fields'],
+        ['videos.csv', '3', 'duplicate Videos key'],
+        ['videos.csv', '4', 'expected 4 fields'],
+    ]
+    assert (clean / 'users.csv').read_text() == CSV_FILES['users.csv']
+    assert (clean / 'videos.csv').read_text() == CSV_FILES['videos.csv']
+
+
+# Session inserts
+
+class SessionCursor:
+    # Answers the reference checks of insert_session_batch from sets and keeps the inserted rows
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+
+    def execute(self, statement, params=None):
+        database = self.connection
+        if 'FROM Viewers' in statement:
+            self.rows = [(uid,) for uid in params if int(uid) in database.viewers]
+        elif 'FROM Videos' in statement:
+            pairs = zip(params[::2], params[1::2])
+            self.rows = [pair for pair in pairs if (int(pair[0]), int(pair[1])) in database.videos]
+        elif 'FROM Sessions' in statement:
+            self.rows = [(sid,) for sid in params if int(sid) in database.sids]
+
+    def executemany(self, statement, rows):
+        self.connection.batches.append([row[0] for row in rows])
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class SessionConnection:
+    def __init__(self):
+        self.viewers, self.videos, self.sids = {2, 3}, {(1, 1)}, {1}
+        self.batches = []
+        self.commits = 0
+
+    def cursor(self):
+        return SessionCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def close(self):
+        pass
+
+
+def session_row(sid, uid=2, rid=1, ep_num=1):
+    return [str(sid), str(uid), str(rid), str(ep_num), '2025-01-01 10:00:00', '2025-01-01 11:00:00', '720p', 'mobile']
+
+
+def test_insert_session_batch_checks_references_once_per_batch():
+    connection = SessionConnection()
+    rows = [session_row(2), session_row(1), session_row(3, uid=9), session_row(4, ep_num=2),
+            session_row(2, uid=3), ['5', '2'], session_row('x'), session_row(6, uid=3)]
+    assert project.insert_session_batch(connection.cursor(), rows) == [True, False, False, False, False, False, False, True]
+    assert connection.batches == [['2', '6']]
+
+
+def test_insert_sessions_commits_a_partial_final_batch(monkeypatch):
+    connection = SessionConnection()
+    monkeypatch.setattr(project, 'connect', lambda *args, **kwargs: connection)
+    rows = [session_row(sid) for sid in (2, 3, 1, 4, 5)]
+    assert project.insert_sessions(rows, batch_size=2) == [True, True, False, True, True]
+    assert connection.batches == [['2', '3'], ['4'], ['5']]
+    assert connection.commits == 3
+
+
+# Bulk deletes
+
+def test_read_uids_from_arguments_or_a_file(tmp_path):
+    assert list(project.read_uids(['4', '5'])) == ['4', '5']
+    assert list(project.read_uids(['4'])) == ['4']
+
+    path = tmp_path / 'uids.txt'
+    path.write_text('4\n\n  5 \n4\n   \n')
+    # Blank lines are skipped; a repeated uid is kept and fails like a second deleteViewer
+    assert list(project.read_uids([str(path)])) == ['4', '5', '4']
+
+
+def test_row_throttle_paces_to_the_rate(monkeypatch):
+    clock = [100.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        clock[0] += seconds
+
+    monkeypatch.setattr(project.time, 'monotonic', lambda: clock[0])
+    monkeypatch.setattr(project.time, 'sleep', sleep)
+
+    throttle = project.RowThrottle(100)
+    throttle.wait(50)
+    assert sleeps == [0.5]
+    clock[0] += 2.0             # Slow work since: no wait owed for the next 100 rows
+    throttle.wait(100)
+    assert sleeps == [0.5]
+    throttle.wait(200)
+    assert sleeps == [0.5, 1.0]
+    assert throttle.rate() == 100
+
+    unlimited = project.RowThrottle(0)
+    unlimited.wait(10 ** 6)
+    assert sleeps == [0.5, 1.0]
+
+
+# Session partitions
+
+def test_partition_months():
+    assert project.add_months(datetime.date(2024, 11, 15), 3) == datetime.date(2025, 2, 1)
+    assert project.add_months(datetime.date(2024, 1, 31), -1) == datetime.date(2023, 12, 1)
+    assert project.partition_name(datetime.date(2025, 2, 1)) == 'p202502'
+
+
+def test_sessions_command_partitions_by_month():
+    assert project.sessions_command() is project.TABLES["Sessions"]
+
+    project.SCHEMA_OPTIONS['partition_sessions'] = True
+    command = project.sessions_command()
+    last = project.add_months(datetime.date.today(), project.SESSION_PARTITIONS_AHEAD)
+    assert "PARTITION p_before VALUES LESS THAN ('2024-01-01')" in command
+    assert project.partition_definition(project.SESSION_PARTITION_START) in command
+    assert project.partition_definition(last) in command
+    assert "PARTITION p_future VALUES LESS THAN (MAXVALUE)" in command
+
+
+# Query plans, against the local database
+
+@pytest.fixture(scope='module')
+def database():
+    try:
+        connection = mysql.connector.connect(**project.DB_CONFIG, connection_timeout=2)
+    except mysql.connector.Error as error:
+        pytest.skip(f"MySQL not reachable: {error}")
+
+    cursor = connection.cursor()
+    cursor.execute("SHOW TABLES LIKE 'Sessions'")
+    loaded = cursor.fetchall()
+    cursor.close()
+    connection.close()
+    if not loaded:
+        pytest.skip("No tables, run: python3 project.py import test_data")
+
+    yield
+    project.get_pool().close()
+
+
+def test_query_plans_use_indexes(database):
+    # Every scan counts here: test_data is far smaller than EXPLAIN_SCAN_ROWS
+    assert project.check_query_plans(min_rows=0) == []
+
+
+def test_query_plans_report_a_full_scan(database, monkeypatch):
+    # Reviews.body has no index, so the check has to flag the lookup
+    monkeypatch.setattr(project, 'EXPLAIN_QUERIES', {'bodySearch': ("SELECT rvid FROM Reviews WHERE body = %s", ('x',), set())})
+    assert [(command, table) for command, table, _ in project.check_query_plans(min_rows=0)] == [('bodySearch', 'Reviews')]
+
+
+def test_active_viewer_reads_one_partition(database):
+    # With a partitioned Sessions, a one-month activeViewer range must be pruned to that month
+    connection = mysql.connector.connect(**project.DB_CONFIG)
+    cursor = connection.cursor(dictionary=True)
+    try:
+        plain = connection.cursor()
+        partitions = project.session_partitions(plain)
+        plain.close()
+        if not partitions:
+            pytest.skip("Sessions is not partitioned")
+
+        cursor.execute("EXPLAIN " + project.GET_ACTIVE_VIEWERS, ('2025-01-01', '2025-01-31 23:59:59', 1))
+        steps = [step for step in cursor.fetchall() if step['partitions']]
+    finally:
+        cursor.close()
+        connection.close()
+
+    assert steps
+    assert all(step['partitions'] == 'p202501' for step in steps)
+
+    project.SCHEMA_OPTIONS['partition_sessions'] = True
+    assert not [scan for scan in project.check_query_plans() if 'partitions' in str(scan[2])]